@@ -11,8 +11,8 @@ def is_admin(user_id: int) -> bool:
 
 def get_admin_commands() -> list:
     """Возвращает список команд для администраторов"""
-    return ['start', 'delete', 'debug', 'stats']
+    return ['start', 'delete', 'search', 'export', 'groups', 'group_create', 'group_join', 'debug', 'stats', 'profile', 'vocab_add', 'vocab_reload', 'backup', 'restore']
 
 def get_user_commands() -> list:
     """Возвращает список команд для обычных пользователей"""
-    return ['start', 'delete']
\ No newline at end of file
+    return ['start', 'delete', 'search', 'export', 'groups', 'group_create', 'group_join']
\ No newline at end of file
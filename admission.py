@@ -0,0 +1,129 @@
+# admission.py
+"""
+Допуск входящих апдейтов до обработчиков.
+
+Каждый апдейт сначала проходит дешёвые проверки — ведро токенов
+пользователя и длина текста, — и только потом доходит до разбора
+(extract_with_spacy с запасным разбором dateutil), базы и ответа.
+Так один пользователь, засыпающий бота длинными текстами, не отнимает
+время у остальных: лишнее отбрасывается за пару сравнений.
+"""
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Ведро токенов: в среднем RATE_PER_SECOND апдейтов в секунду,
+# всплеском — до BURST подряд (пересланная пачка сообщений, листание кнопок)
+RATE_PER_SECOND = 0.5
+BURST = 10
+
+# Длиннее описание события не бывает; всё, что больше, — не к парсеру
+MAX_MESSAGE_LENGTH = 1000
+
+# Сколько вёдер держать в памяти; сверх этого выбрасываются давно молчавшие
+MAX_TRACKED_USERS = 10000
+
+# Причины отказа (они же ключи счётчиков)
+TOO_LONG = "too_long"
+THROTTLED = "throttled"
+
+
+class TokenBucket:
+    """Ведро токенов одного пользователя"""
+
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, now: float):
+        self.tokens = float(BURST)
+        self.updated = now
+        # Предупреждение о лимите уже отправлено (не отвечаем на каждое лишнее)
+        self.warned = False
+
+    def refill(self, now: float):
+        self.tokens = min(BURST, self.tokens + (now - self.updated) * RATE_PER_SECOND)
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        """Забирает токен; False, если ведро пусто"""
+        self.refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+# Порядок — от давно молчавших к недавним (LRU)
+_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+_counters: Counter = Counter()
+
+
+def _get_bucket(user_id: int, now: float) -> TokenBucket:
+    """Ведро пользователя; при переполнении вытесняет самое давнее"""
+    bucket = _buckets.get(user_id)
+    if bucket is not None:
+        _buckets.move_to_end(user_id)
+        return bucket
+    if len(_buckets) >= MAX_TRACKED_USERS:
+        _buckets.popitem(last=False)
+    bucket = _buckets[user_id] = TokenBucket(now)
+    return bucket
+
+
+def _message_length(update: Update) -> int:
+    """Длина текста или подписи входящего сообщения.
+
+    Только message/edited_message: у нажатия кнопки effective_message —
+    сообщение самого бота, и его длина к пользователю отношения не имеет.
+    """
+    message = update.message or update.edited_message
+    if message is None:
+        return 0
+    return len(message.text or message.caption or "")
+
+
+def check_update(update: Update, now: Optional[float] = None) -> Optional[str]:
+    """Причина отказа (TOO_LONG / THROTTLED) или None, если апдейт допущен"""
+    user = update.effective_user
+    if user is None:
+        return None
+    now = time.monotonic() if now is None else now
+
+    bucket = _get_bucket(user.id, now)
+
+    # Сначала ведро: поток длинных сообщений тоже упирается в лимит
+    if not bucket.take(now):
+        _counters[THROTTLED] += 1
+        return THROTTLED
+    bucket.warned = False
+
+    if _message_length(update) > MAX_MESSAGE_LENGTH:
+        _counters[TOO_LONG] += 1
+        return TOO_LONG
+
+    _counters["admitted"] += 1
+    return None
+
+
+def should_warn(user_id: int) -> bool:
+    """Отвечать ли на отказ по лимиту: только на первый подряд"""
+    bucket = _buckets.get(user_id)
+    if bucket is None or bucket.warned:
+        return False
+    bucket.warned = True
+    logger.warning(f"Пользователь {user_id} превысил лимит частоты сообщений")
+    return True
+
+
+def get_counters() -> Dict[str, int]:
+    """Счётчики допуска с момента запуска: admitted, throttled, too_long, users"""
+    return {
+        "admitted": _counters["admitted"],
+        THROTTLED: _counters[THROTTLED],
+        TOO_LONG: _counters[TOO_LONG],
+        "users": len(_buckets),
+    }
@@ -0,0 +1,237 @@
+# backup.py
+"""
+Резервные копии events.db без остановки бота.
+
+Копия снимается онлайн-API SQLite (Connection.backup) небольшими
+порциями страниц в отдельном потоке. Между порциями блокировка чтения
+снимается, и обработчики успевают записать свои изменения; если база
+изменилась посреди копирования, SQLite сам начинает проход заново, так
+что копия всегда согласована. Просто скопировать файл нельзя: запись
+посреди копирования даёт битую базу.
+
+Копия пишется во временный файл, проверяется PRAGMA integrity_check и
+только потом получает своё имя, поэтому в BACKUP_DIR лежат лишь целые
+копии. Старые копии сверх BACKUP_KEEP удаляются.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import clock
+import database
+from config import BACKUP_DIR, BACKUP_INTERVAL_HOURS, BACKUP_KEEP
+
+logger = logging.getLogger(__name__)
+
+# Страниц за один шаг и пауза между шагами (секунды)
+BACKUP_PAGES = 256
+BACKUP_STEP_SLEEP = 0.01
+# Сколько раз копия может начаться заново из-за записи, прежде чем
+# попробовать снова после паузы с шагом вдвое больше (иначе при частой
+# записи она не кончится); всего попыток BACKUP_ATTEMPTS
+BACKUP_MAX_RESTARTS = 3
+BACKUP_ATTEMPTS = 4
+BACKUP_RETRY_SLEEP = 1.0
+
+BACKUP_PREFIX = "events-"
+BACKUP_SUFFIX = ".db"
+
+# Копирование и восстановление не должны идти одновременно
+_lock = asyncio.Lock()
+
+
+def _backup_name(moment: datetime) -> str:
+    return f"{BACKUP_PREFIX}{moment.strftime('%Y%m%d-%H%M%S-%f')}{BACKUP_SUFFIX}"
+
+
+def _new_backup_path(moment: datetime) -> str:
+    """Путь для новой копии; существующую копию os.replace не перезапишет"""
+    path = os.path.join(BACKUP_DIR, _backup_name(moment))
+    # Часы могут стоять (FixedClock) — сдвигаемся, сохраняя порядок имён
+    while os.path.exists(path):
+        moment += timedelta(microseconds=1)
+        path = os.path.join(BACKUP_DIR, _backup_name(moment))
+    return path
+
+
+def list_backups() -> List[str]:
+    """Имена копий в BACKUP_DIR, от новых к старым"""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    names = [name for name in os.listdir(BACKUP_DIR)
+             if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)]
+    # Дата в имени, так что порядок имён — порядок времени
+    return sorted(names, reverse=True)
+
+
+def check_integrity(path: str) -> bool:
+    """PRAGMA integrity_check для файла базы"""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            result = conn.execute("PRAGMA integrity_check").fetchone()
+        finally:
+            conn.close()
+        return result is not None and result[0] == "ok"
+    except sqlite3.Error as e:
+        logger.error(f"Проверка {path} не удалась: {e}")
+        return False
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy_once(src: sqlite3.Connection, dst: sqlite3.Connection, pages: int, sleep: float):
+    """Один проход онлайн-копии; _TooManyRestarts, если он слишком часто начинается заново"""
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        # Осталось больше, чем на прошлом шаге, — SQLite начал заново
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _TooManyRestarts
+        last_remaining = remaining
+
+    src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+
+
+def _copy(src_path: str, dst_path: str, pages: int, sleep: float):
+    """Онлайн-копия src_path в dst_path порциями по pages страниц.
+
+    Если база меняется так часто, что копия раз за разом начинается
+    заново, после паузы пробуем снова с шагом вдвое больше. Блокировка
+    чтения при этом держится не дольше одного шага, а не на всю базу.
+    """
+    # Только чтение: отсутствующий файл не должен молча стать пустой базой
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True)
+    dst = sqlite3.connect(dst_path)
+    try:
+        for attempt in range(1, BACKUP_ATTEMPTS + 1):
+            try:
+                _copy_once(src, dst, pages, sleep)
+                return
+            except _TooManyRestarts:
+                logger.info(f"База {src_path} меняется слишком часто (попытка {attempt}, шаг {pages} страниц)")
+            if attempt < BACKUP_ATTEMPTS:
+                time.sleep(BACKUP_RETRY_SLEEP * attempt)
+                pages *= 2
+        raise sqlite3.OperationalError(f"копия {src_path} не снята: база меняется слишком часто")
+    finally:
+        dst.close()
+        src.close()
+
+
+def rotate_backups(keep: int = BACKUP_KEEP) -> List[str]:
+    """Удаляет копии сверх keep самых новых; возвращает удалённые имена"""
+    removed = []
+    for name in list_backups()[keep:]:
+        try:
+            os.remove(os.path.join(BACKUP_DIR, name))
+            removed.append(name)
+        except OSError as e:
+            logger.error(f"Не удалось удалить старую копию {name}: {e}")
+    return removed
+
+
+def create_backup(pages: int = BACKUP_PAGES, sleep: float = BACKUP_STEP_SLEEP,
+                  rotate: bool = True) -> Optional[str]:
+    """Снимает копию базы и (если rotate) удаляет старые; путь к копии или None"""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    path = _new_backup_path(clock.now())
+    partial = path + ".part"
+    try:
+        _copy(database.DB_PATH, partial, pages, sleep)
+        if not check_integrity(partial):
+            logger.error(f"Копия {partial} не прошла integrity_check")
+            os.remove(partial)
+            return None
+        os.replace(partial, path)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Ошибка резервного копирования: {e}")
+        if os.path.exists(partial):
+            os.remove(partial)
+        return None
+
+    removed = rotate_backups() if rotate else []
+    logger.info(f"Резервная копия {path}, удалено старых: {len(removed)}")
+    return path
+
+
+def restore_backup(name: str) -> bool:
+    """Заменяет содержимое базы копией name.
+
+    Перед заменой снимается свежая копия текущей базы, чтобы
+    восстановление можно было откатить. Запись в базу на время
+    замены блокируется целиком.
+    """
+    if os.path.basename(name) != name or name not in list_backups():
+        logger.error(f"Копия {name!r} не найдена")
+        return False
+    path = os.path.join(BACKUP_DIR, name)
+    if not check_integrity(path):
+        logger.error(f"Копия {name} не прошла integrity_check, восстановление отменено")
+        return False
+    # Без ротации: иначе она может удалить ту самую копию, из которой восстанавливаем
+    if create_backup(rotate=False) is None:
+        logger.error("Не удалось сохранить текущую базу, восстановление отменено")
+        return False
+
+    try:
+        # Одним шагом: промежуточная смесь старой и новой базы никому не нужна
+        _copy(path, database.DB_PATH, pages=-1, sleep=0)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка восстановления из {name}: {e}")
+        return False
+
+    # Копия могла быть снята до появления новых таблиц
+    database.init_db()
+    # Счётчики версий откатились вместе с базой: новая эпоха не даст
+    # подписке выдать старый ETag за новое содержимое, а новая версия
+    # с текущим временем — ответить 304 по If-Modified-Since
+    database.renew_epoch()
+    database.bump_all_user_versions()
+    logger.info(f"База восстановлена из {name}")
+    return True
+
+
+async def backup_now() -> Optional[str]:
+    """create_backup в отдельном потоке, не блокируя обработчики"""
+    async with _lock:
+        return await asyncio.to_thread(create_backup)
+
+
+async def restore_now(name: str) -> bool:
+    """restore_backup в отдельном потоке"""
+    async with _lock:
+        return await asyncio.to_thread(restore_backup, name)
+
+
+def _next_delay(interval: timedelta) -> float:
+    """Секунды до следующей копии: interval от самой свежей из имеющихся"""
+    backups = list_backups()
+    if not backups:
+        return 0
+    age = clock.now().timestamp() - os.path.getmtime(os.path.join(BACKUP_DIR, backups[0]))
+    return max(0.0, interval.total_seconds() - age)
+
+
+async def backup_loop(interval: timedelta = timedelta(hours=BACKUP_INTERVAL_HOURS)):
+    """Копия базы каждые interval; после перезапуска отсчёт идёт от последней копии"""
+    delay = _next_delay(interval)
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await backup_now()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка фонового резервного копирования: {e}", exc_info=e)
+        delay = interval.total_seconds()
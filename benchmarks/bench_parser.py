@@ -0,0 +1,159 @@
+# benchmarks/bench_parser.py
+"""
+Бенчмарк и проверка точности парсера на размеченном корпусе.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_parser
+    python -m benchmarks.bench_parser --baseline benchmarks/parser_baseline.json
+    python -m benchmarks.bench_parser --update-baseline
+
+Если точность любого поля опустилась ниже базовой (или пропускная
+способность ниже --min-throughput), скрипт завершается с кодом 1.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import clock
+import parser
+from benchmarks.corpus import CORPUS, REFERENCE_NOW
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "parser_baseline.json")
+
+
+# Извлекатели, которые измеряем по отдельности
+EXTRACTORS: Dict[str, Callable] = {
+    "extract_datetime": parser.extract_datetime,
+    "extract_location_improved": parser.extract_location_improved,
+    "extract_dances_simple": parser.extract_dances_simple,
+    "extract_with_spacy": parser.extract_with_spacy,
+}
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """Перцентиль по уже отсортированному списку (nearest-rank)"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def measure(func: Callable, texts: List[str], rounds: int) -> Dict[str, float]:
+    """Прогоняет func по всем текстам rounds раз и считает задержки"""
+    # Прогрев: компиляция регулярных выражений, кэши и т.п.
+    for text in texts:
+        func(text)
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            t0 = time.perf_counter_ns()
+            func(text)
+            latencies.append(time.perf_counter_ns() - t0)
+    total = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "messages_per_second": len(latencies) / total if total else 0.0,
+        "p50_us": _percentile(latencies, 50) / 1000,
+        "p99_us": _percentile(latencies, 99) / 1000,
+    }
+
+
+def evaluate_accuracy() -> Tuple[Dict[str, float], List[tuple]]:
+    """Считает точность по каждому полю на корпусе"""
+    hits = {"datetime": 0, "location": 0, "dances": 0, "recurrence": 0}
+    true_positive = false_positive = false_negative = 0
+    mistakes = []
+
+    for case in CORPUS:
+        result = parser.extract_with_spacy(case["text"])
+        got_dances = set(result["dances"])
+
+        for field, got in (("datetime", result["datetime"]),
+                           ("location", result["location"]),
+                           ("dances", got_dances),
+                           ("recurrence", result["recurrence"])):
+            expected = case.get(field)
+            if got == expected:
+                hits[field] += 1
+            else:
+                mistakes.append((case["text"], field, expected, got))
+
+        true_positive += len(got_dances & case["dances"])
+        false_positive += len(got_dances - case["dances"])
+        false_negative += len(case["dances"] - got_dances)
+
+    total = len(CORPUS)
+    accuracy = {field: count / total for field, count in hits.items()}
+    accuracy["dances_precision"] = true_positive / ((true_positive + false_positive) or 1)
+    accuracy["dances_recall"] = true_positive / ((true_positive + false_negative) or 1)
+    return accuracy, mistakes
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Бенчмарк парсера объявлений")
+    arg_parser.add_argument("--rounds", type=int, default=200,
+                            help="сколько раз прогнать корпус для замера скорости")
+    arg_parser.add_argument("--baseline", default=None,
+                            help="JSON с базовой точностью; ниже неё — ошибка")
+    arg_parser.add_argument("--update-baseline", action="store_true",
+                            help="записать текущую точность как базовую")
+    arg_parser.add_argument("--min-throughput", type=float, default=0.0,
+                            help="минимум сообщений/с для extract_with_spacy")
+    arg_parser.add_argument("--verbose", action="store_true",
+                            help="показать все расхождения с разметкой")
+    args = arg_parser.parse_args(argv)
+
+    clock.set_clock(clock.FixedClock(REFERENCE_NOW))
+    texts = [case["text"] for case in CORPUS]
+
+    print(f"Корпус: {len(texts)} сообщений, now = {REFERENCE_NOW.isoformat()}\n")
+    print(f"{'функция':<28}{'сообщ./с':>12}{'p50, мкс':>12}{'p99, мкс':>12}")
+    timings = {}
+    for name, func in EXTRACTORS.items():
+        timings[name] = measure(func, texts, args.rounds)
+        t = timings[name]
+        print(f"{name:<28}{t['messages_per_second']:>12.0f}{t['p50_us']:>12.1f}{t['p99_us']:>12.1f}")
+
+    accuracy, mistakes = evaluate_accuracy()
+    print("\nТочность:")
+    for field, value in accuracy.items():
+        print(f"  {field:<18}{value:.3f}")
+
+    if args.verbose and mistakes:
+        print("\nРасхождения:")
+        for text, field, expected, got in mistakes:
+            print(f"  [{field}] {text!r}: ожидалось {expected!r}, получено {got!r}")
+
+    if args.update_baseline:
+        path = args.baseline or DEFAULT_BASELINE
+        with open(path, "w", encoding="utf-8", newline="\r\n") as f:
+            json.dump({"accuracy": accuracy}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nБазовая точность записана в {path}")
+        return 0
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["accuracy"]
+        for field, expected in baseline.items():
+            if accuracy.get(field, 0.0) + 1e-9 < expected:
+                print(f"❌ Точность {field} упала: {accuracy.get(field, 0.0):.3f} < {expected:.3f}")
+                failed = True
+
+    throughput = timings["extract_with_spacy"]["messages_per_second"]
+    if throughput < args.min_throughput:
+        print(f"❌ Пропускная способность {throughput:.0f} < {args.min_throughput:.0f} сообщ./с")
+        failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+# benchmarks/corpus.py
+"""
+Размеченный корпус объявлений для проверки парсера.
+
+Все ожидаемые даты посчитаны относительно REFERENCE_NOW (понедельник),
+поэтому результаты не зависят от текущего времени.
+"""
+from datetime import datetime
+
+# Фиксированное «сейчас» для всех прогонов
+REFERENCE_NOW = datetime(2025, 11, 10, 10, 0)
+
+# text — текст сообщения, datetime — ожидаемая дата (None, если её нет
+# или она в прошлом), location — каноническое место, dances — танцы,
+# recurrence — правило повторения (если не указано, ожидается None)
+CORPUS = [
+    {
+        "text": "Завтра в 19:00 в Троицком танцуем вальс",
+        "datetime": datetime(2025, 11, 11, 19, 0),
+        "location": "Троицкий",
+        "dances": {"Вальс"},
+    },
+    {
+        "text": "20 ноября в 18:30 концерт в БКЗ, танцуем Барыню и Шумиху",
+        "datetime": datetime(2025, 11, 20, 18, 30),
+        "location": "БКЗ",
+        "dances": {"Барыня", "Шумиха"},
+    },
+    {
+        "text": "Послезавтра репетиция в Максиме в 17:00",
+        "datetime": datetime(2025, 11, 12, 17, 0),
+        "location": "Максим",
+        "dances": set(),
+    },
+    {
+        "text": "В субботу в 12 ч выступаем в ДК Горького: Сюиту и Белый вальс",
+        "datetime": datetime(2025, 11, 15, 12, 0),
+        "location": "ДК Горького",
+        "dances": {"Сюита", "Белый вальс"},
+    },
+    {
+        "text": "5 декабря начало в 13:00, КДЦ Московский, Цветная круговерть",
+        "datetime": datetime(2025, 12, 5, 13, 0),
+        "location": "КДЦ Московский",
+        "dances": {"Цветная круговерть"},
+    },
+    {
+        "text": "Сегодня в 20:00 на улица Попова танцуем Снегирей",
+        "datetime": datetime(2025, 11, 10, 20, 0),
+        "location": "Улица Попова",
+        "dances": {"Снегири"},
+    },
+    {
+        "text": "Во вторник в 19 часов в Московском репетиция Семеновны и Дробушки",
+        "datetime": datetime(2025, 11, 11, 19, 0),
+        "location": "Московский",
+        "dances": {"Семеновна", "Дробушки"},
+    },
+    {
+        "text": "1 января в 15:00 новогодний концерт, Победная пляска",
+        "datetime": datetime(2026, 1, 1, 15, 0),
+        "location": None,
+        "dances": {"Победная пляска"},
+    },
+    {
+        "text": "В пятницу адрес: Советская 25, танцуем Яблочко",
+        "datetime": datetime(2025, 11, 14, 13, 0),
+        "location": "Адрес: Советская 25",
+        "dances": {"Морской"},
+    },
+    {
+        "text": "Концерт 15 декабря в Троицком",
+        "datetime": datetime(2025, 12, 15, 13, 0),
+        "location": "Троицкий",
+        "dances": set(),
+    },
+    {
+        "text": "Завтра Скакалки и Соперницы",
+        "datetime": datetime(2025, 11, 11, 13, 0),
+        "location": None,
+        "dances": {"Скакалки", "Соперницы"},
+    },
+    {
+        "text": "Завтра в 18:00 танцуем Ярмарочную круговерть в БКЗ",
+        "datetime": datetime(2025, 11, 11, 18, 0),
+        "location": "БКЗ",
+        "dances": {"Ярмарочная круговерть"},
+    },
+    {
+        "text": "В воскресенье в 11:00 фестиваль, Детинушка",
+        "datetime": datetime(2025, 11, 16, 11, 0),
+        "location": None,
+        "dances": {"Детинушка"},
+    },
+    {
+        "text": "В 21:00 ул. Ленина, Сапожники",
+        "datetime": datetime(2025, 11, 10, 21, 0),
+        "location": "Улица Ленина",
+        "dances": {"Сапожники"},
+    },
+    {
+        "text": "30 ноября в 19 ч 30 мин Школьный вальс в Максиме",
+        "datetime": datetime(2025, 11, 30, 19, 30),
+        "location": "Максим",
+        "dances": {"Школьный вальс"},
+    },
+    {
+        "text": "привет как дела",
+        "datetime": None,
+        "location": None,
+        "dances": set(),
+    },
+    {
+        "text": "Сегодня в 9:00 в Троицком",
+        "datetime": None,
+        "location": "Троицкий",
+        "dances": set(),
+    },
+    {
+        "text": "В четверг Заигрыши и Россияночка в 18:00",
+        "datetime": datetime(2025, 11, 13, 18, 0),
+        "location": None,
+        "dances": {"Заигрыши", "Россияночка"},
+    },
+    {
+        "text": "В среду Субботея, Московский, 19:30",
+        "datetime": datetime(2025, 11, 12, 19, 30),
+        "location": "Московский",
+        "dances": {"Субботея"},
+    },
+    {
+        "text": "Танцуем Морской 3 декабря в 16:00 в ДК Горького",
+        "datetime": datetime(2025, 12, 3, 16, 0),
+        "location": "ДК Горького",
+        "dances": {"Морской"},
+    },
+    {
+        "text": "Сегодня в 19:00 в Троицком, Барыня",
+        "datetime": datetime(2025, 11, 10, 19, 0),
+        "location": "Троицкий",
+        "dances": {"Барыня"},
+    },
+    {
+        "text": "12 декабря в 18 часов БКЗ, Вальс",
+        "datetime": datetime(2025, 12, 12, 18, 0),
+        "location": "БКЗ",
+        "dances": {"Вальс"},
+    },
+    {
+        "text": "В понедельник в 17:00 репетиция в КДЦ Московском",
+        "datetime": datetime(2025, 11, 17, 17, 0),
+        "location": "КДЦ Московский",
+        "dances": set(),
+    },
+    {
+        "text": "Дробушки и Сапожники послезавтра в 18:00 в Максиме",
+        "datetime": datetime(2025, 11, 12, 18, 0),
+        "location": "Максим",
+        "dances": {"Дробушки", "Сапожники"},
+    },
+    {
+        "text": "25 декабря в 14:00 ёлка в Троицком, танцуем Снегирей и Белый вальс",
+        "datetime": datetime(2025, 12, 25, 14, 0),
+        "location": "Троицкий",
+        "dances": {"Снегири", "Белый вальс"},
+    },
+    # Опечатки и непредусмотренные падежи
+    {
+        "text": "Завтра в 19:00 в Трицком репетируем Барыни",
+        "datetime": datetime(2025, 11, 11, 19, 0),
+        "location": "Троицкий",
+        "dances": {"Барыня"},
+    },
+    {
+        "text": "20 ноября в 18:00 концерт в Максиме, Сапожнеки и Дробушке",
+        "datetime": datetime(2025, 11, 20, 18, 0),
+        "location": "Максим",
+        "dances": {"Сапожники", "Дробушки"},
+    },
+    {
+        "text": "В четверг в 18:00 в Московскм, Семеновны и Снегирей",
+        "datetime": datetime(2025, 11, 13, 18, 0),
+        "location": "Московский",
+        "dances": {"Семеновна", "Снегири"},
+    },
+    {
+        "text": "1 декабря в 17:00 КДЦ Московкий, Цветную круговерть",
+        "datetime": datetime(2025, 12, 1, 17, 0),
+        "location": "КДЦ Московский",
+        "dances": {"Цветная круговерть"},
+    },
+    # Обычные слова на расстоянии опечатки от формы танца — танцев нет
+    {
+        "text": "Субботний концерт в ДК Горького",
+        "datetime": None,
+        "location": "ДК Горького",
+        "dances": set(),
+    },
+    {
+        "text": "Морские пехотинцы выступают завтра в 19:00 в БКЗ",
+        "datetime": datetime(2025, 11, 11, 19, 0),
+        "location": "БКЗ",
+        "dances": set(),
+    },
+    {
+        "text": "Соперник не пришёл, репетиция в пятницу в 17:00 в Максиме",
+        "datetime": datetime(2025, 11, 14, 17, 0),
+        "location": "Максим",
+        "dances": set(),
+    },
+    {
+        "text": "Каждый вторник в 19:00 в Троицком репетиция",
+        "datetime": datetime(2025, 11, 11, 19, 0),
+        "location": "Троицкий",
+        "dances": set(),
+        "recurrence": {"freq": "weekly", "interval": 1},
+    },
+    {
+        "text": "По средам в 18:30 в Максиме, Барыня и Шумиха",
+        "datetime": datetime(2025, 11, 12, 18, 30),
+        "location": "Максим",
+        "dances": {"Барыня", "Шумиха"},
+        "recurrence": {"freq": "weekly", "interval": 1},
+    },
+]
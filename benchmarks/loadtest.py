@@ -0,0 +1,394 @@
+# benchmarks/loadtest.py
+"""
+Сквозной нагрузочный тест бота на фейковом Telegram Bot API.
+
+Поднимает локальный HTTP-сервер, который притворяется api.telegram.org,
+запускает настоящий Application из bot.py против него и гоняет тысячи
+виртуальных пользователей по полному сценарию:
+сообщение → «Всё верно» → «Мои мероприятия» → /delete 1.
+
+Запуск из корня репозитория:
+    python -m benchmarks.loadtest --users 1000 --mode both
+    python -m benchmarks.loadtest --start-time 2025-11-10T10:00 --time-factor 60
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+import tornado.web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+
+import bot
+import clock
+import database
+from benchmarks.corpus import CORPUS
+
+FAKE_TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Calendar", "username": "calendar_loadtest_bot"}
+
+# Тексты объявлений для виртуальных пользователей
+LOAD_TEXTS = [case["text"] for case in CORPUS if case["datetime"] is not None]
+
+# Методы Bot API, которые считаются «ответом» бота пользователю
+REPLY_METHODS = {"sendMessage", "editMessageText", "sendDocument"}
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """Перцентиль по уже отсортированному списку (nearest-rank)"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class FakeBotAPI:
+    """Минимальная реализация Bot API, достаточная для bot.py"""
+
+    def __init__(self):
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.pending_updates: List[dict] = []
+        self.updates_available = asyncio.Event()
+        self.replies: Dict[int, asyncio.Queue] = {}
+        self.calls: Dict[str, int] = {}
+
+    def reply_queue(self, chat_id: int) -> asyncio.Queue:
+        """Очередь ответов бота в конкретный чат"""
+        if chat_id not in self.replies:
+            self.replies[chat_id] = asyncio.Queue()
+        return self.replies[chat_id]
+
+    def push_update(self, update: dict):
+        """Кладёт апдейт в очередь для getUpdates"""
+        update["update_id"] = next(self.update_ids)
+        self.pending_updates.append(update)
+        self.updates_available.set()
+
+    def _message(self, chat_id: int, text: str, reply_markup: Optional[str], message_id: Optional[int] = None) -> dict:
+        message = {
+            "message_id": message_id or next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+        if reply_markup:
+            message["reply_markup"] = json.loads(reply_markup)
+        return message
+
+    async def call(self, method: str, params: dict):
+        """Выполняет метод Bot API и возвращает поле result"""
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getMe":
+            return BOT_USER
+        if method in ("deleteWebhook", "setWebhook", "answerCallbackQuery", "close", "logOut"):
+            return True
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method in REPLY_METHODS:
+            chat_id = int(params["chat_id"])
+            message_id = int(params["message_id"]) if "message_id" in params else None
+            message = self._message(chat_id, params.get("text", ""), params.get("reply_markup"), message_id)
+            self.reply_queue(chat_id).put_nowait((method, message, time.perf_counter()))
+            return message
+        return True
+
+    def release_pollers(self):
+        """Будит висящие long-poll запросы перед остановкой сервера"""
+        self.pending_updates = []
+        self.updates_available.set()
+
+    async def _get_updates(self, params: dict) -> List[dict]:
+        offset = int(params.get("offset", 0) or 0)
+        limit = int(params.get("limit", 100) or 100)
+        timeout = float(params.get("timeout", 0) or 0)
+
+        self.pending_updates = [u for u in self.pending_updates if u["update_id"] >= offset]
+        if not self.pending_updates and timeout:
+            self.updates_available.clear()
+            try:
+                await asyncio.wait_for(self.updates_available.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.pending_updates[:limit]
+
+
+class _BotAPIHandler(tornado.web.RequestHandler):
+    def initialize(self, api: FakeBotAPI):
+        self.api = api
+
+    async def post(self, token: str, method: str):
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(self.request.body or b"{}")
+        else:
+            params = {k: v[0].decode() for k, v in self.request.body_arguments.items()}
+        result = await self.api.call(method, params)
+        self.set_header("Content-Type", "application/json")
+        self.write(json.dumps({"ok": True, "result": result}))
+
+    get = post
+
+
+class DBMetrics:
+    """Время удержания соединений SQLite и число блокировок"""
+
+    def __init__(self):
+        self.hold_times: List[float] = []
+        self.lock_errors = 0
+
+    def install(self):
+        original = database.get_db_connection
+
+        @contextmanager
+        def timed_connection():
+            started = time.perf_counter()
+            try:
+                with original() as conn:
+                    yield conn
+            except sqlite3.OperationalError as e:
+                if "locked" in str(e):
+                    self.lock_errors += 1
+                raise
+            finally:
+                self.hold_times.append(time.perf_counter() - started)
+
+        database.get_db_connection = timed_connection
+        return original
+
+
+class VirtualUser:
+    """Один пользователь, проходящий полный сценарий"""
+
+    def __init__(self, user_id: int, api: FakeBotAPI, deliver, think_time: float, reply_timeout: float):
+        self.user_id = user_id
+        self.api = api
+        self.deliver = deliver
+        self.think_time = think_time
+        self.reply_timeout = reply_timeout
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+        self.latencies: Dict[str, List[float]] = {}
+        self.timeouts = 0
+        self.rejected = 0
+
+    async def _think(self):
+        if self.think_time:
+            await asyncio.sleep(random.expovariate(1 / self.think_time))
+
+    async def _step(self, name: str, update: dict) -> Optional[dict]:
+        """Отправляет апдейт и ждёт первого ответа бота"""
+        queue = self.api.reply_queue(self.user_id)
+        started = time.perf_counter()
+        await self.deliver(update)
+        try:
+            _, message, answered_at = await asyncio.wait_for(queue.get(), self.reply_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return None
+        self.latencies.setdefault(name, []).append(answered_at - started)
+        return message
+
+    def _text_update(self, text: str) -> dict:
+        message = {
+            "message_id": next(self.api.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": self.user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"message": message}
+
+    def _callback_update(self, data: str, message: dict) -> dict:
+        return {
+            "callback_query": {
+                "id": f"{self.user_id}-{time.perf_counter_ns()}",
+                "from": self.user,
+                "chat_instance": str(self.user_id),
+                "data": data,
+                "message": message,
+            }
+        }
+
+    async def run(self):
+        message = await self._step("message", self._text_update(random.choice(LOAD_TEXTS)))
+        await self._think()
+
+        if message and "confirm" in json.dumps(message.get("reply_markup", {})):
+            message = await self._step("confirm", self._callback_update("confirm", message))
+            await self._think()
+        else:
+            self.rejected += 1
+
+        if message:
+            await self._step("list", self._callback_update("show_events", message))
+            await self._think()
+
+        await self._step("delete", self._text_update("/delete 1"))
+
+
+async def run_scenario(mode: str, users: int, think_time: float, ramp_up: float, reply_timeout: float) -> dict:
+    """Запускает бота и прогоняет сценарий в режиме polling или webhook"""
+    api = FakeBotAPI()
+    api_app = tornado.web.Application([(r"/bot([^/]+)/(\w+)", _BotAPIHandler, {"api": api})])
+    api_sockets = bind_sockets(0, "127.0.0.1")
+    api_server = HTTPServer(api_app)
+    api_server.add_sockets(api_sockets)
+    api_port = api_sockets[0].getsockname()[1]
+
+    application = bot.build_application(FAKE_TOKEN, base_url=f"http://127.0.0.1:{api_port}/bot")
+    await application.initialize()
+
+    client = httpx.AsyncClient(timeout=reply_timeout)
+    if mode == "webhook":
+        webhook_port = _free_port()
+        await application.updater.start_webhook(
+            listen="127.0.0.1",
+            port=webhook_port,
+            url_path="hook",
+            webhook_url=f"http://127.0.0.1:{webhook_port}/hook",
+        )
+        webhook_url = f"http://127.0.0.1:{webhook_port}/hook"
+
+        async def deliver(update: dict):
+            update["update_id"] = next(api.update_ids)
+            await client.post(webhook_url, json=update)
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+
+        async def deliver(update: dict):
+            api.push_update(update)
+
+    await application.start()
+
+    virtual_users = [VirtualUser(10_000 + i, api, deliver, think_time, reply_timeout) for i in range(users)]
+
+    async def start_user(index: int, user: VirtualUser):
+        if ramp_up:
+            await asyncio.sleep(ramp_up * index / users)
+        await user.run()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(start_user(i, u) for i, u in enumerate(virtual_users)))
+    elapsed = time.perf_counter() - started
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await client.aclose()
+    api.release_pollers()
+    api_server.stop()
+    await asyncio.sleep(0.1)
+
+    latencies: Dict[str, List[float]] = {}
+    for user in virtual_users:
+        for step, values in user.latencies.items():
+            latencies.setdefault(step, []).extend(values)
+
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "timeouts": sum(u.timeouts for u in virtual_users),
+        "rejected": sum(u.rejected for u in virtual_users),
+        "api_calls": api.calls,
+    }
+
+
+def _free_port() -> int:
+    """Свободный локальный порт для webhook-сервера"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def print_report(mode: str, result: dict, metrics: DBMetrics):
+    """Печатает пропускную способность, перцентили и статистику SQLite"""
+    total_updates = sum(len(v) for v in result["latencies"].values()) + result["timeouts"]
+    print(f"\n=== Режим: {mode} ===")
+    print(f"Время: {result['elapsed']:.1f} c, апдейтов: {total_updates}, "
+          f"пропускная способность: {total_updates / result['elapsed']:.1f} апд./с")
+    print(f"Таймаутов: {result['timeouts']}, сообщений без даты: {result['rejected']}")
+
+    print(f"{'шаг':<10}{'n':>8}{'p50, мс':>10}{'p90, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for step in ("message", "confirm", "list", "delete"):
+        values = sorted(result["latencies"].get(step, []))
+        if not values:
+            continue
+        print(f"{step:<10}{len(values):>8}"
+              f"{_percentile(values, 50) * 1000:>10.1f}{_percentile(values, 90) * 1000:>10.1f}"
+              f"{_percentile(values, 99) * 1000:>10.1f}{values[-1] * 1000:>10.1f}")
+
+    holds = sorted(metrics.hold_times)
+    if holds:
+        print(f"SQLite: соединений {len(holds)}, удержание p50 {_percentile(holds, 50) * 1000:.2f} мс, "
+              f"p99 {_percentile(holds, 99) * 1000:.2f} мс, суммарно {sum(holds):.2f} c, "
+              f"блокировок: {metrics.lock_errors}")
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Нагрузочный тест бота на фейковом Bot API")
+    arg_parser.add_argument("--users", type=int, default=1000, help="число виртуальных пользователей")
+    arg_parser.add_argument("--think-time", type=float, default=1.0,
+                            help="среднее время «раздумий» между шагами, с (экспоненциальное)")
+    arg_parser.add_argument("--ramp-up", type=float, default=10.0,
+                            help="за сколько секунд подключаются все пользователи")
+    arg_parser.add_argument("--reply-timeout", type=float, default=30.0,
+                            help="сколько ждать ответа бота на каждом шаге, с")
+    arg_parser.add_argument("--mode", choices=("polling", "webhook", "both"), default="both")
+    arg_parser.add_argument("--seed", type=int, default=None, help="seed для воспроизводимости")
+    arg_parser.add_argument("--start-time", type=datetime.fromisoformat, default=None,
+                            help="стартовое время бота (ISO), по умолчанию — системное")
+    arg_parser.add_argument("--time-factor", type=float, default=1.0,
+                            help="ускорение часов относительно реального времени (0 — часы стоят)")
+    args = arg_parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if args.start_time is not None:
+        if args.time_factor:
+            clock.set_clock(clock.AcceleratedClock(args.start_time, args.time_factor))
+        else:
+            clock.set_clock(clock.FixedClock(args.start_time))
+
+    # Шум от каждого апдейта только мешает замерам
+    logging.getLogger().setLevel(logging.WARNING)
+
+    modes = ("polling", "webhook") if args.mode == "both" else (args.mode,)
+    for mode in modes:
+        # Каждый режим — на чистой временной базе
+        with tempfile.TemporaryDirectory() as tmp:
+            database.DB_PATH = os.path.join(tmp, "loadtest.db")
+            database.init_db()
+            metrics = DBMetrics()
+            original = metrics.install()
+            try:
+                result = asyncio.run(run_scenario(mode, args.users, args.think_time,
+                                                  args.ramp_up, args.reply_timeout))
+            finally:
+                database.get_db_connection = original
+            print_report(mode, result, metrics)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
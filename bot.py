@@ -1,18 +1,30 @@
 # bot.py
+import asyncio
 import logging
-import sqlite3
 import os
-from datetime import datetime
+import tempfile
+import time
+from datetime import timedelta
+from typing import Optional
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, ContextTypes,
-    ConversationHandler, CallbackQueryHandler, filters
+    Application, ApplicationHandlerStop, CommandHandler, MessageHandler, ContextTypes,
+    ConversationHandler, CallbackQueryHandler, TypeHandler, filters
 )
 
-from config import BOT_TOKEN
-from database import init_db, add_event, get_upcoming_events, delete_event, get_today_events, get_all_events
-from parser import extract_with_spacy
+from config import BOT_TOKEN, FEED_PORT, DIGEST_TIME, BACKUP_INTERVAL_HOURS
+from database import Event
+from storage import SQLiteStorage, get_storage
+from parser import extract_with_spacy, EVENT_DURATIONS, reload_vocabulary
+from conflicts import find_conflicts
+from ics_export import iter_ics, feed_url, start_feed_server
+from importer import IMPORT_BATCH_SIZE, SUPPORTED_EXTENSIONS, iter_file_entries, read_mapped
+from digest import digest_loop, parse_digest_time
+from backup import backup_loop, backup_now, list_backups, restore_now
 from admin import is_admin, get_admin_commands, get_user_commands, ADMIN_IDS
+import admission
+import clock
+import profiler
 
 # Настройка логирования
 logging.basicConfig(
@@ -27,6 +39,12 @@ AWAITING_CONFIRMATION, AWAITING_LOCATION, AWAITING_DANCES = 1, 2, 3
 # Временное хранилище
 user_data = {}
 
+# Сколько результатов поиска показывать на одной странице
+SEARCH_PAGE_SIZE = 10
+
+# Не чаще одного обновления прогресса импорта за столько секунд
+IMPORT_PROGRESS_INTERVAL = 3
+
 
 def get_main_menu():
     """Возвращает главное меню с кнопками"""
@@ -39,6 +57,58 @@ def get_main_menu():
     return InlineKeyboardMarkup(keyboard)
 
 
+def format_event(ev: Event, time_format: str = '%d.%m %H:%M') -> str:
+    """Строка события для списков: «дата — место | танцы»"""
+    loc = ev.location or "не указано"
+    dances = ev.dances or "не указаны"
+    marks = ("🔁 " if ev.rule_id else "") + ("👥 " if ev.group_id else "")
+    return f"{marks}{ev.dt.strftime(time_format)} — {loc} | {dances}"
+
+
+def format_digest(events: list) -> str:
+    """Текст утренней сводки на сегодня"""
+    msg = "☀️ Доброе утро! Сегодня у тебя:\n\n"
+    for ev in events:
+        msg += f"• {format_event(ev, '%H:%M')}\n"
+    return msg
+
+
+def format_recurrence(recurrence: Optional[dict]) -> str:
+    """Строка «🔁 ...» для подтверждения регулярного события"""
+    if not recurrence:
+        return ""
+    interval = recurrence["interval"]
+    if recurrence["freq"] == "weekly":
+        text = "каждую неделю" if interval == 1 else f"раз в {interval} недели"
+    else:
+        text = "каждый день" if interval == 1 else f"раз в {interval} дня"
+    return f"🔁 {text}\n"
+
+
+async def admission_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отсекает флуд и слишком длинные тексты до всех остальных обработчиков"""
+    user = update.effective_user
+    if user is None or is_admin(user.id):
+        return
+
+    reason = admission.check_update(update)
+    if reason is None:
+        return
+
+    message = update.effective_message
+    if reason == admission.TOO_LONG:
+        await message.reply_text(
+            f"❌ Слишком длинное сообщение. Опиши выступление короче "
+            f"(до {admission.MAX_MESSAGE_LENGTH} символов)."
+        )
+    elif admission.should_warn(user.id):
+        if update.callback_query:
+            await update.callback_query.answer("⏳ Слишком часто, подожди немного.")
+        elif message:
+            await message.reply_text("⏳ Слишком много сообщений подряд, подожди немного.")
+    raise ApplicationHandlerStop
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
@@ -64,22 +134,19 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     elif query.data == "show_events":
-        events = get_upcoming_events(user_id)
+        events = await get_storage().get_upcoming_events(user_id)
 
         if not events:
             msg = "У тебя пока нет запланированных мероприятий."
         else:
             msg = "📌 Твои ближайшие мероприятия:\n\n"
             for ev in events:
-                dt = datetime.fromisoformat(ev[1])
-                loc = ev[2] or "не указано"
-                dances = ev[3] or "не указаны"
-                msg += f"• {dt.strftime('%d.%m %H:%M')} — {loc} | {dances}\n"
+                msg += f"• {format_event(ev)}\n"
         await query.edit_message_text(msg, reply_markup=get_main_menu())
         return ConversationHandler.END
 
     elif query.data == "delete_event":
-        events = get_upcoming_events(user_id)
+        events = await get_storage().get_upcoming_events(user_id)
         if not events:
             msg = "У тебя нет мероприятий для удаления."
             await query.edit_message_text(msg, reply_markup=get_main_menu())
@@ -87,10 +154,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         msg = "📌 Выбери событие для удаления:\n\n"
         for i, ev in enumerate(events, 1):
-            dt = datetime.fromisoformat(ev[1])
-            loc = ev[2] or "не указано"
-            dances = ev[3] or "не указаны"
-            msg += f"{i}. {dt.strftime('%d.%m %H:%M')} — {loc} | {dances}\n"
+            msg += f"{i}. {format_event(ev)}\n"
 
         msg += "\n\nОтправь команду /delete N, где N — номер события."
 
@@ -98,16 +162,13 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     elif query.data == "today":
-        events = get_today_events(user_id)
+        events = await get_storage().get_today_events(user_id, now=clock.now())
         if not events:
             msg = "Сегодня у тебя нет мероприятий 😊"
         else:
             msg = "🎉 Сегодня у тебя:\n\n"
             for ev in events:
-                dt = datetime.fromisoformat(ev[1])
-                loc = ev[2] or "не указано"
-                dances = ev[3] or "не указаны"
-                msg += f"• {dt.strftime('%H:%M')} — {loc} | {dances}\n"
+                msg += f"• {format_event(ev, '%H:%M')}\n"
 
         await query.edit_message_text(msg, reply_markup=get_main_menu())
         return ConversationHandler.END
@@ -116,27 +177,48 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
     user_id = update.effective_user.id
+    # Один снимок времени на весь апдейт
+    now = clock.now()
 
     # Используем парсер
-    extracted = extract_with_spacy(text)
+    extracted = extract_with_spacy(text, now)
     dt = extracted["datetime"]
     location = extracted["location"]
     dances = extracted["dances"]
+    recurrence = extracted["recurrence"]
 
     if not dt:
         await update.message.reply_text("❌ Не удалось определить дату. Попробуй: *«завтра в 19:00»*",
                                         parse_mode="Markdown")
         return ConversationHandler.END
 
+    # Ансамбли, в календарь которых пользователь может добавлять события
+    leader_groups = [(g["id"], g["name"]) for g in await get_storage().get_user_groups(user_id) if g["role"] == "leader"]
+
     # Сохраняем во временное хранилище
     user_data[user_id] = {
         "datetime": dt,
         "location": location,
         "dances": dances,
-        "raw_text": text
+        "recurrence": recurrence,
+        "raw_text": text,
+        "group_id": None,
+        "leader_groups": leader_groups,
+        "duration": EVENT_DURATIONS[extracted["event_type"]]
     }
+    await refresh_conflicts(user_id, user_data[user_id])
+
+    await update.message.reply_text(
+        f"Проверь данные:\n\n"
+        f"{format_draft(user_data[user_id], 'не распознаны')}\n"
+        f"Всё правильно?",
+        reply_markup=get_confirmation_keyboard(user_data[user_id])
+    )
+    return AWAITING_CONFIRMATION
+
 
-    # Кнопки подтверждения
+def get_confirmation_keyboard(data: dict) -> InlineKeyboardMarkup:
+    """Кнопки подтверждения нового события"""
     keyboard = [
         [
             InlineKeyboardButton("✅ Всё верно", callback_data="confirm"),
@@ -146,18 +228,51 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             InlineKeyboardButton("💃 Танцы", callback_data="edit_dances")
         ]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if data.get("leader_groups"):
+        keyboard.append([InlineKeyboardButton("👥 Чей календарь", callback_data="target_group")])
+    return InlineKeyboardMarkup(keyboard)
 
-    dances_str = ", ".join(dances) if dances else "не распознаны"
-    await update.message.reply_text(
-        f"Проверь данные:\n\n"
-        f"📅 {dt.strftime('%d.%m.%Y %H:%M')}\n"
-        f"📍 {location or 'не указано'}\n"
-        f"💃 {dances_str}\n\n"
-        f"Всё правильно?",
-        reply_markup=reply_markup
+
+async def refresh_conflicts(user_id: int, data: dict):
+    """Пересчитывает пересечения черновика с календарём, в который он попадёт"""
+    start = data["datetime"]
+    end = start + timedelta(minutes=data["duration"])
+    data["conflicts"] = await find_conflicts(user_id, start, end, data["location"],
+                                             data.get("recurrence"), data.get("group_id"))
+
+
+# Сколько конфликтов показывать в подтверждении (у регулярного их может быть много)
+MAX_SHOWN_CONFLICTS = 5
+
+
+def format_conflicts(conflicts: list) -> str:
+    """Предупреждения о пересечениях для подтверждения"""
+    if not conflicts:
+        return ""
+    lines = ["\n⚠️ Возможный конфликт:"]
+    for kind, ev in conflicts[:MAX_SHOWN_CONFLICTS]:
+        reason = "в то же время" if kind == "overlap" else "не успеть доехать"
+        lines.append(f"• {format_event(ev)} ({reason})")
+    if len(conflicts) > MAX_SHOWN_CONFLICTS:
+        lines.append(f"• ...и ещё {len(conflicts) - MAX_SHOWN_CONFLICTS}")
+    return "\n".join(lines) + "\n"
+
+
+def format_draft(data: dict, no_dances: str = "не указаны") -> str:
+    """Описание ещё не сохранённого события для подтверждения"""
+    dances_str = ", ".join(data["dances"]) if data["dances"] else no_dances
+    group_line = ""
+    if data.get("group_id"):
+        group_name = dict(data["leader_groups"]).get(data["group_id"], "")
+        group_line = f"👥 Ансамбль: {group_name}\n"
+    return (
+        f"📅 {data['datetime'].strftime('%d.%m.%Y %H:%M')}\n"
+        f"{format_recurrence(data.get('recurrence'))}"
+        f"{group_line}"
+        f"📍 {data['location'] or 'не указано'}\n"
+        f"💃 {dances_str}\n"
+        f"{format_conflicts(data.get('conflicts'))}"
     )
-    return AWAITING_CONFIRMATION
 
 
 async def confirm_or_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -172,8 +287,20 @@ async def confirm_or_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = user_data[user_id]
 
     if query.data == "confirm":
-        success = add_event(user_id, data["datetime"], data["location"], data["dances"], data["raw_text"])
-        if success:
+        recurrence = data.get("recurrence")
+        group_id = data.get("group_id")
+        if recurrence:
+            success = await get_storage().add_recurring_event(user_id, data["datetime"], recurrence["freq"], recurrence["interval"],
+                                                              data["location"], data["dances"], data["raw_text"], group_id=group_id,
+                                                              duration_minutes=data["duration"])
+        else:
+            success = await get_storage().add_event(user_id, data["datetime"], data["location"], data["dances"], data["raw_text"],
+                                                    group_id=group_id,
+                                                    end_datetime=data["datetime"] + timedelta(minutes=data["duration"]))
+        if success and group_id:
+            await query.edit_message_text("✅ Отлично! Событие сохранено в календаре ансамбля.",
+                                          reply_markup=get_main_menu())
+        elif success:
             await query.edit_message_text("✅ Отлично! Событие сохранено в календаре.", reply_markup=get_main_menu())
         else:
             await query.edit_message_text("❌ Ошибка при сохранении события.", reply_markup=get_main_menu())
@@ -188,6 +315,18 @@ async def confirm_or_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("Напиши правильные танцы через запятую:")
         return AWAITING_DANCES
 
+    elif query.data == "target_group":
+        # Переключаем по кругу: личный календарь → ансамбль 1 → ансамбль 2 → ...
+        targets = [None] + [group_id for group_id, _ in data["leader_groups"]]
+        data["group_id"] = targets[(targets.index(data["group_id"]) + 1) % len(targets)]
+        # Пересечения проверяются по тому календарю, куда попадёт событие
+        await refresh_conflicts(user_id, data)
+        await query.edit_message_text(
+            f"Проверь данные:\n\n{format_draft(data)}\nВсё правильно?",
+            reply_markup=get_confirmation_keyboard(data)
+        )
+        return AWAITING_CONFIRMATION
+
 
 async def receive_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -197,32 +336,19 @@ async def receive_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     new_location = update.message.text.strip()
 
-    # Обновляем данные
+    # Обновляем данные (от места зависит время на дорогу)
     user_data[user_id]["location"] = new_location
+    await refresh_conflicts(user_id, user_data[user_id])
 
     # Показываем обновленные данные для подтверждения
     data = user_data[user_id]
 
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Всё верно", callback_data="confirm"),
-        ],
-        [
-            InlineKeyboardButton("✏️ Место", callback_data="edit_location"),
-            InlineKeyboardButton("💃 Танцы", callback_data="edit_dances")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    dances_str = ", ".join(data["dances"]) if data["dances"] else "не указаны"
     await update.message.reply_text(
         f"✅ Место обновлено!\n\n"
         f"Обновленные данные:\n"
-        f"📅 {data['datetime'].strftime('%d.%m.%Y %H:%M')}\n"
-        f"📍 {new_location or 'не указано'}\n"
-        f"💃 {dances_str}\n\n"
+        f"{format_draft(data)}\n"
         f"Всё правильно?",
-        reply_markup=reply_markup
+        reply_markup=get_confirmation_keyboard(data)
     )
     return AWAITING_CONFIRMATION
 
@@ -242,26 +368,12 @@ async def receive_dances(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Показываем обновленные данные для подтверждения
     data = user_data[user_id]
 
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Всё верно", callback_data="confirm"),
-        ],
-        [
-            InlineKeyboardButton("✏️ Место", callback_data="edit_location"),
-            InlineKeyboardButton("💃 Танцы", callback_data="edit_dances")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    dances_str = ", ".join(dances) if dances else "не указаны"
     await update.message.reply_text(
         f"✅ Танцы обновлены!\n\n"
         f"Обновленные данные:\n"
-        f"📅 {data['datetime'].strftime('%d.%m.%Y %H:%M')}\n"
-        f"📍 {data['location'] or 'не указано'}\n"
-        f"💃 {dances_str}\n\n"
+        f"{format_draft(data)}\n"
         f"Всё правильно?",
-        reply_markup=reply_markup
+        reply_markup=get_confirmation_keyboard(data)
     )
     return AWAITING_CONFIRMATION
 
@@ -277,13 +389,14 @@ async def delete_event_command(update: Update, context: ContextTypes.DEFAULT_TYP
     if not args or not args[0].isdigit():
         await update.message.reply_text(
             "❌ Неверный формат.\nИспользуй: /delete N, где N — номер события.\n"
+            "Для регулярного события /delete N все удалит всю серию.\n"
             "Сначала посмотри список через /events или кнопку «Мои мероприятия».",
             reply_markup=get_main_menu()
         )
         return
 
     event_num = int(args[0])
-    events = get_upcoming_events(user_id)
+    events = await get_storage().get_upcoming_events(user_id)
 
     if event_num < 1 or event_num > len(events):
         await update.message.reply_text(
@@ -292,14 +405,269 @@ async def delete_event_command(update: Update, context: ContextTypes.DEFAULT_TYP
         )
         return
 
-    event_id = events[event_num - 1][0]  # id события
-    delete_event(event_id)
+    event = events[event_num - 1]
+    if event.group_id and await get_storage().get_member_role(event.group_id, user_id) != "leader":
+        await update.message.reply_text(
+            "❌ Событие ансамбля может удалить только руководитель.",
+            reply_markup=get_main_menu()
+        )
+        return
+
+    if event.rule_id is None:
+        await get_storage().delete_event(event.id)
+        msg = f"✅ Событие №{event_num} удалено!"
+    elif len(args) > 1 and args[1].lower() == "все":
+        await get_storage().delete_recurring_event(event.rule_id)
+        msg = f"✅ Регулярное событие №{event_num} удалено со всеми повторениями!"
+    else:
+        # Отменяем только это повторение, правило остаётся
+        await get_storage().skip_occurrence(event.rule_id, event.event_datetime)
+        msg = f"✅ Повторение №{event_num} отменено!"
+
+    await update.message.reply_text(msg, reply_markup=get_main_menu())
+
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Полнотекстовый поиск по своим событиям: /search текст"""
+    query_text = " ".join(context.args).strip()
+    if not query_text:
+        await update.message.reply_text(
+            "❌ Укажи, что искать.\nПример: /search Сюита БКЗ",
+            reply_markup=get_main_menu()
+        )
+        return
+
+    context.user_data["search_query"] = query_text
+    msg, reply_markup = await build_search_page(update.effective_user.id, query_text, 0)
+    await update.message.reply_text(msg, reply_markup=reply_markup)
+
+
+async def search_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Листание страниц результатов поиска"""
+    query = update.callback_query
+    await query.answer()
+
+    query_text = context.user_data.get("search_query")
+    if not query_text:
+        await query.edit_message_text("❌ Поиск устарел. Повтори команду /search.", reply_markup=get_main_menu())
+        return
+
+    page = int(query.data.split(":")[1])
+    msg, reply_markup = await build_search_page(update.effective_user.id, query_text, page)
+    await query.edit_message_text(msg, reply_markup=reply_markup)
+
+
+async def build_search_page(user_id: int, query_text: str, page: int):
+    """Текст и кнопки для страницы результатов поиска"""
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+    events = await get_storage().search_events(user_id, query_text, limit=SEARCH_PAGE_SIZE + 1,
+                                               offset=page * SEARCH_PAGE_SIZE)
+    has_next = len(events) > SEARCH_PAGE_SIZE
+    events = events[:SEARCH_PAGE_SIZE]
+
+    if not events:
+        return f"🔎 По запросу «{query_text}» ничего не найдено.", get_main_menu()
+
+    msg = f"🔎 Найдено по запросу «{query_text}» (стр. {page + 1}):\n\n"
+    for i, ev in enumerate(events, page * SEARCH_PAGE_SIZE + 1):
+        msg += f"{i}. {format_event(ev, '%d.%m.%Y %H:%M')}\n"
+
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("◀️ Назад", callback_data=f"search:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"search:{page + 1}"))
+    reply_markup = InlineKeyboardMarkup([nav]) if nav else None
+    return msg, reply_markup
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка календаря в .ics для импорта в телефон"""
+    user_id = update.effective_user.id
+
+    # Пишем документ кусками во временный файл, а не собираем строку в памяти
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", newline="", suffix=".ics", delete=False) as f:
+        path = f.name
+        async for chunk in iter_ics(user_id):
+            f.write(chunk)
+
+    try:
+        with open(path, "rb") as f:
+            await update.message.reply_document(
+                f, filename="calendar.ics",
+                caption="📆 Открой файл, чтобы добавить выступления в календарь телефона."
+            )
+    finally:
+        os.remove(path)
+
+    url = feed_url(user_id)
+    if url:
+        await update.message.reply_text(
+            "🔄 Чтобы календарь обновлялся сам, подпишись на ссылку "
+            f"(«Добавить календарь по URL»):\n{url}"
+        )
+
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Импорт событий из присланного файла .ics или .csv"""
+    user_id = update.effective_user.id
+    document = update.message.document
+    if not (document.file_name or "").lower().endswith(SUPPORTED_EXTENSIONS):
+        await update.message.reply_text("❌ Пришли файл календаря в формате .ics или .csv.")
+        return
+
+    progress = await update.message.reply_text("⏳ Загружаю файл...")
+    suffix = os.path.splitext(document.file_name)[1].lower()
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    # rows — сколько событий и правил получилось из файла (с дубликатами)
+    stats = {"read": 0, "rows": 0, "added": 0, "rules": 0, "skipped": 0, "unsupported": 0}
+    entries = None
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+
+        entries = iter_file_entries(path)
+        last_report = time.monotonic()
+        while True:
+            # Разбор пачки — в отдельном потоке, чтобы бот не замирал на больших файлах
+            mapped = await asyncio.to_thread(read_mapped, entries, IMPORT_BATCH_SIZE)
+            if not mapped:
+                break
+
+            events, rules = [], []
+            for event in mapped:
+                stats["read"] += 1
+                if event is None:
+                    stats["skipped"] += 1
+                    continue
+                if event["unsupported"]:
+                    stats["unsupported"] += 1
+                    continue
+
+                recurrence = event["recurrence"]
+                if not recurrence:
+                    events.append((event["start"], event["end"], event["location"], event["dances"],
+                                   event["raw_text"]))
+                    continue
+                if recurrence["single"]:
+                    events.append((recurrence["single"], event["end"], event["location"], event["dances"],
+                                   event["raw_text"]))
+                duration = event["end"] - event["start"] if event["end"] else None
+                # BYDAY с несколькими днями — несколько правил, но одна запись файла
+                for first, exceptions in recurrence["series"]:
+                    rules.append((first, recurrence["freq"], recurrence["interval"], recurrence["until"],
+                                  event["location"], event["dances"], event["raw_text"],
+                                  int(duration.total_seconds() // 60) if duration else None, exceptions))
+
+            stats["rows"] += len(events) + len(rules)
+            if events:
+                stats["added"] += await get_storage().add_events_batch(user_id, events)
+            if rules:
+                stats["rules"] += await get_storage().add_recurring_events_batch(user_id, rules)
+            if time.monotonic() - last_report >= IMPORT_PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                await progress.edit_text(
+                    f"⏳ Импорт: прочитано {stats['read']}, добавлено {stats['added'] + stats['rules']}..."
+                )
+    except Exception as e:
+        logger.error(f"Ошибка импорта файла пользователя {user_id}: {e}")
+        added = stats["added"] + stats["rules"]
+        if added:
+            # Записанные пачки остаются в календаре — говорим, сколько успели
+            await progress.edit_text(
+                f"⚠️ Импорт прерван ошибкой после {stats['read']} записей файла.\n"
+                f"Уже добавлено и осталось в календаре: {added} (регулярных: {stats['rules']})"
+            )
+        else:
+            await progress.edit_text("❌ Не удалось прочитать файл. Проверь, что это .ics или .csv с заголовком.")
+        return
+    finally:
+        if entries is not None:
+            entries.close()
+        os.remove(path)
+
+    added = stats["added"] + stats["rules"]
+    summary = (
+        f"✅ Импорт завершён.\n\n"
+        f"Записей в файле: {stats['read']}\n"
+        f"Добавлено: {added} (регулярных: {stats['rules']})\n"
+        f"Уже были в календаре: {stats['rows'] - added}\n"
+        f"Без даты, пропущено: {stats['skipped']}"
+    )
+    if stats["unsupported"]:
+        summary += f"\nПовторения, которые бот не поддерживает (ежемесячные и т.п.), пропущено: {stats['unsupported']}"
+    await progress.edit_text(summary)
+
+
+async def group_create_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Создаёт календарь ансамбля: /group_create Название"""
+    name = " ".join(context.args).strip()
+    if not name:
+        await update.message.reply_text("❌ Укажи название.\nПример: /group_create Ансамбль Калинка")
+        return
+
+    group = await get_storage().create_group(update.effective_user.id, name)
+    if group is None:
+        await update.message.reply_text("❌ Не удалось создать ансамбль.")
+        return
+
+    await update.message.reply_text(
+        f"✅ Ансамбль «{group['name']}» создан, ты его руководитель.\n\n"
+        f"Участники присоединяются командой:\n/group_join {group['invite_code']}\n\n"
+        "При добавлении события нажми «👥 Чей календарь», чтобы сохранить его для всего ансамбля."
+    )
+
+
+async def group_join_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Вступление в ансамбль по коду: /group_join КОД"""
+    if not context.args:
+        await update.message.reply_text("❌ Укажи код приглашения.\nПример: /group_join AbC123xy")
+        return
+
+    group = await get_storage().join_group(update.effective_user.id, context.args[0])
+    if group is None:
+        await update.message.reply_text("❌ Ансамбль с таким кодом не найден.")
+        return
 
     await update.message.reply_text(
-        f"✅ Событие №{event_num} удалено!",
+        f"✅ Ты в ансамбле «{group['name']}». Его события появятся в твоём календаре.",
         reply_markup=get_main_menu()
     )
 
+
+async def groups_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Список ансамблей пользователя"""
+    groups = await get_storage().get_user_groups(update.effective_user.id)
+    if not groups:
+        await update.message.reply_text(
+            "Ты пока не состоишь ни в одном ансамбле.\n"
+            "Создай свой: /group_create Название\nИли вступи: /group_join КОД"
+        )
+        return
+
+    msg = "👥 Твои ансамбли:\n\n"
+    for group in groups:
+        role = "👑 руководитель" if group["role"] == "leader" else "участник"
+        msg += f"• {group['name']} (id {group['id']}) — {role}, участников: {group['members']}\n"
+        if group["role"] == "leader":
+            msg += f"  приглашение: /group_join {group['invite_code']}\n"
+    msg += "\nВыйти из ансамбля: /group_leave ID"
+    await update.message.reply_text(msg)
+
+
+async def group_leave_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выход из ансамбля: /group_leave ID"""
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("❌ Используй: /group_leave ID (ID смотри в /groups)")
+        return
+
+    if await get_storage().leave_group(update.effective_user.id, int(context.args[0])):
+        await update.message.reply_text("✅ Ты вышел из ансамбля.", reply_markup=get_main_menu())
+    else:
+        await update.message.reply_text("❌ Ты не состоишь в этом ансамбле.")
+
+
 async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для отладки - показывает все события (только для админов)"""
     user_id = update.effective_user.id
@@ -308,22 +676,116 @@ async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
         return
 
-    events = get_all_events(user_id)
+    events = await get_storage().get_all_events(user_id)
 
     if not events:
         await update.message.reply_text("В базе данных нет событий.")
     else:
         msg = "🔧 Все события в БД:\n\n"
+        now = clock.now()
         for ev in events:
-            dt = datetime.fromisoformat(ev[1])
-            loc = ev[2] or "не указано"
-            dances = ev[3] or "не указаны"
-            is_past = "⏰" if dt < datetime.now() else "✅"
-            msg += f"{is_past} {dt.strftime('%d.%m %H:%M')} — {loc} | {dances}\n"
+            is_past = "⏰" if ev.dt < now else "✅"
+            msg += f"{is_past} {format_event(ev)}\n"
 
         await update.message.reply_text(msg)
 
 
+# Как можно назвать вид записи в /vocab_add
+VOCABULARY_KINDS = {'танец': 'dance', 'dance': 'dance', 'место': 'location', 'location': 'location'}
+
+
+async def vocab_add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Добавляет танец или место в словарь и сразу перезагружает его (только для админов)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    kind = VOCABULARY_KINDS.get(context.args[0].lower()) if context.args else None
+    parts = [part.strip() for part in " ".join(context.args[1:]).split(",") if part.strip()]
+    if kind is None or not parts:
+        await update.message.reply_text(
+            "❌ Используй: /vocab_add танец|место Название[, вариант, вариант]\n"
+            "Пример: /vocab_add место Дом офицеров, ДО"
+        )
+        return
+
+    name, variants = parts[0], parts[1:]
+    if not await get_storage().add_vocabulary_entry(kind, name, variants):
+        await update.message.reply_text("❌ Не удалось сохранить слово.")
+        return
+
+    reload_vocabulary(await get_storage().get_vocabulary_entries())
+    await update.message.reply_text(f"✅ «{name}» добавлено в словарь, все падежные формы распознаются.")
+
+
+async def vocab_reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перечитывает словарь из базы без перезапуска бота (только для админов)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    vocabulary = reload_vocabulary(await get_storage().get_vocabulary_entries())
+    await update.message.reply_text(
+        f"🔄 Словарь перезагружен: танцев {len(vocabulary.dances.names)}, "
+        f"мест {len(vocabulary.locations.names)}."
+    )
+
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Резервная копия базы прямо сейчас (только для админов)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    if not isinstance(get_storage(), SQLiteStorage):
+        await update.message.reply_text("ℹ️ Резервные копии PostgreSQL делаются на сервере базы (pg_dump).")
+        return
+
+    await update.message.reply_text("💾 Снимаю резервную копию...")
+    path = await backup_now()
+    if path is None:
+        await update.message.reply_text("❌ Не удалось снять копию, подробности в логе.")
+        return
+    await update.message.reply_text(f"✅ Копия сохранена: {os.path.basename(path)}")
+
+
+async def restore_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Восстановление базы из копии (только для админов)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    if not isinstance(get_storage(), SQLiteStorage):
+        await update.message.reply_text("ℹ️ Резервные копии PostgreSQL делаются на сервере базы (pg_dump).")
+        return
+
+    backups = list_backups()
+    if not context.args:
+        if not backups:
+            await update.message.reply_text("📭 Резервных копий пока нет. Сними первую: /backup")
+            return
+        await update.message.reply_text(
+            "🗂 Резервные копии (новые сверху):\n\n" + "\n".join(backups[:20]) +
+            "\n\nВосстановить: /restore <имя копии>"
+        )
+        return
+
+    name = context.args[0]
+    if name not in backups:
+        await update.message.reply_text("❌ Такой копии нет. Список: /restore")
+        return
+
+    await update.message.reply_text(f"♻️ Восстанавливаю базу из {name}...")
+    if not await restore_now(name):
+        await update.message.reply_text("❌ Восстановление не удалось, база не изменена.")
+        return
+    # Словарь из /vocab_add тоже вернулся к состоянию копии
+    reload_vocabulary(await get_storage().get_vocabulary_entries())
+    await update.message.reply_text(
+        f"✅ База восстановлена из {name}.\nПрежнее состояние сохранено отдельной копией."
+    )
+
+
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Статистика бота (только для админов)"""
     user_id = update.effective_user.id
@@ -333,28 +795,20 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     try:
-        conn = sqlite3.connect("events.db")
-        cursor = conn.cursor()
-
-        # Общая статистика
-        cursor.execute("SELECT COUNT(*) FROM events")
-        total_events = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(DISTINCT user_id) FROM events")
-        total_users = cursor.fetchone()[0]
-
-        cursor.execute("SELECT COUNT(*) FROM events WHERE event_datetime >= ?",
-                       (datetime.now().isoformat(),))
-        upcoming_events = cursor.fetchone()[0]
-
-        conn.close()
+        stats = await get_storage().get_stats(clock.now())
+        counters = admission.get_counters()
 
         stats_msg = (
             "📊 Статистика бота:\n\n"
-            f"• Всего событий: {total_events}\n"
-            f"• Предстоящих событий: {upcoming_events}\n"
-            f"• Уникальных пользователей: {total_users}\n"
-            f"• Админов: {len(ADMIN_IDS)}\n"
+            f"• Всего событий: {stats['total_events']}\n"
+            f"• Предстоящих событий: {stats['upcoming_events']}\n"
+            f"• Уникальных пользователей: {stats['total_users']}\n"
+            f"• Админов: {len(ADMIN_IDS)}\n\n"
+            "🚦 Входящие апдейты с запуска:\n"
+            f"• Принято: {counters['admitted']}\n"
+            f"• Отброшено по лимиту частоты: {counters[admission.THROTTLED]}\n"
+            f"• Отброшено как слишком длинные: {counters[admission.TOO_LONG]}\n"
+            f"• Пользователей под контролем лимита: {counters['users']}\n"
         )
 
         await update.message.reply_text(stats_msg)
@@ -363,6 +817,56 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Ошибка при получении статистики: {e}")
 
 
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Профилирование живого бота на N секунд (только для админов)"""
+    user_id = update.effective_user.id
+
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    args = context.args
+    if any(not arg.isdigit() for arg in args):
+        await update.message.reply_text(
+            "❌ Неверный формат.\nИспользуй: /profile [секунды] [топ-N], например /profile 60 30"
+        )
+        return
+
+    seconds = int(args[0]) if args else profiler.DEFAULT_PROFILE_SECONDS
+    seconds = max(1, min(seconds, profiler.MAX_PROFILE_SECONDS))
+    top_n = int(args[1]) if len(args) > 1 else profiler.DEFAULT_TOP_N
+    top_n = max(1, min(top_n, profiler.MAX_TOP_N))
+
+    if not profiler.start_profiling():
+        await update.message.reply_text("⏳ Профилирование уже запущено, дождись отчёта.")
+        return
+
+    await update.message.reply_text(f"🔬 Профилирование запущено на {seconds} c...")
+
+    # Ждём в отдельной задаче, чтобы не блокировать обработку других апдейтов.
+    # Не через application.create_task: остановка бота ждала бы конца профилирования
+    context.bot_data["profile_task"] = asyncio.create_task(
+        _finish_profiling(update, seconds, top_n), name="profile"
+    )
+
+
+async def _finish_profiling(update: Update, seconds: int, top_n: int):
+    """Останавливает профилирование и отправляет отчёт администратору"""
+    await asyncio.sleep(seconds)
+    result = profiler.stop_profiling(top_n)
+    if result is None:
+        return
+
+    report, path = result
+    try:
+        # Лимит Telegram на длину сообщения — 4096 символов
+        await update.message.reply_text(f"📈 Профиль (топ-{top_n}):\n\n{report[:3900]}")
+        with open(path, "rb") as f:
+            await update.message.reply_document(f, filename=os.path.basename(path))
+    finally:
+        os.remove(path)
+
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает доступные команды"""
     user_id = update.effective_user.id
@@ -391,12 +895,59 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.error(f"Ошибка: {context.error}", exc_info=context.error)
 
 
-def main():
-    # Инициализация базы данных
-    init_db()
+async def post_init(application: Application):
+    """Хранилище и фоновые службы, которые живут вместе с ботом"""
+    await get_storage().open()
 
-    # Создаем Application
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Слова, добавленные через /vocab_add, лежат в базе
+    entries = await get_storage().get_vocabulary_entries()
+    if entries:
+        reload_vocabulary(entries)
+    if FEED_PORT:
+        application.bot_data["feed_server"] = start_feed_server(FEED_PORT)
+
+    digest_at = parse_digest_time(DIGEST_TIME)
+    if digest_at:
+        # Не через application.create_task: stop() ждал бы такие задачи вечно
+        application.bot_data["digest_task"] = asyncio.create_task(
+            digest_loop(application.bot, digest_at, format_digest)
+        )
+
+    # Резервные копии — только для файла SQLite; PostgreSQL копирует свой сервер
+    if BACKUP_INTERVAL_HOURS > 0 and isinstance(get_storage(), SQLiteStorage):
+        application.bot_data["backup_task"] = asyncio.create_task(
+            backup_loop(timedelta(hours=BACKUP_INTERVAL_HOURS))
+        )
+
+
+async def post_shutdown(application: Application):
+    """Останавливает фоновые службы"""
+    server = application.bot_data.pop("feed_server", None)
+    if server is not None:
+        server.stop()
+
+    for name in ("digest_task", "backup_task", "profile_task"):
+        task = application.bot_data.pop(name, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    # Отменённый profile_task не дошёл до stop_profiling: cProfile остался бы включён
+    if profiler.is_profiling():
+        profiler.stop_profiling()
+
+    await get_storage().close()
+
+
+def build_application(token: str = BOT_TOKEN, base_url: Optional[str] = None) -> Application:
+    """Создаёт Application со всеми обработчиками.
+
+    base_url позволяет направить бота на другой Bot API сервер
+    (например, на фейковый при нагрузочном тестировании).
+    """
+    builder = Application.builder().token(token).post_init(post_init).post_shutdown(post_shutdown)
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
 
     # Обработчик диалога
     conv_handler = ConversationHandler(
@@ -405,7 +956,7 @@ def main():
         ],
         states={
             AWAITING_CONFIRMATION: [
-                CallbackQueryHandler(confirm_or_edit, pattern="^(confirm|edit_location|edit_dances)$")
+                CallbackQueryHandler(confirm_or_edit, pattern="^(confirm|edit_location|edit_dances|target_group)$")
             ],
             AWAITING_LOCATION: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, receive_location)
@@ -419,6 +970,9 @@ def main():
         persistent=False
     )
 
+    # Допуск апдейтов — раньше всех групп, чтобы флуд не доходил до парсера
+    application.add_handler(TypeHandler(Update, admission_guard), group=-1)
+
     # Добавляем обработчики команд
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("start", start))
@@ -426,11 +980,31 @@ def main():
     application.add_handler(CommandHandler("delete", delete_event_command))
     application.add_handler(CommandHandler("debug", debug_command))
     application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+    application.add_handler(CommandHandler("vocab_add", vocab_add_command))
+    application.add_handler(CommandHandler("vocab_reload", vocab_reload_command))
+    application.add_handler(CommandHandler("backup", backup_command))
+    application.add_handler(CommandHandler("restore", restore_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(MessageHandler(filters.Document.ALL, import_document))
+    application.add_handler(CommandHandler("group_create", group_create_command))
+    application.add_handler(CommandHandler("group_join", group_join_command))
+    application.add_handler(CommandHandler("group_leave", group_leave_command))
+    application.add_handler(CommandHandler("groups", groups_command))
+    application.add_handler(CallbackQueryHandler(search_page_handler, pattern=r"^search:\d+$"))
     application.add_handler(CallbackQueryHandler(button_handler))
 
     # Добавляем обработчик ошибок
     application.add_error_handler(error_handler)
 
+    return application
+
+
+def main():
+    # Создаем Application
+    application = build_application()
+
     # Запускаем бота
     print("✅ Бот запущен с системой прав!")
     print(f"👑 Админы: {ADMIN_IDS}")
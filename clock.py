@@ -0,0 +1,63 @@
+# clock.py
+"""
+Источник «текущего времени» для парсера и базы данных.
+
+По умолчанию используются системные часы. Бенчмарки и инструменты
+воспроизведения подменяют их через set_clock() на фиксированные или
+ускоренные, чтобы результаты не зависели от реального времени.
+"""
+import time
+from datetime import datetime, timedelta
+
+
+class SystemClock:
+    """Обычные системные часы"""
+
+    def now(self) -> datetime:
+        return datetime.now()
+
+
+class FixedClock:
+    """Часы, которые стоят на месте (можно сдвигать вручную)"""
+
+    def __init__(self, moment: datetime):
+        self.moment = moment
+
+    def now(self) -> datetime:
+        return self.moment
+
+    def advance(self, delta: timedelta):
+        """Сдвигает часы вперёд на delta"""
+        self.moment += delta
+
+
+class AcceleratedClock:
+    """Часы, идущие от start в factor раз быстрее реального времени"""
+
+    def __init__(self, start: datetime, factor: float = 1.0):
+        self.start = start
+        self.factor = factor
+        self._origin = time.monotonic()
+
+    def now(self) -> datetime:
+        elapsed = time.monotonic() - self._origin
+        return self.start + timedelta(seconds=elapsed * self.factor)
+
+
+_clock = SystemClock()
+
+
+def get_clock():
+    """Возвращает текущий источник времени"""
+    return _clock
+
+
+def set_clock(clock):
+    """Подменяет источник времени (для бенчмарков и тестов)"""
+    global _clock
+    _clock = clock
+
+
+def now() -> datetime:
+    """Текущее время по активным часам"""
+    return _clock.now()
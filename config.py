@@ -2,4 +2,23 @@
 import os
 
 # Получите токен бота от @BotFather
-BOT_TOKEN = os.getenv('BOT_TOKEN', '8309102835:AAFNfHP0CIH9vtZVWf6lWj3ctsVHbTe0nxY')
\ No newline at end of file
+BOT_TOKEN = os.getenv('BOT_TOKEN', '8309102835:AAFNfHP0CIH9vtZVWf6lWj3ctsVHbTe0nxY')
+
+# Подписка на календарь (.ics): порт HTTP-сервера и внешний адрес для ссылок.
+# Если FEED_PORT не задан, подписка выключена, остаётся только /export.
+FEED_PORT = int(os.getenv('FEED_PORT', '0'))
+FEED_BASE_URL = os.getenv('FEED_BASE_URL', '')
+
+# Время утренней сводки на сегодня (ЧЧ:ММ); пустая строка — сводка выключена
+DIGEST_TIME = os.getenv('DIGEST_TIME', '08:00')
+
+# Резервные копии events.db: каталог, период (часы, 0 — выключено) и сколько копий хранить
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '24'))
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+
+# Хранилище: sqlite (файл events.db) или postgres (DATABASE_URL, PostgreSQL 14+, пул соединений asyncpg)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')
+DATABASE_URL = os.getenv('DATABASE_URL', '')
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
\ No newline at end of file
@@ -0,0 +1,104 @@
+# conflicts.py
+"""
+Проверка пересечений нового события с уже сохранёнными.
+
+Кандидаты ищутся по настоящему времени окончания (get_overlapping_events):
+хранилище ищет по индексу событий, которые кончаются после начала окна,
+так что находятся и многодневные события, а время проверки не зависит
+от длины истории пользователя. Регулярный черновик проверяется всеми
+повторениями в пределах RECURRENCE_LOOKAHEAD, а не только первым.
+"""
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+from database import FREQ_DAYS, Event
+from storage import get_storage
+
+# Время на дорогу между известными площадками, минуты
+TRAVEL_MINUTES = {
+    frozenset({'Троицкий', 'Московский'}): 30,
+    frozenset({'Троицкий', 'Максим'}): 25,
+    frozenset({'Троицкий', 'БКЗ'}): 20,
+    frozenset({'Троицкий', 'ДК Горького'}): 35,
+    frozenset({'Троицкий', 'КДЦ Московский'}): 30,
+    frozenset({'Московский', 'Максим'}): 20,
+    frozenset({'Московский', 'БКЗ'}): 25,
+    frozenset({'Московский', 'ДК Горького'}): 30,
+    frozenset({'Московский', 'КДЦ Московский'}): 5,
+    frozenset({'Максим', 'БКЗ'}): 15,
+    frozenset({'Максим', 'ДК Горького'}): 25,
+    frozenset({'Максим', 'КДЦ Московский'}): 20,
+    frozenset({'БКЗ', 'ДК Горького'}): 20,
+    frozenset({'БКЗ', 'КДЦ Московский'}): 25,
+    frozenset({'ДК Горького', 'КДЦ Московский'}): 30,
+}
+
+MAX_TRAVEL = timedelta(minutes=max(TRAVEL_MINUTES.values()))
+
+# Сколько вперёд проверяем повторения регулярного черновика
+RECURRENCE_LOOKAHEAD = timedelta(weeks=8)
+
+
+def travel_time(from_location: Optional[str], to_location: Optional[str]) -> Optional[timedelta]:
+    """Время на дорогу между площадками или None, если оно неизвестно"""
+    if not from_location or not to_location:
+        return None
+    if from_location == to_location:
+        return timedelta(0)
+    minutes = TRAVEL_MINUTES.get(frozenset({from_location, to_location}))
+    return timedelta(minutes=minutes) if minutes is not None else None
+
+
+def draft_occurrences(start: datetime, end: datetime,
+                      recurrence: Optional[dict] = None) -> Iterator[Tuple[datetime, datetime]]:
+    """Повторения черновика (начало, конец) в пределах RECURRENCE_LOOKAHEAD"""
+    if not recurrence:
+        yield start, end
+        return
+    step = timedelta(days=FREQ_DAYS[recurrence["freq"]] * recurrence["interval"])
+    last = start + RECURRENCE_LOOKAHEAD
+    if recurrence.get("until"):
+        last = min(last, recurrence["until"])
+    current = start
+    while current <= last:
+        yield current, current + (end - start)
+        current += step
+
+
+def _classify(ev: Event, start: datetime, end: datetime, location: Optional[str]) -> Optional[str]:
+    """'overlap', 'travel' или None для события ev и нового [start, end]"""
+    if ev.dt < end and ev.end > start:
+        return 'overlap'
+    travel = travel_time(ev.location, location)
+    if not travel:
+        return None
+    # Зазор между окончанием одного и началом другого меньше дороги
+    if ev.end <= start and start - ev.end < travel:
+        return 'travel'
+    if ev.dt >= end and ev.dt - end < travel:
+        return 'travel'
+    return None
+
+
+async def find_conflicts(user_id: int, start: datetime, end: datetime, location: Optional[str],
+                         recurrence: Optional[dict] = None,
+                         group_id: Optional[int] = None) -> List[Tuple[str, Event]]:
+    """События, мешающие новому: ('overlap', ev) — пересечение по времени,
+    ('travel', ev) — не успеть доехать между площадками.
+
+    recurrence — правило черновика (проверяются его повторения), group_id —
+    проверять календарь этого ансамбля, а не личный календарь пользователя.
+    """
+    occurrences = list(draft_occurrences(start, end, recurrence))
+    candidates = await get_storage().get_overlapping_events(
+        user_id, occurrences[0][0] - MAX_TRAVEL, occurrences[-1][1] + MAX_TRAVEL, group_id
+    )
+
+    conflicts = []
+    for ev in candidates:
+        for occurrence_start, occurrence_end in occurrences:
+            kind = _classify(ev, occurrence_start, occurrence_end, location)
+            if kind:
+                conflicts.append((kind, ev))
+                break
+    return conflicts
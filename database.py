@@ -1,15 +1,73 @@
 # database.py
+import heapq
+import re
+import secrets
 import sqlite3
 from datetime import datetime, timedelta
-from typing import List, Optional
+from itertools import islice
+from operator import attrgetter
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 import logging
 from contextlib import contextmanager
 
+import clock
+
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
 DB_PATH = "events.db"
 
+# Длительность событий, сохранённых без времени окончания
+DEFAULT_DURATION_MINUTES = 120
+
+
+class Event:
+    """Событие из БД: компактная запись вместо кортежа.
+
+    Дата хранится строкой ISO и разбирается в datetime только при первом
+    обращении к dt. У повторений регулярного события id = None, а rule_id
+    указывает на правило в recurring_events. group_id задан у событий
+    из календаря ансамбля.
+    """
+    __slots__ = ("id", "event_datetime", "location", "dances", "raw_text", "group_id", "end_datetime",
+                 "rule_id", "_dt")
+
+    def __init__(self, id: Optional[int], event_datetime: str, location: str, dances: str, raw_text: str,
+                 group_id: Optional[int] = None, end_datetime: Optional[str] = None,
+                 rule_id: Optional[int] = None):
+        self.id = id
+        self.event_datetime = event_datetime
+        self.location = location
+        self.dances = dances
+        self.raw_text = raw_text
+        self.group_id = group_id
+        self.end_datetime = end_datetime
+        self.rule_id = rule_id
+        self._dt = None
+
+    @property
+    def dt(self) -> datetime:
+        """Дата и время события"""
+        if self._dt is None:
+            self._dt = datetime.fromisoformat(self.event_datetime)
+        return self._dt
+
+    @property
+    def end(self) -> datetime:
+        """Время окончания (для старых записей — по длительности по умолчанию)"""
+        if self.end_datetime:
+            return datetime.fromisoformat(self.end_datetime)
+        return self.dt + timedelta(minutes=DEFAULT_DURATION_MINUTES)
+
+    def __repr__(self) -> str:
+        return (f"Event(id={self.id}, event_datetime={self.event_datetime!r}, "
+                f"location={self.location!r}, group_id={self.group_id}, rule_id={self.rule_id})")
+
+
+def _event_factory(cursor, row) -> Event:
+    """row_factory: строит Event прямо из строки курсора"""
+    return Event(*row)
+
 
 @contextmanager
 def get_db_connection():
@@ -49,25 +107,455 @@ def init_db():
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON events(user_id)")
         cursor.execute("CREATE INDEX IF NOT EXISTS idx_event_datetime ON events(event_datetime)")
 
+        # Календари ансамблей: участники и события, принадлежащие группе
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS groups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                owner_id INTEGER NOT NULL,
+                invite_code TEXT NOT NULL UNIQUE,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS group_members (
+                group_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                role TEXT NOT NULL DEFAULT 'member',
+                joined_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (group_id, user_id)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members(user_id, group_id)")
+
+        _add_column_if_missing(cursor, "events", "group_id", "INTEGER")
+        _add_column_if_missing(cursor, "events", "end_datetime", "TEXT")
+        # Личные события ищутся по (user_id, дата), события ансамбля — по (group_id, дата)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_user_datetime ON events(user_id, event_datetime)")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_events_group_datetime ON events(group_id, event_datetime)
+            WHERE group_id IS NOT NULL
+        """)
+        # Пересечения ищутся по окончанию: так находятся и многодневные события
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_user_end ON events(user_id, end_datetime)")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_events_group_end ON events(group_id, end_datetime)
+            WHERE group_id IS NOT NULL
+        """)
+
+        # Регулярные события хранятся правилом, а не строкой на каждое повторение
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS recurring_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                start_datetime TEXT NOT NULL,
+                freq TEXT NOT NULL,
+                interval INTEGER NOT NULL DEFAULT 1,
+                until TEXT,
+                location TEXT,
+                dances TEXT,
+                raw_text TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_recurring_user_id ON recurring_events(user_id)")
+        _add_column_if_missing(cursor, "recurring_events", "group_id", "INTEGER")
+        _add_column_if_missing(cursor, "recurring_events", "duration_minutes", "INTEGER")
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_recurring_group_id ON recurring_events(group_id)
+            WHERE group_id IS NOT NULL
+        """)
+
+        # Отменённые повторения регулярных событий
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS recurrence_exceptions (
+                rule_id INTEGER NOT NULL,
+                occurrence_datetime TEXT NOT NULL,
+                PRIMARY KEY (rule_id, occurrence_datetime)
+            ) WITHOUT ROWID
+        """)
+
+        _init_fts(cursor)
+        _init_versions(cursor)
+        _init_epoch(cursor)
+
+        # Утренние сводки: запуски по дням и доставка каждому пользователю,
+        # чтобы после перезапуска продолжить рассылку с того же места
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS digest_runs (
+                digest_date TEXT PRIMARY KEY,
+                started_at TEXT NOT NULL,
+                finished_at TEXT
+            )
+        """)
+        # Кто ведёт рассылку и до какого времени (захват, см. digest.py)
+        _add_column_if_missing(cursor, "digest_runs", "owner", "TEXT")
+        _add_column_if_missing(cursor, "digest_runs", "lease_until", "TEXT")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS digest_deliveries (
+                digest_date TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                sent_at TEXT NOT NULL,
+                PRIMARY KEY (digest_date, user_id)
+            ) WITHOUT ROWID
+        """)
+
+        # Слова словаря, добавленные без правки кода (см. vocabulary.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS vocabulary (
+                kind TEXT NOT NULL CHECK (kind IN ('dance', 'location')),
+                name TEXT NOT NULL,
+                variants TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (kind, name)
+            ) WITHOUT ROWID
+        """)
+
         conn.commit()
         logger.info("Database initialized successfully")
 
 
+def _bump_versions_sql(owner: str, group: str) -> str:
+    """Тело триггера: +1 к версии календаря владельца или всех участников ансамбля"""
+    return f"""
+        INSERT INTO user_versions (user_id, version, updated_at)
+        SELECT user_id, 1, CURRENT_TIMESTAMP FROM (
+            SELECT {owner} AS user_id WHERE {group} IS NULL
+            UNION
+            SELECT user_id FROM group_members WHERE group_id = {group}
+        ) WHERE 1
+        ON CONFLICT(user_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at;
+    """
+
+
+def _init_versions(cursor):
+    """Счётчик изменений календаря каждого пользователя.
+
+    Триггеры увеличивают версию при любом изменении видимых пользователю
+    событий, поэтому подписка на календарь может ответить 304 Not Modified
+    по одной строке user_versions, не сканируя события.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+    rule_owner = "(SELECT user_id FROM recurring_events WHERE id = {row}.rule_id)"
+    rule_group = "(SELECT group_id FROM recurring_events WHERE id = {row}.rule_id)"
+    triggers = {
+        "events": ("{row}.user_id", "{row}.group_id"),
+        "recurring_events": ("{row}.user_id", "{row}.group_id"),
+        "recurrence_exceptions": (rule_owner, rule_group),
+        "group_members": ("{row}.user_id", "NULL"),
+    }
+    for table, (owner, group) in triggers.items():
+        for suffix, when, rows in (("ai", "INSERT", ["new"]), ("ad", "DELETE", ["old"]),
+                                   ("au", "UPDATE", ["old", "new"])):
+            body = "".join(_bump_versions_sql(owner.format(row=row), group.format(row=row)) for row in rows)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {when} ON {table} BEGIN
+                    {body}
+                END
+            """)
+
+
+def _init_epoch(cursor):
+    """Эпоха базы: случайная метка, которая меняется при восстановлении из копии.
+
+    Вместе с базой откатываются и счётчики user_versions; эпоха в ETag
+    не даёт выдать после восстановления тег, уже выданный до него.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS database_epoch (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            epoch TEXT NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO database_epoch (id, epoch) VALUES (1, ?)", (secrets.token_hex(4),))
+
+
+def renew_epoch() -> bool:
+    """Новая эпоха базы (после восстановления из копии)"""
+    try:
+        with get_db_connection() as conn:
+            conn.execute("UPDATE database_epoch SET epoch = ? WHERE id = 1", (secrets.token_hex(4),))
+            conn.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Error renewing database epoch: {e}")
+        return False
+
+
+def bump_all_user_versions() -> bool:
+    """+1 к версии календаря каждого пользователя (после восстановления из копии)"""
+    try:
+        with get_db_connection() as conn:
+            conn.execute("UPDATE user_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP")
+            conn.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Error bumping calendar versions: {e}")
+        return False
+
+
+def get_user_version(user_id: int) -> Tuple[str, int, Optional[str]]:
+    """Эпоха базы, версия календаря пользователя и время последнего изменения (UTC)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT d.epoch, v.version, v.updated_at
+                FROM database_epoch d LEFT JOIN user_versions v ON v.user_id = ?
+            """, (user_id,))
+            row = cursor.fetchone()
+            return row['epoch'], row['version'] or 0, row['updated_at']
+    except Exception as e:
+        logger.error(f"Error getting calendar version for user {user_id}: {e}")
+        return "", 0, None
+
+
+def get_user_events_page(user_id: int, after: Optional[Tuple[str, int]] = None,
+                         limit: int = 500) -> List[Event]:
+    """Следующие limit видимых пользователю событий после after = (event_datetime, id).
+
+    Страницы вместо одного долгого курсора: между страницами соединение
+    закрыто, и медленный читатель (выгрузка по сети) не держит блокировку
+    чтения, мешая записи.
+    """
+    condition = "(e.event_datetime, e.id) > (:after_datetime, :after_id)" if after else "1"
+    after_datetime, after_id = after or (None, None)
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = _event_factory
+        cursor.execute(
+            _visible_events_sql(condition) + " ORDER BY event_datetime ASC, id ASC LIMIT :limit",
+            {"user_id": user_id, "after_datetime": after_datetime, "after_id": after_id, "limit": limit}
+        )
+        return cursor.fetchall()
+
+
+def get_stats(now: datetime) -> Dict[str, int]:
+    """Счётчики для /stats: total_events, upcoming_events, total_users"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT COUNT(*) AS total_events,
+                   COUNT(*) FILTER (WHERE event_datetime >= ?) AS upcoming_events,
+                   COUNT(DISTINCT user_id) AS total_users
+            FROM events
+        """, (now.isoformat(),))
+        return dict(cursor.fetchone())
+
+
+def get_user_rules(user_id: int) -> List[Tuple[sqlite3.Row, List[str]]]:
+    """Правила регулярных событий пользователя и его ансамблей с отменёнными датами"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT r.* FROM recurring_events r
+                WHERE r.user_id = :user_id AND r.group_id IS NULL
+                UNION ALL
+                SELECT r.* FROM group_members m
+                JOIN recurring_events r ON r.group_id = m.group_id
+                WHERE m.user_id = :user_id
+            """, {"user_id": user_id})
+            rules = cursor.fetchall()
+            if not rules:
+                return []
+            exceptions = _load_exceptions(cursor, [rule['id'] for rule in rules], datetime.min)
+            return [(rule, sorted(exceptions.get(rule['id'], ()))) for rule in rules]
+    except Exception as e:
+        logger.error(f"Error getting recurring events for user {user_id}: {e}")
+        return []
+
+
+def _add_column_if_missing(cursor, table: str, column: str, definition: str):
+    """Добавляет колонку в существующую таблицу (простая миграция)"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"Column {table}.{column} added")
+
+
+def _init_fts(cursor):
+    """Полнотекстовые индексы FTS5 по raw_text, месту и танцам.
+
+    Индексы внешнего содержимого (content='events' и 'recurring_events'):
+    сами тексты хранятся только в исходных таблицах, а триггеры держат
+    индексы в актуальном состоянии. Правила регулярных событий
+    индексируются отдельно, иначе /search их не находит.
+    """
+    for fts, table in (("events_fts", "events"), ("recurring_fts", "recurring_events")):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,))
+        exists = cursor.fetchone() is not None
+
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                raw_text, location, dances,
+                content='{table}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, raw_text, location, dances)
+                VALUES (new.id, new.raw_text, new.location, new.dances);
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, raw_text, location, dances)
+                VALUES ('delete', old.id, old.raw_text, old.location, old.dances);
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, raw_text, location, dances)
+                VALUES ('delete', old.id, old.raw_text, old.location, old.dances);
+                INSERT INTO {fts}(rowid, raw_text, location, dances)
+                VALUES (new.id, new.raw_text, new.location, new.dances);
+            END
+        """)
+
+        # Для существующей базы индексируем уже сохранённые записи
+        if not exists:
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            logger.info(f"Full-text index {fts} built")
+
+
+# Окончания, которые отрезаем у слов запроса, чтобы «Сюиту» находила «Сюита»
+_RUSSIAN_ENDINGS = (
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ую', 'юю',
+    'ом', 'ем', 'ах', 'ях', 'ов', 'ев',
+    'а', 'я', 'ы', 'и', 'у', 'ю', 'е', 'о', 'ь', 'й',
+)
+
+
+def fts_terms(text: str) -> List[str]:
+    """Основы слов запроса (без окончаний) для поиска по префиксу"""
+    terms = []
+    for word in re.findall(r'\w+', text.lower()):
+        for ending in _RUSSIAN_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= 3:
+                word = word[:-len(ending)]
+                break
+        terms.append(word)
+    return terms
+
+
+def _fts_query(text: str) -> str:
+    """Строит запрос FTS5: все слова по префиксу их основы"""
+    # Кавычки экранируют слово от синтаксиса FTS5, звёздочка — поиск по префиксу
+    return " ".join(f'"{term}"*' for term in fts_terms(text))
+
+
+def _visible_events_sql(condition: str) -> str:
+    """SELECT событий, которые видит пользователь (:user_id).
+
+    Личные события и события календарей его ансамблей собираются двумя
+    ветками UNION ALL: первая идёт по индексу (user_id, event_datetime),
+    вторая — от членства в группах по индексу (group_id, event_datetime).
+    condition — дополнительное условие на e.event_datetime.
+    """
+    return f"""
+        SELECT e.id, e.event_datetime, e.location, e.dances, e.raw_text, e.group_id, e.end_datetime
+        FROM events e
+        WHERE e.user_id = :user_id AND e.group_id IS NULL AND {condition}
+        UNION ALL
+        SELECT e.id, e.event_datetime, e.location, e.dances, e.raw_text, e.group_id, e.end_datetime
+        FROM group_members m
+        JOIN events e ON e.group_id = m.group_id
+        WHERE m.user_id = :user_id AND {condition}
+    """
+
+
+def _search_hit_factory(cursor, row) -> Event:
+    """row_factory поиска: последняя колонка — ранг, в Event не нужна"""
+    return Event(*row[:-1])
+
+
+def search_events(user_id: int, query: str, limit: int = 10, offset: int = 0,
+                  now: Optional[datetime] = None) -> List[Event]:
+    """Полнотекстовый поиск по событиям и регулярным событиям, лучшие совпадения первыми.
+
+    Найденное правило показывается ближайшим повторением (с rule_id).
+    """
+    fts_query = _fts_query(query)
+    if not fts_query:
+        return []
+
+    try:
+        now = now or clock.now()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = _search_hit_factory
+            # bm25: совпадения в месте и танцах весят больше, чем в тексте
+            cursor.execute("""
+                SELECT e.id, e.event_datetime, e.location, e.dances, e.raw_text, e.group_id, e.end_datetime,
+                       NULL AS rule_id, bm25(events_fts, 1.0, 2.0, 2.0) AS rank
+                FROM events_fts
+                JOIN events e ON e.id = events_fts.rowid
+                WHERE events_fts MATCH :query
+                AND ((e.user_id = :user_id AND e.group_id IS NULL)
+                     OR e.group_id IN (SELECT group_id FROM group_members WHERE user_id = :user_id))
+                UNION ALL
+                SELECT NULL, r.start_datetime, r.location, r.dances, r.raw_text, r.group_id, NULL,
+                       r.id, bm25(recurring_fts, 1.0, 2.0, 2.0)
+                FROM recurring_fts
+                JOIN recurring_events r ON r.id = recurring_fts.rowid
+                WHERE recurring_fts MATCH :query
+                AND ((r.user_id = :user_id AND r.group_id IS NULL)
+                     OR r.group_id IN (SELECT group_id FROM group_members WHERE user_id = :user_id))
+                ORDER BY rank, event_datetime DESC
+                LIMIT :limit OFFSET :offset
+            """, {"query": fts_query, "user_id": user_id, "limit": limit, "offset": offset})
+            hits = cursor.fetchall()
+
+            rule_ids = [ev.rule_id for ev in hits if ev.rule_id is not None]
+            if not rule_ids:
+                return hits
+            cursor = conn.cursor()
+            placeholders = ",".join("?" * len(rule_ids))
+            cursor.execute(f"""
+                SELECT id, start_datetime, freq, interval, until, location, dances, raw_text, group_id,
+                       duration_minutes
+                FROM recurring_events WHERE id IN ({placeholders})
+            """, rule_ids)
+            rules = {rule['id']: rule for rule in cursor.fetchall()}
+            exceptions = _load_exceptions(cursor, rule_ids, now)
+            # Правило показываем ближайшим повторением, а если они кончились — началом
+            return [next(iter_occurrences(rules[ev.rule_id], exceptions.get(ev.rule_id, set()), now), ev)
+                    if ev.rule_id is not None else ev for ev in hits]
+    except Exception as e:
+        logger.error(f"Error searching events for user {user_id}: {e}")
+        return []
+
+
 def add_event(user_id: int, event_datetime: datetime, location: Optional[str],
-              dances: List[str], raw_text: str) -> bool:
-    """Добавляет событие в базу данных"""
+              dances: List[str], raw_text: str, group_id: Optional[int] = None,
+              end_datetime: Optional[datetime] = None) -> bool:
+    """Добавляет событие в базу данных (group_id — в календарь ансамбля)"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO events (user_id, event_datetime, location, dances, raw_text)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO events (user_id, event_datetime, location, dances, raw_text, group_id, end_datetime)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
             """, (
                 user_id,
                 event_datetime.isoformat(),
                 location or "",
                 ",".join(dances) if dances else "",
-                raw_text
+                raw_text,
+                group_id,
+                end_datetime.isoformat() if end_datetime else None
             ))
             conn.commit()
             logger.info(f"Event added for user {user_id} at {event_datetime}")
@@ -77,36 +565,295 @@ def add_event(user_id: int, event_datetime: datetime, location: Optional[str],
         return False
 
 
-def get_upcoming_events(user_id: int, limit: int = 50) -> List:
-    """Получает предстоящие события пользователя"""
+def add_events_batch(user_id: int, events: List[Tuple[datetime, Optional[datetime], Optional[str], List[str], str]]) -> int:
+    """Добавляет пачку событий одной транзакцией, пропуская дубликаты.
+
+    Дубликат — событие того же пользователя в то же время и в том же
+    месте; проверка идёт по индексу (user_id, event_datetime) и видит
+    строки, вставленные раньше в этой же пачке. Возвращает число
+    добавленных событий.
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("""
+                INSERT INTO events (user_id, event_datetime, location, dances, raw_text, end_datetime)
+                SELECT :user_id, :start, :location, :dances, :raw_text, :end
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM events
+                    WHERE user_id = :user_id AND event_datetime = :start AND location = :location
+                )
+            """, ({
+                "user_id": user_id,
+                "start": start.isoformat(),
+                "end": end.isoformat() if end else None,
+                "location": location or "",
+                "dances": ",".join(dances) if dances else "",
+                "raw_text": raw_text,
+            } for start, end, location, dances, raw_text in events))
+            added = cursor.rowcount
+            conn.commit()
+            logger.info(f"Imported {added} of {len(events)} events for user {user_id}")
+            return added
+    except Exception as e:
+        logger.error(f"Error importing events for user {user_id}: {e}")
+        return 0
+
+
+def has_recurring_event(user_id: int, start_datetime: datetime, freq: str) -> bool:
+    """Есть ли у пользователя правило с тем же началом и частотой"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT 1 FROM recurring_events
+                WHERE user_id = ? AND start_datetime = ? AND freq = ?
+            """, (user_id, start_datetime.isoformat(), freq))
+            return cursor.fetchone() is not None
+    except Exception as e:
+        logger.error(f"Error checking recurring events for user {user_id}: {e}")
+        return False
+
+
+# Шаг повторения в днях для каждой частоты
+FREQ_DAYS = {"daily": 1, "weekly": 7}
+
+
+def add_recurring_event(user_id: int, start_datetime: datetime, freq: str, interval: int,
+                        location: Optional[str], dances: List[str], raw_text: str,
+                        until: Optional[datetime] = None, group_id: Optional[int] = None,
+                        duration_minutes: Optional[int] = None,
+                        exceptions: Optional[List[datetime]] = None) -> bool:
+    """Добавляет регулярное событие (одно правило вместо множества строк).
+
+    exceptions — сразу отменённые повторения (EXDATE при импорте).
+    """
+    if freq not in FREQ_DAYS:
+        logger.error(f"Unknown recurrence frequency {freq!r} for user {user_id}")
+        return False
+
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO recurring_events
+                    (user_id, start_datetime, freq, interval, until, location, dances, raw_text, group_id,
+                     duration_minutes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                user_id,
+                start_datetime.isoformat(),
+                freq,
+                interval,
+                until.isoformat() if until else None,
+                location or "",
+                ",".join(dances) if dances else "",
+                raw_text,
+                group_id,
+                duration_minutes
+            ))
+            if exceptions:
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO recurrence_exceptions (rule_id, occurrence_datetime) VALUES (?, ?)",
+                    [(cursor.lastrowid, moment.isoformat()) for moment in exceptions]
+                )
+            conn.commit()
+            logger.info(f"Recurring event ({freq}/{interval}) added for user {user_id} from {start_datetime}")
+            return True
+    except Exception as e:
+        logger.error(f"Error adding recurring event for user {user_id}: {e}")
+        return False
+
+
+def add_recurring_events_batch(user_id: int, rules: List[Tuple]) -> int:
+    """Добавляет пачку правил одной транзакцией, пропуская дубликаты.
+
+    Правило — (начало, freq, interval, until, место, танцы, текст,
+    длительность в минутах, отменённые повторения). Дубликат — правило
+    с тем же началом и частотой, как в has_recurring_event. Возвращает
+    число добавленных правил.
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            added = 0
+            for start, freq, interval, until, location, dances, raw_text, duration_minutes, exceptions in rules:
+                if freq not in FREQ_DAYS:
+                    logger.error(f"Unknown recurrence frequency {freq!r} for user {user_id}")
+                    continue
+                cursor.execute("""
+                    INSERT INTO recurring_events
+                        (user_id, start_datetime, freq, interval, until, location, dances, raw_text,
+                         duration_minutes)
+                    SELECT :user_id, :start, :freq, :interval, :until, :location, :dances, :raw_text, :duration
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM recurring_events
+                        WHERE user_id = :user_id AND start_datetime = :start AND freq = :freq
+                    )
+                """, {
+                    "user_id": user_id,
+                    "start": start.isoformat(),
+                    "freq": freq,
+                    "interval": interval,
+                    "until": until.isoformat() if until else None,
+                    "location": location or "",
+                    "dances": ",".join(dances) if dances else "",
+                    "raw_text": raw_text,
+                    "duration": duration_minutes,
+                })
+                if not cursor.rowcount:
+                    continue
+                added += 1
+                if exceptions:
+                    cursor.executemany(
+                        "INSERT OR IGNORE INTO recurrence_exceptions (rule_id, occurrence_datetime) VALUES (?, ?)",
+                        [(cursor.lastrowid, moment.isoformat()) for moment in exceptions]
+                    )
+            conn.commit()
+            logger.info(f"Imported {added} of {len(rules)} recurring events for user {user_id}")
+            return added
+    except Exception as e:
+        logger.error(f"Error importing recurring events for user {user_id}: {e}")
+        return 0
+
+
+def skip_occurrence(rule_id: int, occurrence_datetime: str) -> bool:
+    """Отменяет одно повторение регулярного события"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT id, event_datetime, location, dances, raw_text
-                FROM events 
-                WHERE user_id = ? AND event_datetime >= ?
-                ORDER BY event_datetime ASC
-                LIMIT ?
-            """, (user_id, datetime.now().isoformat(), limit))
-            rows = cursor.fetchall()
+                INSERT OR IGNORE INTO recurrence_exceptions (rule_id, occurrence_datetime)
+                VALUES (?, ?)
+            """, (rule_id, occurrence_datetime))
+            conn.commit()
+            logger.info(f"Occurrence {occurrence_datetime} of rule {rule_id} skipped")
+            return True
+    except Exception as e:
+        logger.error(f"Error skipping occurrence of rule {rule_id}: {e}")
+        return False
+
 
-            result = []
-            for row in rows:
-                result.append((
-                    row['id'],
-                    row['event_datetime'],
-                    row['location'],
-                    row['dances'],
-                    row['raw_text']
-                ))
-            return result
+def delete_recurring_event(rule_id: int) -> bool:
+    """Удаляет регулярное событие целиком вместе с исключениями"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM recurrence_exceptions WHERE rule_id = ?", (rule_id,))
+            cursor.execute("DELETE FROM recurring_events WHERE id = ?", (rule_id,))
+            conn.commit()
+            logger.info(f"Recurring event {rule_id} deleted")
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Error deleting recurring event {rule_id}: {e}")
+        return False
+
+
+def rule_duration(rule) -> timedelta:
+    """Длительность одного повторения правила"""
+    return timedelta(minutes=rule['duration_minutes'] or DEFAULT_DURATION_MINUTES)
+
+
+def iter_occurrences(rule: sqlite3.Row, exceptions: Set[str], start: datetime,
+                      end: Optional[datetime] = None) -> Iterator[Event]:
+    """Лениво разворачивает правило в повторения внутри [start, end]"""
+    first = datetime.fromisoformat(rule['start_datetime'])
+    step = timedelta(days=FREQ_DAYS[rule['freq']] * rule['interval'])
+    duration = rule_duration(rule)
+    if rule['until']:
+        until = datetime.fromisoformat(rule['until'])
+        end = until if end is None else min(end, until)
+
+    # Сразу перескакиваем к первому повторению не раньше start
+    current = first
+    if start > first:
+        current = first + -((first - start) // step) * step
+
+    while end is None or current <= end:
+        occurrence = current.isoformat()
+        if occurrence not in exceptions:
+            yield Event(None, occurrence, rule['location'], rule['dances'], rule['raw_text'],
+                        group_id=rule['group_id'], end_datetime=(current + duration).isoformat(),
+                        rule_id=rule['id'])
+        current += step
+
+
+_RULE_COLUMNS = """r.id, r.start_datetime, r.freq, r.interval, r.until, r.location, r.dances, r.raw_text,
+               r.group_id, r.duration_minutes"""
+
+
+def _visible_rules_sql(condition: str) -> str:
+    """SELECT правил пользователя (:user_id) и его ансамблей; condition — условие на r"""
+    return f"""
+        SELECT {_RULE_COLUMNS}
+        FROM recurring_events r
+        WHERE r.user_id = :user_id AND r.group_id IS NULL AND {condition}
+        UNION ALL
+        SELECT {_RULE_COLUMNS}
+        FROM group_members m
+        JOIN recurring_events r ON r.group_id = m.group_id
+        WHERE m.user_id = :user_id AND {condition}
+    """
+
+
+def _recurring_occurrences(conn, user_id: int, start: datetime,
+                           end: Optional[datetime] = None) -> List[Iterator[Event]]:
+    """Генераторы повторений всех правил пользователя и его ансамблей, пересекающих окно"""
+    window = {"user_id": user_id, "start": start.isoformat(), "end": (end or datetime.max).isoformat()}
+    cursor = conn.cursor()
+    cursor.execute(_visible_rules_sql("r.start_datetime <= :end AND (r.until IS NULL OR r.until >= :start)"),
+                   window)
+    rules = cursor.fetchall()
+    if not rules:
+        return []
+
+    exceptions = _load_exceptions(cursor, [rule['id'] for rule in rules], start, end)
+    return [iter_occurrences(rule, exceptions.get(rule['id'], set()), start, end) for rule in rules]
+
+
+def _load_exceptions(cursor, rule_ids: List[int], start: datetime,
+                     end: Optional[datetime] = None) -> Dict[int, Set[str]]:
+    """Отменённые повторения указанных правил внутри окна"""
+    placeholders = ",".join("?" * len(rule_ids))
+    cursor.execute(f"""
+        SELECT rule_id, occurrence_datetime
+        FROM recurrence_exceptions
+        WHERE rule_id IN ({placeholders}) AND occurrence_datetime BETWEEN ? AND ?
+    """, (*rule_ids, start.isoformat(), (end or datetime.max).isoformat()))
+    exceptions: Dict[int, Set[str]] = {}
+    for row in cursor.fetchall():
+        exceptions.setdefault(row['rule_id'], set()).add(row['occurrence_datetime'])
+    return exceptions
+
+
+def merge_occurrences(events: List[Event], occurrences: List[Iterator[Event]],
+                       limit: Optional[int] = None) -> List[Event]:
+    """Сливает обычные события и повторения в один список по времени"""
+    if not occurrences:
+        return events[:limit] if limit is not None else events
+    merged = heapq.merge(events, *occurrences, key=attrgetter('dt'))
+    return list(islice(merged, limit))
+
+
+def get_upcoming_events(user_id: int, limit: int = 50, now: Optional[datetime] = None) -> List[Event]:
+    """Получает предстоящие события пользователя"""
+    try:
+        now = now or clock.now()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = _event_factory
+            cursor.execute(
+                _visible_events_sql("e.event_datetime >= :start") + " ORDER BY event_datetime ASC LIMIT :limit",
+                {"user_id": user_id, "start": now.isoformat(), "limit": limit}
+            )
+            events = cursor.fetchall()
+            return merge_occurrences(events, _recurring_occurrences(conn, user_id, now), limit)
     except Exception as e:
         logger.error(f"Error getting events for user {user_id}: {e}")
         return []
 
 
-def get_events_for_notification(user_id: int, target_date: datetime) -> List:
+def get_events_for_notification(user_id: int, target_date: datetime) -> List[Event]:
     """Получает события пользователя на указанную дату (для уведомлений)"""
     try:
         start_of_day = target_date.replace(hour=0, minute=0, second=0, microsecond=0)
@@ -114,86 +861,106 @@ def get_events_for_notification(user_id: int, target_date: datetime) -> List:
 
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, event_datetime, location, dances, raw_text
-                FROM events 
-                WHERE user_id = ? AND event_datetime BETWEEN ? AND ?
-                ORDER BY event_datetime ASC
-            """, (user_id, start_of_day.isoformat(), end_of_day.isoformat()))
-            rows = cursor.fetchall()
-
-            result = []
-            for row in rows:
-                result.append((
-                    row['id'],
-                    row['event_datetime'],
-                    row['location'],
-                    row['dances'],
-                    row['raw_text']
-                ))
-            return result
+            cursor.row_factory = _event_factory
+            cursor.execute(
+                _visible_events_sql("e.event_datetime BETWEEN :start AND :end") + " ORDER BY event_datetime ASC",
+                {"user_id": user_id, "start": start_of_day.isoformat(), "end": end_of_day.isoformat()}
+            )
+            events = cursor.fetchall()
+            return merge_occurrences(events, _recurring_occurrences(conn, user_id, start_of_day, end_of_day))
     except Exception as e:
         logger.error(f"Error getting events for notification for user {user_id}: {e}")
         return []
 
 
-def get_all_events(user_id: int) -> List:
+def get_all_events(user_id: int) -> List[Event]:
     """Получает ВСЕ события пользователя (для отладки)"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, event_datetime, location, dances, raw_text
-                FROM events 
-                WHERE user_id = ?
-                ORDER BY event_datetime ASC
-            """, (user_id,))
-            rows = cursor.fetchall()
-
-            result = []
-            for row in rows:
-                result.append((
-                    row['id'],
-                    row['event_datetime'],
-                    row['location'],
-                    row['dances'],
-                    row['raw_text']
-                ))
-            return result
+            cursor.row_factory = _event_factory
+            cursor.execute(
+                _visible_events_sql("1") + " ORDER BY event_datetime ASC",
+                {"user_id": user_id}
+            )
+            return cursor.fetchall()
     except Exception as e:
         logger.error(f"Error getting all events for user {user_id}: {e}")
         return []
 
 
-def get_events_by_date_range(user_id: int, start_date: datetime, end_date: datetime) -> List:
+def get_events_by_date_range(user_id: int, start_date: datetime, end_date: datetime) -> List[Event]:
     """Получает события пользователя за указанный период"""
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, event_datetime, location, dances, raw_text
-                FROM events 
-                WHERE user_id = ? 
-                AND event_datetime BETWEEN ? AND ?
-                ORDER BY event_datetime ASC
-            """, (user_id, start_date.isoformat(), end_date.isoformat()))
-            rows = cursor.fetchall()
-
-            result = []
-            for row in rows:
-                result.append((
-                    row['id'],
-                    row['event_datetime'],
-                    row['location'],
-                    row['dances'],
-                    row['raw_text']
-                ))
-            return result
+            cursor.row_factory = _event_factory
+            cursor.execute(
+                _visible_events_sql("e.event_datetime BETWEEN :start AND :end") + " ORDER BY event_datetime ASC",
+                {"user_id": user_id, "start": start_date.isoformat(), "end": end_date.isoformat()}
+            )
+            events = cursor.fetchall()
+            return merge_occurrences(events, _recurring_occurrences(conn, user_id, start_date, end_date))
     except Exception as e:
         logger.error(f"Error getting events for date range: {e}")
         return []
 
 
+def get_overlapping_events(user_id: int, start: datetime, end: datetime,
+                           group_id: Optional[int] = None) -> List[Event]:
+    """События и повторения, которые идут хотя бы часть окна [start, end].
+
+    Пересечение считается по настоящему окончанию, поэтому находятся и
+    многодневные события. Индекс по end_datetime ограничивает поиск
+    событиями, которые кончаются после start, а не всей историей.
+    group_id — только календарь этого ансамбля, иначе всё, что видит пользователь.
+    """
+    window = {
+        "user_id": user_id, "group_id": group_id, "start": start.isoformat(), "end": end.isoformat(),
+        "default_start": (start - timedelta(minutes=DEFAULT_DURATION_MINUTES)).isoformat(),
+        "default_duration": DEFAULT_DURATION_MINUTES,
+    }
+    conditions = (
+        "e.end_datetime > :start AND e.event_datetime < :end",
+        # У старых записей окончания нет — длительность по умолчанию
+        "e.end_datetime IS NULL AND e.event_datetime > :default_start AND e.event_datetime < :end",
+    )
+    # Правило кончилось (until) раньше, чем могло бы задеть окно, — не нужно
+    rule_condition = """r.start_datetime < :end AND (r.until IS NULL OR
+        strftime('%Y-%m-%dT%H:%M:%S', r.until, '+' || COALESCE(r.duration_minutes, :default_duration) || ' minutes')
+        > :start)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = _event_factory
+            if group_id is None:
+                sql = " UNION ALL ".join(_visible_events_sql(condition) for condition in conditions)
+                rules_sql = _visible_rules_sql(rule_condition)
+            else:
+                sql = " UNION ALL ".join(f"""
+                    SELECT e.id, e.event_datetime, e.location, e.dances, e.raw_text, e.group_id, e.end_datetime
+                    FROM events e WHERE e.group_id = :group_id AND {condition}
+                """ for condition in conditions)
+                rules_sql = f"SELECT {_RULE_COLUMNS} FROM recurring_events r WHERE r.group_id = :group_id AND {rule_condition}"
+            cursor.execute(sql + " ORDER BY event_datetime ASC", window)
+            events = cursor.fetchall()
+
+            cursor = conn.cursor()
+            cursor.execute(rules_sql, window)
+            rules = cursor.fetchall()
+            if not rules:
+                return events
+            # Повторение задевает окно, если начинается не раньше start минус длительность правила
+            longest = max(rule_duration(rule) for rule in rules)
+            exceptions = _load_exceptions(cursor, [rule['id'] for rule in rules], start - longest, end)
+            occurrences = [iter_occurrences(rule, exceptions.get(rule['id'], set()), start - rule_duration(rule), end)
+                           for rule in rules]
+            return [ev for ev in merge_occurrences(events, occurrences) if ev.dt < end and ev.end > start]
+    except Exception as e:
+        logger.error(f"Error getting overlapping events for user {user_id}: {e}")
+        return []
+
+
 def delete_event(event_id: int) -> bool:
     """Удаляет событие"""
     try:
@@ -208,14 +975,276 @@ def delete_event(event_id: int) -> bool:
         return False
 
 
-def get_today_events(user_id: int) -> List:
+def get_today_events(user_id: int, now: Optional[datetime] = None) -> List[Event]:
     """Получает события на сегодня"""
     try:
-        now = datetime.now()
+        now = now or clock.now()
         today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
         today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
 
         return get_events_by_date_range(user_id, today_start, today_end)
     except Exception as e:
         logger.error(f"Error getting today's events: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+def create_group(owner_id: int, name: str) -> Optional[sqlite3.Row]:
+    """Создаёт ансамбль; создатель становится его руководителем"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            invite_code = secrets.token_urlsafe(6)
+            cursor.execute("""
+                INSERT INTO groups (name, owner_id, invite_code) VALUES (?, ?, ?)
+            """, (name, owner_id, invite_code))
+            group_id = cursor.lastrowid
+            cursor.execute("""
+                INSERT INTO group_members (group_id, user_id, role) VALUES (?, ?, 'leader')
+            """, (group_id, owner_id))
+            conn.commit()
+            logger.info(f"Group {group_id} created by user {owner_id}")
+            cursor.execute("SELECT id, name, invite_code FROM groups WHERE id = ?", (group_id,))
+            return cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error creating group for user {owner_id}: {e}")
+        return None
+
+
+def join_group(user_id: int, invite_code: str) -> Optional[sqlite3.Row]:
+    """Добавляет пользователя в ансамбль по коду приглашения"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, invite_code FROM groups WHERE invite_code = ?", (invite_code,))
+            group = cursor.fetchone()
+            if group is None:
+                return None
+            cursor.execute("""
+                INSERT OR IGNORE INTO group_members (group_id, user_id) VALUES (?, ?)
+            """, (group['id'], user_id))
+            conn.commit()
+            logger.info(f"User {user_id} joined group {group['id']}")
+            return group
+    except Exception as e:
+        logger.error(f"Error joining group for user {user_id}: {e}")
+        return None
+
+
+def leave_group(user_id: int, group_id: int) -> bool:
+    """Выход из ансамбля"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM group_members WHERE group_id = ? AND user_id = ?", (group_id, user_id))
+            conn.commit()
+            logger.info(f"User {user_id} left group {group_id}")
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Error leaving group {group_id} for user {user_id}: {e}")
+        return False
+
+
+def get_user_groups(user_id: int) -> List[sqlite3.Row]:
+    """Ансамбли пользователя с его ролью и числом участников"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT g.id, g.name, g.invite_code, m.role,
+                       (SELECT COUNT(*) FROM group_members c WHERE c.group_id = g.id) AS members
+                FROM group_members m
+                JOIN groups g ON g.id = m.group_id
+                WHERE m.user_id = ?
+                ORDER BY g.name
+            """, (user_id,))
+            return cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Error getting groups for user {user_id}: {e}")
+        return []
+
+
+def get_member_role(group_id: int, user_id: int) -> Optional[str]:
+    """Роль пользователя в ансамбле ('leader' / 'member') или None"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT role FROM group_members WHERE group_id = ? AND user_id = ?
+            """, (group_id, user_id))
+            row = cursor.fetchone()
+            return row['role'] if row else None
+    except Exception as e:
+        logger.error(f"Error getting role in group {group_id} for user {user_id}: {e}")
+        return None
+
+
+def iter_notification_recipients(start: datetime, end: datetime) -> Iterator[Tuple[int, Event]]:
+    """Все пары (получатель, событие) в окне [start, end], по user_id и времени.
+
+    Один проход по индексу event_datetime: личное событие получает его
+    владелец, событие ансамбля размножается по участникам через LEFT JOIN.
+    Повторения регулярных событий разворачиваются и вливаются в тот же поток.
+    """
+    window = {"start": start.isoformat(), "end": end.isoformat()}
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        # Повторения правил в окне (их немного — окно обычно один день)
+        cursor.execute("""
+            SELECT r.id, r.user_id, r.start_datetime, r.freq, r.interval, r.until,
+                   r.location, r.dances, r.raw_text, r.group_id, r.duration_minutes
+            FROM recurring_events r
+            WHERE r.start_datetime <= :end AND (r.until IS NULL OR r.until >= :start)
+        """, window)
+        rules = cursor.fetchall()
+        occurrences = []
+        if rules:
+            exceptions = _load_exceptions(cursor, [rule['id'] for rule in rules], start, end)
+            for rule in rules:
+                rule_events = list(iter_occurrences(rule, exceptions.get(rule['id'], set()), start, end))
+                if not rule_events:
+                    continue
+                if rule['group_id'] is None:
+                    recipients = [rule['user_id']]
+                else:
+                    cursor.execute("SELECT user_id FROM group_members WHERE group_id = ?", (rule['group_id'],))
+                    recipients = [row['user_id'] for row in cursor.fetchall()]
+                occurrences.extend((recipient, ev) for recipient in recipients for ev in rule_events)
+        occurrences.sort(key=lambda pair: (pair[0], pair[1].event_datetime))
+
+        cursor.execute("""
+            SELECT COALESCE(m.user_id, e.user_id) AS recipient,
+                   e.id, e.event_datetime, e.location, e.dances, e.raw_text, e.group_id, e.end_datetime
+            FROM events e
+            LEFT JOIN group_members m ON m.group_id = e.group_id
+            WHERE e.event_datetime BETWEEN :start AND :end
+            ORDER BY recipient, e.event_datetime
+        """, window)
+        rows = ((row['recipient'], Event(*tuple(row)[1:])) for row in cursor)
+
+        yield from heapq.merge(rows, occurrences, key=lambda pair: (pair[0], pair[1].event_datetime))
+
+
+def start_digest_run(digest_date: str, owner: str, lease_until: datetime) -> bool:
+    """Захватывает рассылку сводки за день до lease_until.
+
+    True, если рассылка новая или прервана и её захват истёк; False,
+    если она закончена или её ведёт другой экземпляр.
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO digest_runs (digest_date, started_at, owner, lease_until) VALUES (?, ?, ?, ?)
+                ON CONFLICT(digest_date) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until
+                WHERE finished_at IS NULL AND (lease_until IS NULL OR lease_until < excluded.started_at)
+            """, (digest_date, clock.now().isoformat(), owner, lease_until.isoformat()))
+            conn.commit()
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Error starting digest run {digest_date}: {e}")
+        return False
+
+
+def extend_digest_lease(digest_date: str, owner: str, lease_until: datetime) -> bool:
+    """Продлевает захват рассылки; False, если он перешёл к другому экземпляру"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE digest_runs SET lease_until = ?
+                WHERE digest_date = ? AND owner = ? AND finished_at IS NULL
+            """, (lease_until.isoformat(), digest_date, owner))
+            conn.commit()
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Error extending digest lease {digest_date}: {e}")
+        return False
+
+
+def finish_digest_run(digest_date: str):
+    """Отмечает, что сводка за день разослана всем"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE digest_runs SET finished_at = ? WHERE digest_date = ?",
+                           (clock.now().isoformat(), digest_date))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error finishing digest run {digest_date}: {e}")
+
+
+def is_digest_run_unfinished(digest_date: str) -> bool:
+    """Рассылка за день начиналась, но не дошла до конца (бот перезапускался)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT finished_at FROM digest_runs WHERE digest_date = ?", (digest_date,))
+            row = cursor.fetchone()
+            return row is not None and row['finished_at'] is None
+    except Exception as e:
+        logger.error(f"Error checking digest run {digest_date}: {e}")
+        return False
+
+
+def get_digest_recipients_done(digest_date: str) -> Set[int]:
+    """Пользователи, которым сводка за день уже доставлена (или их не достать)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT user_id FROM digest_deliveries
+                WHERE digest_date = ? AND status IN ('sent', 'blocked')
+            """, (digest_date,))
+            return {row['user_id'] for row in cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Error getting digest deliveries for {digest_date}: {e}")
+        return set()
+
+
+def record_digest_delivery(digest_date: str, user_id: int, status: str):
+    """Сохраняет результат отправки сводки пользователю"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO digest_deliveries (digest_date, user_id, status, sent_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(digest_date, user_id) DO UPDATE SET status = excluded.status, sent_at = excluded.sent_at
+            """, (digest_date, user_id, status, clock.now().isoformat()))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Error recording digest delivery to {user_id}: {e}")
+
+
+def get_vocabulary_entries() -> List[Tuple[str, str, Optional[str]]]:
+    """Записи словаря из базы: (kind, name, variants через запятую)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT kind, name, variants FROM vocabulary ORDER BY kind, name")
+            return [tuple(row) for row in cursor.fetchall()]
+    except Exception as e:
+        logger.error(f"Error getting vocabulary: {e}")
+        return []
+
+
+def add_vocabulary_entry(kind: str, name: str, variants: List[str]) -> bool:
+    """Добавляет танец или место в словарь (варианты дописываются к уже известным)"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO vocabulary (kind, name, variants) VALUES (?, ?, ?)
+                ON CONFLICT(kind, name) DO UPDATE SET
+                    variants = CASE
+                        WHEN excluded.variants = '' THEN variants
+                        WHEN variants IS NULL OR variants = '' THEN excluded.variants
+                        ELSE variants || ',' || excluded.variants
+                    END
+            """, (kind, name, ",".join(variants)))
+            conn.commit()
+            logger.info(f"Vocabulary {kind} {name!r} saved")
+            return True
+    except Exception as e:
+        logger.error(f"Error saving vocabulary {kind} {name!r}: {e}")
+        return False
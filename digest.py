@@ -0,0 +1,151 @@
+# digest.py
+"""
+Утренняя сводка: события на сегодня всем пользователям сразу.
+
+События дня идут по индексу event_datetime, уже отсортированными по
+получателю (iter_notification_recipients), и группируются по user_id.
+SQLite читает день целиком до начала рассылки: пока открыт читающий
+запрос, SQLite (журнал отката) не даёт ничего записать — ни новые
+события, ни отметки о доставке. PostgreSQL отдаёт день страницами по
+получателям, так что в памяти только одна страница, сколько бы
+пользователей ни было.
+
+Результат каждой отправки записывается в digest_deliveries; если бот
+перезапустился посреди рассылки, она продолжается и пропускает тех,
+кому сводка уже ушла.
+
+Рассылку за день ведёт один экземпляр бота — тот, кто захватил её в
+digest_runs (start_digest_run). Захват действует DIGEST_LEASE и
+продлевается по ходу рассылки; если экземпляр упал, прерванную
+рассылку подхватывает другой, но не раньше, чем захват истечёт.
+"""
+import asyncio
+import logging
+import os
+import socket
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+import clock
+from database import Event
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+# Пауза между сообщениями: лимит Telegram — около 30 сообщений в секунду
+DIGEST_SEND_INTERVAL = 0.05
+
+# Сколько действует захват рассылки без продления
+DIGEST_LEASE = timedelta(minutes=5)
+
+# Имя этого экземпляра в digest_runs.owner
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def parse_digest_time(value: str) -> Optional[time]:
+    """«08:00» → time(8, 0); пустая или кривая строка выключает сводку"""
+    if not value:
+        return None
+    try:
+        return time.fromisoformat(value.strip())
+    except ValueError:
+        logger.error(f"Неверное время сводки {value!r}, сводка выключена")
+        return None
+
+
+async def _iter_groups(day: date, done: set) -> AsyncIterator[Tuple[int, List[Event]]]:
+    """Группы (user_id, [события]) за день, кроме уже получивших сводку"""
+    start = datetime.combine(day, time.min)
+    end = datetime.combine(day, time.max)
+    current, events = None, []
+    async for user_id, ev in get_storage().iter_notification_recipients(start, end):
+        if user_id != current:
+            if events and current not in done:
+                yield current, events
+            current, events = user_id, []
+        events.append(ev)
+    if events and current not in done:
+        yield current, events
+
+
+async def _deliver(bot, user_id: int, text: str) -> str:
+    """Отправляет сводку; статус для digest_deliveries"""
+    for _ in range(2):
+        try:
+            await bot.send_message(user_id, text)
+            return "sent"
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta)
+                                else e.retry_after)
+        except Forbidden:
+            # Пользователь заблокировал бота — повторять бессмысленно
+            return "blocked"
+        except TelegramError as e:
+            logger.error(f"Не удалось отправить сводку {user_id}: {e}")
+            return "failed"
+    return "failed"
+
+
+async def send_daily_digest(bot, day: date, render: Callable[[List[Event]], str]) -> Optional[Counter]:
+    """Рассылает сводку за day всем, у кого есть события; возвращает счётчики статусов.
+
+    None, если рассылку за день не удалось захватить: она уже закончена
+    или её ведёт другой экземпляр.
+    """
+    storage = get_storage()
+    digest_date = day.isoformat()
+    lease_until = clock.now() + DIGEST_LEASE
+    if not await storage.start_digest_run(digest_date, INSTANCE_ID, lease_until):
+        logger.info(f"Сводка за {digest_date} уже разослана или её рассылает другой экземпляр")
+        return None
+    done = await storage.get_digest_recipients_done(digest_date)
+    stats = Counter(skipped=len(done))
+    async for user_id, events in _iter_groups(day, done):
+        # Продлеваем захват заранее, пока его не счёл истёкшим другой экземпляр
+        if clock.now() >= lease_until - DIGEST_LEASE / 2:
+            lease_until = clock.now() + DIGEST_LEASE
+            if not await storage.extend_digest_lease(digest_date, INSTANCE_ID, lease_until):
+                logger.warning(f"Рассылку сводки за {digest_date} перехватил другой экземпляр")
+                return stats
+        status = await _deliver(bot, user_id, render(events))
+        # Отметка сразу после отправки: после перезапуска этот пользователь будет пропущен
+        await storage.record_digest_delivery(digest_date, user_id, status)
+        stats[status] += 1
+        await asyncio.sleep(DIGEST_SEND_INTERVAL)
+
+    await storage.finish_digest_run(digest_date)
+    logger.info(f"Сводка за {digest_date}: {dict(stats)}")
+    return stats
+
+
+async def _run_safely(bot, day: date, render) -> Optional[Counter]:
+    try:
+        return await send_daily_digest(bot, day, render)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка рассылки сводки за {day}: {e}", exc_info=e)
+        return None
+
+
+async def digest_loop(bot, at: time, render: Callable[[List[Event]], str]):
+    """Каждый день в at рассылает сводку; после перезапуска дорассылает прерванную"""
+    now = clock.now()
+    if now.time() >= at:
+        # Прерванную рассылку продолжаем, как только истечёт захват упавшего экземпляра
+        while await get_storage().is_digest_run_unfinished(now.date().isoformat()):
+            logger.info("Продолжаю прерванную рассылку сводки")
+            if await _run_safely(bot, now.date(), render) is not None:
+                break
+            await asyncio.sleep(DIGEST_LEASE.total_seconds())
+
+    while True:
+        now = clock.now()
+        run_at = datetime.combine(now.date(), at)
+        if run_at <= now:
+            run_at += timedelta(days=1)
+        await asyncio.sleep((run_at - now).total_seconds())
+        await _run_safely(bot, run_at.date(), render)
@@ -0,0 +1,160 @@
+# fuzzy.py
+"""
+Нечёткий поиск по словарю танцев и площадок.
+
+BK-дерево раскладывает слова словаря по расстоянию Левенштейна, и при
+поиске с допуском k обходятся только ветви с расстоянием в [d-k, d+k],
+так что проверяется малая часть словаря. Допуск зависит от длины слова:
+короткие слова сравниваются только точно, иначе «вальс» совпадал бы
+с чем угодно; два исправления допускаются только во фразах из
+нескольких слов. Первая буква должна совпадать: опечатки в ней редки,
+а обычные слова с общим окончанием так не подходят.
+"""
+from typing import Dict, List, Optional, Tuple
+
+
+def _pattern(word: str) -> Tuple[Dict[str, int], int]:
+    """Битовые маски позиций каждой буквы слова (для _distance)"""
+    masks: Dict[str, int] = {}
+    for i, ch in enumerate(word):
+        masks[ch] = masks.get(ch, 0) | (1 << i)
+    return masks, len(word)
+
+
+def _distance(pattern: Tuple[Dict[str, int], int], text: str) -> int:
+    """Расстояние Левенштейна бит-параллельным алгоритмом Майерса (Hyyrö).
+
+    Столбец матрицы хранится разностями в двух целых, так что на каждую
+    букву text приходится десяток битовых операций вместо цикла по pattern.
+    """
+    masks, m = pattern
+    if not m:
+        return len(text)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = full, 0, m
+    for ch in text:
+        eq = masks.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv & full
+    return score
+
+
+def levenshtein(a: str, b: str, limit: Optional[int] = None) -> int:
+    """Расстояние Левенштейна (вставка, удаление, замена).
+
+    Если задан limit, всё, что дальше, возвращается как limit + 1.
+    """
+    if limit is not None and abs(len(a) - len(b)) > limit:
+        return limit + 1
+    distance = _distance(_pattern(a), b)
+    return distance if limit is None else min(distance, limit + 1)
+
+
+def max_edits(word: str) -> int:
+    """Допустимое число опечаток для слова или фразы такой длины.
+
+    Одно длинное слово за два исправления слишком часто становится
+    другим словом («субботний» → «субботеи»), поэтому два — только
+    во фразах.
+    """
+    length = len(word)
+    if length < 5:
+        return 0
+    if length < 9 or ' ' not in word:
+        return 1
+    return 2
+
+
+# Сколько разных запросов помнит каждое дерево (в сообщениях слова повторяются)
+CACHE_SIZE = 4096
+
+
+class BKTree:
+    """BK-дерево над словами; каждому слову сопоставлено значение"""
+
+    __slots__ = ('_root', '_values', '_cache', 'size')
+
+    def __init__(self, items: Dict[str, str]):
+        # Узел: (слово, {расстояние: дочерний узел})
+        self._root: Optional[Tuple[str, dict]] = None
+        self._values = dict(items)
+        self._cache: Dict[str, Optional[str]] = {}
+        self.size = 0
+        # Сортировка делает дерево воспроизводимым от запуска к запуску
+        for word in sorted(self._values):
+            self._add(word)
+
+    def _add(self, word: str):
+        self.size += 1
+        if self._root is None:
+            self._root = (word, {})
+            return
+        node = self._root
+        while True:
+            distance = levenshtein(word, node[0])
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Все слова словаря не дальше max_distance: [(расстояние, слово)]"""
+        if self._root is None:
+            return []
+        pattern = _pattern(word)
+        found = []
+        stack = [self._root]
+        while stack:
+            node_word, children = stack.pop()
+            # Дальше этого расстояния ни сам узел, ни его ветви не подходят:
+            # разница длин уже даёт нижнюю оценку, и считать не нужно
+            limit = max_distance + (max(children) if children else 0)
+            if abs(len(word) - len(node_word)) > limit:
+                distance = limit + 1
+            else:
+                distance = _distance(pattern, node_word)
+            if distance <= max_distance:
+                found.append((distance, node_word))
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for edge, child in children.items() if low <= edge <= high)
+        found.sort()
+        return found
+
+    def closest(self, word: str, max_distance: Optional[int] = None) -> Optional[str]:
+        """Значение ближайшего слова или None (допуск по умолчанию — max_edits)"""
+        if max_distance is None:
+            max_distance = max_edits(word)
+        if word in self._values:
+            return self._values[word]
+        if max_distance == 0:
+            return None
+
+        key = f"{max_distance}:{word}"
+        if key in self._cache:
+            return self._cache[key]
+
+        found = [(d, w) for d, w in self.search(word, max_distance) if w[0] == word[0]]
+        value = None
+        if found:
+            # При равных расстояниях разные значения — неоднозначно, не угадываем
+            best = found[0][0]
+            values = {self._values[w] for d, w in found if d == best}
+            value = values.pop() if len(values) == 1 else None
+
+        if len(self._cache) >= CACHE_SIZE:
+            self._cache.clear()
+        self._cache[key] = value
+        return value
+
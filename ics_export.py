@@ -0,0 +1,210 @@
+# ics_export.py
+"""
+Выгрузка календаря в формате iCalendar (.ics).
+
+Документ собирается потоком: события читаются из хранилища страницами
+и сразу превращаются в строки VEVENT, так что память не зависит от их
+числа, а между страницами хранилище свободно для записи.
+Регулярные события выгружаются одним VEVENT с RRULE/EXDATE, а не
+развёрнутыми повторениями.
+
+Подписка (FEED_PORT) — отдельный HTTP-сервер на tornado рядом с webhook.
+Календарные приложения опрашивают ссылку часто; ETag и Last-Modified
+берутся из счётчика изменений user_versions, поэтому ответ 304 стоит
+одного чтения по первичному ключу без сканирования событий. В ETag
+входит и эпоха базы: после /restore счётчики откатываются, а эпоха
+меняется, так что уже выданный тег не повторится.
+"""
+import hashlib
+import hmac
+import logging
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Iterator, Optional
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from config import BOT_TOKEN, FEED_BASE_URL
+from database import DEFAULT_DURATION_MINUTES
+from storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+PRODID = "-//Dance Calendar Bot//RU"
+UID_DOMAIN = "dance-calendar-bot"
+
+# Сколько строк .ics копить перед отдачей очередного куска
+CHUNK_LINES = 200
+
+_RRULE_FREQ = {"daily": "DAILY", "weekly": "WEEKLY"}
+
+
+def _escape(value: str) -> str:
+    """Экранирование текстового значения по RFC 5545"""
+    return (value.replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _fold(line: str) -> str:
+    """Переносит строку длиннее 75 октетов (продолжение начинается с пробела)"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+
+    parts = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Не режем многобайтовый символ UTF-8 посередине
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+        limit = 74
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _ics_datetime(value: datetime) -> str:
+    """«Плавающее» локальное время: бот хранит события без часового пояса"""
+    return value.strftime("%Y%m%dT%H%M%S")
+
+
+def _vevent(uid: str, stamp: str, start: datetime, end: datetime, location: Optional[str],
+            dances: Optional[str], raw_text: Optional[str], extra: tuple = ()) -> Iterator[str]:
+    """Строки одного VEVENT"""
+    yield "BEGIN:VEVENT"
+    yield f"UID:{uid}"
+    yield f"DTSTAMP:{stamp}"
+    yield f"DTSTART:{_ics_datetime(start)}"
+    yield f"DTEND:{_ics_datetime(end)}"
+    yield f"SUMMARY:{_escape(dances or 'Выступление')}"
+    if location:
+        yield f"LOCATION:{_escape(location)}"
+    if raw_text:
+        yield f"DESCRIPTION:{_escape(raw_text)}"
+    yield from extra
+    yield "END:VEVENT"
+
+
+def _rule_lines(rule, exceptions) -> tuple:
+    """RRULE и EXDATE регулярного события"""
+    rrule = f"RRULE:FREQ={_RRULE_FREQ[rule['freq']]};INTERVAL={rule['interval']}"
+    if rule['until']:
+        rrule += f";UNTIL={_ics_datetime(datetime.fromisoformat(rule['until']))}"
+    lines = [rrule]
+    if exceptions:
+        dates = ",".join(_ics_datetime(datetime.fromisoformat(occ)) for occ in exceptions)
+        lines.append(f"EXDATE:{dates}")
+    return tuple(lines)
+
+
+async def _iter_lines(user_id: int, stamp: str) -> AsyncIterator[str]:
+    """Все строки документа по порядку"""
+    yield "BEGIN:VCALENDAR"
+    yield "VERSION:2.0"
+    yield f"PRODID:{PRODID}"
+    yield "CALSCALE:GREGORIAN"
+    yield "X-WR-CALNAME:Мои выступления"
+
+    storage = get_storage()
+    default_duration = timedelta(minutes=DEFAULT_DURATION_MINUTES)
+    async for ev in storage.iter_user_events(user_id):
+        for line in _vevent(f"event-{ev.id}@{UID_DOMAIN}", stamp, ev.dt, ev.end,
+                            ev.location, ev.dances, ev.raw_text):
+            yield line
+
+    for rule, exceptions in await storage.get_user_rules(user_id):
+        start = datetime.fromisoformat(rule['start_datetime'])
+        duration = timedelta(minutes=rule['duration_minutes']) if rule['duration_minutes'] else default_duration
+        for line in _vevent(f"rule-{rule['id']}@{UID_DOMAIN}", stamp, start, start + duration,
+                            rule['location'], rule['dances'], rule['raw_text'],
+                            extra=_rule_lines(rule, exceptions)):
+            yield line
+
+    yield "END:VCALENDAR"
+
+
+async def iter_ics(user_id: int, updated_at: Optional[str] = None) -> AsyncIterator[str]:
+    """Календарь пользователя в формате .ics кусками по CHUNK_LINES строк"""
+    moment = datetime.fromisoformat(updated_at) if updated_at else datetime.now(timezone.utc)
+    stamp = moment.strftime("%Y%m%dT%H%M%SZ")
+
+    chunk = []
+    async for line in _iter_lines(user_id, stamp):
+        chunk.append(_fold(line))
+        if len(chunk) >= CHUNK_LINES:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def feed_token(user_id: int) -> str:
+    """Секрет ссылки на подписку: без него чужой календарь не открыть"""
+    digest = hmac.new(BOT_TOKEN.encode(), f"feed:{user_id}".encode(), hashlib.sha256)
+    return digest.hexdigest()[:24]
+
+
+def feed_url(user_id: int) -> Optional[str]:
+    """Ссылка на подписку или None, если FEED_BASE_URL не настроен"""
+    if not FEED_BASE_URL:
+        return None
+    return f"{FEED_BASE_URL.rstrip('/')}/calendar/{user_id}/{feed_token(user_id)}.ics"
+
+
+class _FeedHandler(tornado.web.RequestHandler):
+    """GET /calendar/<user_id>/<token>.ics"""
+
+    async def get(self, user_id: str, token: str):
+        user_id = int(user_id)
+        if not hmac.compare_digest(token, feed_token(user_id)):
+            raise tornado.web.HTTPError(404)
+
+        epoch, version, updated_at = await get_storage().get_user_version(user_id)
+        etag = f'"{epoch}-v{version}"'
+        self.set_header("ETag", etag)
+        self.set_header("Cache-Control", "private, max-age=0, must-revalidate")
+        # updated_at пишет CURRENT_TIMESTAMP, то есть UTC
+        last_modified = datetime.fromisoformat(updated_at) if updated_at else None
+        if last_modified:
+            self.set_header("Last-Modified", last_modified)
+
+        if self._not_modified(etag, last_modified):
+            self.set_status(304)
+            return
+
+        self.set_header("Content-Type", "text/calendar; charset=utf-8")
+        self.set_header("Content-Disposition", 'inline; filename="calendar.ics"')
+        async for chunk in iter_ics(user_id, updated_at):
+            self.write(chunk)
+            await self.flush()
+
+    def _not_modified(self, etag: str, last_modified: Optional[datetime]) -> bool:
+        """Проверка условных заголовков; If-None-Match важнее If-Modified-Since"""
+        if_none_match = self.request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = {tag.strip() for tag in if_none_match.split(",")}
+            return etag in tags or "*" in tags
+
+        if_modified_since = self.request.headers.get("If-Modified-Since")
+        if if_modified_since and last_modified:
+            try:
+                since = parsedate_to_datetime(if_modified_since).replace(tzinfo=None)
+            except (TypeError, ValueError):
+                return False
+            return last_modified <= since
+        return False
+
+    def compute_etag(self):
+        # ETag ставим сами по эпохе и версии, без хэширования тела
+        return None
+
+
+def start_feed_server(port: int, address: str = "0.0.0.0") -> HTTPServer:
+    """Запускает HTTP-сервер подписки в текущем event loop"""
+    app = tornado.web.Application([(r"/calendar/(\d+)/([0-9a-f]+)\.ics", _FeedHandler)])
+    server = HTTPServer(app)
+    server.listen(port, address)
+    logger.info(f"Подписка на календарь слушает порт {port}")
+    return server
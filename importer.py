@@ -0,0 +1,284 @@
+# importer.py
+"""
+Импорт событий из файлов других календарей (.ics и .csv).
+
+Файл читается построчно, записи разбираются по одной и сразу уходят
+в пачку для записи в базу, поэтому память ограничена размером пачки,
+а не размером файла. Места и танцы приводятся к словарю parser.py.
+
+Повторения RRULE переводятся в правила бота (шаг в днях от первой
+даты): COUNT — в дату последнего повторения, BYDAY с несколькими днями —
+в несколько недельных правил, EXDATE — в отменённые повторения. DTSTART
+не в день из BYDAY по RFC 5545 всё равно первое повторение — оно
+становится отдельным разовым событием.
+Правила, которые так не передать (MONTHLY, YEARLY, BYMONTH и т.п.),
+не импортируются, а попадают в отчёт.
+"""
+import csv
+import itertools
+import re
+from datetime import datetime, time, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from dateutil import parser as dateutil_parser
+
+from database import FREQ_DAYS
+from parser import extract_datetime, extract_dances_simple, extract_location_improved, get_vocabulary
+
+# Сколько событий записывать одной транзакцией
+IMPORT_BATCH_SIZE = 500
+
+SUPPORTED_EXTENSIONS = ('.ics', '.csv')
+
+# Названия колонок CSV, которые понимаем (в нижнем регистре)
+CSV_COLUMNS = {
+    'start': ('start', 'start date', 'start_datetime', 'datetime', 'date', 'начало', 'дата'),
+    'start_time': ('start time', 'time', 'время'),
+    'end': ('end', 'end date', 'end_datetime', 'конец', 'окончание'),
+    'end_time': ('end time',),
+    'location': ('location', 'place', 'место', 'площадка'),
+    'summary': ('summary', 'subject', 'title', 'dances', 'название', 'танцы', 'событие'),
+    'description': ('description', 'notes', 'описание', 'заметки'),
+}
+
+_ICS_FREQ = {'DAILY': 'daily', 'WEEKLY': 'weekly'}
+_ICS_WEEKDAYS = {'MO': 0, 'TU': 1, 'WE': 2, 'TH': 3, 'FR': 4, 'SA': 5, 'SU': 6}
+# Части RRULE, которые передаются правилом бота; с любой другой правило не импортируем
+_RRULE_PARTS = {'FREQ', 'INTERVAL', 'UNTIL', 'COUNT', 'BYDAY', 'WKST'}
+
+
+def _unescape(value: str) -> str:
+    """Обратное экранирование текстового значения iCalendar"""
+    return re.sub(r'\\([\\;,nN])', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+
+def _unfold(lines: Iterable[str]) -> Iterator[str]:
+    """Склеивает перенесённые строки iCalendar (продолжение начинается с пробела)"""
+    current = None
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def _parse_ics_datetime(value: str, params: str) -> Optional[datetime]:
+    """DTSTART/DTEND: дата, «плавающее» время или UTC (переводим в локальное)"""
+    value = value.strip()
+    try:
+        if len(value) == 8 or ('VALUE=DATE' in params.upper() and 'VALUE=DATE-TIME' not in params.upper()):
+            return datetime.strptime(value[:8], '%Y%m%d')
+        if value.endswith('Z'):
+            utc = datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            return utc.astimezone().replace(tzinfo=None)
+        return datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    except ValueError:
+        return None
+
+
+def iter_ics_entries(lines: Iterable[str]) -> Iterator[Dict]:
+    """Записи VEVENT из потока строк .ics"""
+    entry = None
+    for line in _unfold(lines):
+        name, _, value = line.partition(':')
+        name, _, params = name.partition(';')
+        name = name.upper()
+
+        if name == 'BEGIN' and value.strip().upper() == 'VEVENT':
+            entry = {}
+        elif name == 'END' and value.strip().upper() == 'VEVENT':
+            if entry is not None:
+                yield entry
+            entry = None
+        elif entry is None:
+            continue
+        elif name in ('DTSTART', 'DTEND'):
+            entry[name.lower().replace('dt', '')] = _parse_ics_datetime(value, params)
+        elif name in ('SUMMARY', 'LOCATION', 'DESCRIPTION'):
+            entry[name.lower()] = _unescape(value)
+        elif name == 'RRULE':
+            entry['rrule'] = {key.upper(): part for key, part in
+                              (item.split('=', 1) for item in value.split(';') if '=' in item)}
+        elif name == 'EXDATE':
+            exdates = (_parse_ics_datetime(item, params) for item in value.split(','))
+            entry.setdefault('exdates', []).extend(moment for moment in exdates if moment)
+
+
+def _parse_csv_datetime(value: str) -> Optional[datetime]:
+    """Дата из CSV: ISO, «дд.мм.гггг чч:мм» или русская фраза"""
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    try:
+        return dateutil_parser.parse(value, dayfirst=True)
+    except (ValueError, OverflowError):
+        return extract_datetime(value)
+
+
+def _csv_column(row: Dict[str, str], field: str) -> str:
+    for name in CSV_COLUMNS[field]:
+        if row.get(name):
+            return row[name]
+    return ''
+
+
+def iter_csv_entries(f: TextIO) -> Iterator[Dict]:
+    """Записи из CSV с заголовком (разделитель , или ; определяется сам)"""
+    sample = f.read(4096)
+    f.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.reader(f, dialect)
+    header = next(reader, None)
+    if not header:
+        return
+    header = [column.strip().lower() for column in header]
+
+    for values in reader:
+        row = dict(zip(header, values))
+        start = _csv_column(row, 'start')
+        end = _csv_column(row, 'end')
+        yield {
+            'start': _parse_csv_datetime(f"{start} {_csv_column(row, 'start_time')}"),
+            'end': _parse_csv_datetime(f"{end} {_csv_column(row, 'end_time')}") if end else None,
+            'location': _csv_column(row, 'location'),
+            'summary': _csv_column(row, 'summary'),
+            'description': _csv_column(row, 'description'),
+        }
+
+
+def normalize_location(raw: str, text: str) -> Optional[str]:
+    """Место из записи: известная площадка, иначе как есть, иначе из текста"""
+    raw = raw.strip()
+    if raw:
+        found = extract_location_improved(raw)
+        return found if found in get_vocabulary().location_names else raw
+    return extract_location_improved(text) if text else None
+
+
+def map_rrule(rrule: Dict[str, str], start: datetime, exdates: List[datetime]) -> Optional[Dict]:
+    """RRULE → {'freq', 'interval', 'until', 'series': [(первая дата, отменённые даты), ...],
+    'single': DTSTART, если он не попадает в правило, иначе None}.
+
+    None, если правило не передать шагом в днях от первой даты.
+    """
+    freq = _ICS_FREQ.get(rrule.get('FREQ', '').upper())
+    if freq is None or set(rrule) - _RRULE_PARTS:
+        return None
+    interval = rrule.get('INTERVAL', '1')
+    if not interval.isdigit() or int(interval) < 1:
+        return None
+    interval = int(interval)
+
+    starts = [start]
+    single = None
+    if rrule.get('BYDAY'):
+        # Номер дня (1MO, -1FR) бывает только у MONTHLY/YEARLY
+        days = [_ICS_WEEKDAYS.get(day.strip().upper()) for day in rrule['BYDAY'].split(',')]
+        wkst = _ICS_WEEKDAYS.get(rrule.get('WKST', 'MO').upper())
+        if None in days or wkst is None:
+            return None
+        if freq == 'daily':
+            # Ежедневно по выбранным дням — то же, что еженедельно по ним
+            if interval != 1:
+                return None
+            freq = 'weekly'
+        if start.weekday() not in days:
+            single = start
+        # Первое повторение каждого дня: в неделе DTSTART или через interval недель
+        week_start = start - timedelta(days=(start.weekday() - wkst) % 7)
+        starts = []
+        for day in set(days):
+            first = week_start + timedelta(days=(day - wkst) % 7)
+            starts.append(first if first >= start else first + timedelta(weeks=interval))
+        starts.sort()
+    step = timedelta(days=FREQ_DAYS[freq] * interval)
+
+    until = None
+    if 'UNTIL' in rrule:
+        until = _parse_ics_datetime(rrule['UNTIL'], '')
+        if until is None:
+            return None
+        if len(rrule['UNTIL'].strip()) == 8:
+            # UNTIL датой включает весь этот день
+            until += timedelta(days=1, microseconds=-1)
+    if 'COUNT' in rrule:
+        count = rrule['COUNT']
+        if not count.isdigit() or int(count) < 1:
+            return None
+        # DTSTART вне BYDAY входит в COUNT, но идёт разовым событием
+        count = int(count) - (single is not None)
+        if count == 0:
+            starts = []
+        # Первые даты лежат внутри одного шага, так что повторения идут
+        # по кругу: starts[0], starts[1], ..., starts[0] + step, ...
+        if starts:
+            rounds, index = divmod(count - 1, len(starts))
+            last = starts[index] + rounds * step
+            until = last if until is None else min(until, last)
+
+    # EXDATE датой отменяет повторение в этот день
+    def skipped(first: datetime) -> List[datetime]:
+        return [datetime.combine(moment.date(), first.time()) if moment.time() == time(0) else moment
+                for moment in exdates]
+
+    series = [(first, [moment for moment in skipped(first)
+                       if moment >= first and (moment - first) % step == timedelta(0)])
+              for first in starts]
+    if single is not None and single in skipped(single):
+        single = None
+    return {'freq': freq, 'interval': interval, 'until': until, 'series': series, 'single': single}
+
+
+def map_entry(entry: Dict) -> Optional[Dict]:
+    """Запись календаря → поля события бота; None, если нет даты.
+
+    'unsupported' — у записи есть RRULE, который бот передать не может.
+    """
+    start = entry.get('start')
+    if start is None:
+        return None
+
+    summary = entry.get('summary') or ''
+    description = entry.get('description') or ''
+    text = f"{summary}\n{description}".strip()
+    end = entry.get('end') if entry.get('end') and entry['end'] > start else None
+
+    rrule = entry.get('rrule')
+    recurrence = map_rrule(rrule, start, entry.get('exdates', [])) if rrule else None
+
+    return {
+        'start': start,
+        'end': end,
+        'location': normalize_location(entry.get('location') or '', text),
+        'dances': extract_dances_simple(text),
+        'raw_text': text or summary,
+        'recurrence': recurrence,
+        'unsupported': bool(rrule) and recurrence is None,
+    }
+
+
+def read_mapped(entries: Iterator[Dict], limit: int) -> List[Optional[Dict]]:
+    """Следующие limit записей через map_entry; пустой список — записи кончились"""
+    return [map_entry(entry) for entry in itertools.islice(entries, limit)]
+
+
+def iter_file_entries(path: str) -> Iterator[Dict]:
+    """Записи файла по расширению; BOM и битые символы не мешают разбору"""
+    with open(path, encoding='utf-8-sig', errors='replace', newline='') as f:
+        if path.lower().endswith('.ics'):
+            yield from iter_ics_entries(f)
+        else:
+            yield from iter_csv_entries(f)
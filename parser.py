@@ -2,9 +2,13 @@
 from datetime import datetime, timedelta
 import re
 from dateutil.parser import parse as dateutil_parse
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import logging
 
+import clock
+from fuzzy import BKTree
+from vocabulary import Vocabulary, load_or_compile, merge_entries
+
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
@@ -32,6 +36,16 @@ DANCE_VARIANTS = {
     "Сюита": {"сюита", "сюиту"}
 }
 
+# Обычные слова, которые с одной опечаткой похожи на форму из словаря
+# («морские» → «морским», «соперник» → «соперниц»); нечётко не ищем
+FUZZY_STOPWORDS = {
+    "морские", "морских", "морскими", "морское",
+    "соперник", "соперника", "сопернику", "соперником", "сопернике",
+    "соперники", "соперникам", "соперниками",
+    "субботний", "субботним", "субботнем", "субботние", "субботних", "субботними",
+    "субботняя", "субботнюю", "субботе",
+}
+
 # Создаем плоский набор для быстрого поиска
 KNOWN_DANCES = {variant: main_name for main_name, variants in DANCE_VARIANTS.items() for variant in variants}
 
@@ -59,6 +73,45 @@ RELATIVE_DATE_KEYWORDS = {
     'в воскресенье': 6,
 }
 
+# Фразы повторяющихся событий с днём недели
+RECURRENCE_WEEKDAYS = {
+    'каждый понедельник': 0, 'по понедельникам': 0,
+    'каждый вторник': 1, 'по вторникам': 1,
+    'каждую среду': 2, 'по средам': 2,
+    'каждый четверг': 3, 'по четвергам': 3,
+    'каждую пятницу': 4, 'по пятницам': 4,
+    'каждую субботу': 5, 'по субботам': 5,
+    'каждое воскресенье': 6, 'по воскресеньям': 6,
+}
+
+# Фразы повторения без дня недели: (частота, интервал)
+RECURRENCE_KEYWORDS = {
+    'каждый день': ('daily', 1),
+    'ежедневно': ('daily', 1),
+    'через день': ('daily', 2),
+    'каждую неделю': ('weekly', 1),
+    'еженедельно': ('weekly', 1),
+    'каждые две недели': ('weekly', 2),
+    'раз в две недели': ('weekly', 2),
+}
+
+# Типы мероприятий по ключевым словам и их длительность по умолчанию (минуты)
+EVENT_TYPE_KEYWORDS = {
+    'репетиц': 'rehearsal',
+    'концерт': 'concert',
+    'выступ': 'concert',
+    'фестивал': 'festival',
+    'конкурс': 'contest',
+}
+
+EVENT_DURATIONS = {
+    'rehearsal': 120,
+    'concert': 90,
+    'festival': 240,
+    'contest': 180,
+    'event': 120,
+}
+
 # ТОЛЬКО ваши места
 KNOWN_LOCATIONS = {
     'Троицкий': {'троицкий', 'троицком', 'троицкая', 'троицкое'},
@@ -69,6 +122,61 @@ KNOWN_LOCATIONS = {
     'КДЦ Московский': {'кдц московский', 'кдц московском'},
 }
 
+# Все падежные формы танцев и мест в префиксном дереве (см. vocabulary.py).
+# Перезагрузка подменяет объект целиком, поэтому функции берут его один раз.
+_vocabulary = load_or_compile(DANCE_VARIANTS, KNOWN_LOCATIONS)
+
+
+def get_vocabulary() -> Vocabulary:
+    """Текущий скомпилированный словарь"""
+    return _vocabulary
+
+
+def reload_vocabulary(entries=()) -> Vocabulary:
+    """Пересобирает словарь с записями (kind, name, variants) из базы без перезапуска"""
+    global _vocabulary
+    dances, locations = merge_entries(DANCE_VARIANTS, KNOWN_LOCATIONS, entries)
+    _vocabulary = load_or_compile(dances, locations)
+    logger.info(f"Словарь перезагружен: танцев {len(dances)}, мест {len(locations)}")
+    return _vocabulary
+
+
+def _exact_spans(words: List[str], trie) -> Tuple[List[str], set]:
+    """Самые длинные точные совпадения со словарём слева направо"""
+    found, covered = [], set()
+    i = 0
+    while i < len(words):
+        match = trie.longest_match(words, i)
+        if match:
+            name, end = match
+            found.append(name)
+            covered.update(range(i, end))
+            i = end
+        else:
+            i += 1
+    return found, covered
+
+
+def _fuzzy_spans(words: List[str], covered: set, index: Dict[int, BKTree]) -> List[str]:
+    """Нечёткие совпадения для ещё не распознанных фраз.
+
+    Сначала пробуем длинные фразы, чтобы «белого вальса» не распалось
+    на отдельный «вальс». Слова из FUZZY_STOPWORDS отдельно не ищем.
+    """
+    found = []
+    for size, tree in index.items():
+        for i in range(len(words) - size + 1):
+            span = range(i, i + size)
+            if any(j in covered for j in span):
+                continue
+            if size == 1 and words[i] in FUZZY_STOPWORDS:
+                continue
+            match = tree.closest(" ".join(words[i:i + size]))
+            if match:
+                found.append(match)
+                covered.update(span)
+    return found
+
 
 def capitalize_location(location: str) -> str:
     """Приводит название места к правильному регистру"""
@@ -86,9 +194,9 @@ def capitalize_location(location: str) -> str:
         return f"Адрес: {address.capitalize()}"
 
     # Для известных локаций возвращаем каноническое название
-    for canonical_name, variants in KNOWN_LOCATIONS.items():
-        if location.lower() in variants:
-            return canonical_name
+    canonical_name = _vocabulary.locations.get(location.lower())
+    if canonical_name:
+        return canonical_name
 
     # Для остальных - просто первую букву заглавную
     return location.capitalize()
@@ -96,7 +204,7 @@ def capitalize_location(location: str) -> str:
 
 class DateTimeExtractor:
     @staticmethod
-    def extract_russian_date(text: str) -> Optional[datetime]:
+    def extract_russian_date(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
         """Извлекает даты в русском формате: '20 ноября', '5 декабря' и т.д."""
         # Словарь месяцев
         months = {
@@ -114,7 +222,7 @@ class DateTimeExtractor:
             month_name = match.group(2)
             month = months[month_name]
 
-            now = datetime.now()
+            now = now or clock.now()
             year = now.year
 
             # Если месяц уже прошел в этом году, берем следующий год
@@ -130,10 +238,10 @@ class DateTimeExtractor:
         return None
 
     @staticmethod
-    def extract_relative_date(text: str) -> Optional[datetime]:
+    def extract_relative_date(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
         """Извлекает относительные даты типа 'завтра', 'в субботу'"""
         text_lower = text.lower()
-        now = datetime.now()
+        now = now or clock.now()
 
         for keyword, days_offset in RELATIVE_DATE_KEYWORDS.items():
             if keyword in text_lower:
@@ -160,8 +268,25 @@ class DateTimeExtractor:
         return from_date + timedelta(days=days_ahead)
 
     @staticmethod
-    def extract_time(text: str) -> Optional[datetime]:
+    def extract_recurring_date(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
+        """Первая дата для 'каждый вторник', 'по средам' и т.п.
+
+        Если день совпадает с сегодняшним, это сегодня: прошло ли уже
+        время, решает extract_datetime.
+        """
+        text_lower = text.lower()
+        now = now or clock.now()
+
+        for phrase, weekday in RECURRENCE_WEEKDAYS.items():
+            if phrase in text_lower:
+                days_ahead = (weekday - now.weekday()) % 7
+                return (now + timedelta(days=days_ahead)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return None
+
+    @staticmethod
+    def extract_time(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
         """Извлекает время из текста"""
+        now = now or clock.now()
         for pattern, time_processor in TIME_PATTERNS:
             match = re.search(pattern, text, re.IGNORECASE)
             if match:
@@ -171,14 +296,15 @@ class DateTimeExtractor:
                         time_str += ':00'
 
                     time_obj = datetime.strptime(time_str, "%H:%M").time()
-                    return datetime.combine(datetime.now().date(), time_obj)
+                    return datetime.combine(now.date(), time_obj)
                 except ValueError as e:
                     logger.debug(f"Ошибка парсинга времени '{time_str}': {e}")
                     continue
         return None
 
     @staticmethod
-    def combine_date_time(date_part: Optional[datetime], time_part: Optional[datetime]) -> Optional[datetime]:
+    def combine_date_time(date_part: Optional[datetime], time_part: Optional[datetime],
+                          now: Optional[datetime] = None) -> Optional[datetime]:
         """Объединяет дату и время"""
         if not date_part and not time_part:
             return None
@@ -194,85 +320,114 @@ class DateTimeExtractor:
                 return date_part
         else:
             # Если есть только время, используем сегодня/завтра
-            now = datetime.now()
+            now = now or clock.now()
             if time_part.time() > now.time():
                 return datetime.combine(now.date(), time_part.time())
             else:
                 return datetime.combine(now.date() + timedelta(days=1), time_part.time())
 
 
-def extract_datetime(text: str) -> Optional[datetime]:
+def extract_datetime(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
     """Основная функция извлечения даты и времени"""
     try:
         extractor = DateTimeExtractor()
+        # Один снимок времени на всё сообщение
+        now = now or clock.now()
 
         # 1. Пробуем извлечь русскую дату (новый метод)
-        date_part = extractor.extract_russian_date(text)
+        date_part = extractor.extract_russian_date(text, now)
 
         # 2. Если не нашли русскую дату, пробуем относительные даты
         if not date_part:
-            date_part = extractor.extract_relative_date(text)
+            date_part = extractor.extract_relative_date(text, now)
+
+        # 2.1. Или первое повторение: 'каждый вторник'
+        recurring = False
+        if not date_part:
+            date_part = extractor.extract_recurring_date(text, now)
+            recurring = date_part is not None
 
         # 3. Извлекаем время
-        time_part = extractor.extract_time(text)
+        time_part = extractor.extract_time(text, now)
 
         # 4. Комбинируем дату и время
-        result = extractor.combine_date_time(date_part, time_part)
+        result = extractor.combine_date_time(date_part, time_part, now)
+
+        # 4.1. Сегодняшнее повторение уже прошло — первым будет следующее
+        if recurring and result and result <= now:
+            result += timedelta(weeks=1)
 
         # 5. Fallback: используем dateutil для сложных случаев
         if not result:
             try:
-                result = dateutil_parse(text, fuzzy=True, dayfirst=True)
-                if result and result <= datetime.now():
+                result = dateutil_parse(text, fuzzy=True, dayfirst=True,
+                                        default=now.replace(hour=0, minute=0, second=0, microsecond=0))
+                if result and result <= now:
                     result += timedelta(days=1)
             except Exception:
                 pass
 
-        return result if result and result > datetime.now() else None
+        return result if result and result > now else None
 
     except Exception as e:
         logger.error(f"Error extracting datetime from '{text}': {e}")
         return None
 
 
+def extract_recurrence(text: str) -> Optional[Dict]:
+    """Извлекает правило повторения: {'freq': 'weekly', 'interval': 1}"""
+    text_lower = text.lower()
+
+    for phrase in RECURRENCE_WEEKDAYS:
+        if phrase in text_lower:
+            # День недели задаётся датой первого события
+            return {"freq": "weekly", "interval": 1}
+
+    for phrase, (freq, interval) in RECURRENCE_KEYWORDS.items():
+        if phrase in text_lower:
+            return {"freq": freq, "interval": interval}
+
+    return None
+
+
+def extract_event_type(text: str) -> str:
+    """Определяет тип мероприятия (репетиция, концерт...) по ключевым словам"""
+    text_lower = text.lower()
+    for stem, event_type in EVENT_TYPE_KEYWORDS.items():
+        if stem in text_lower:
+            return event_type
+    return 'event'
+
+
 def extract_dances_simple(text: str) -> List[str]:
     """Извлекает танцы из текста без spacy"""
-    dances_found = set()
+    vocabulary = _vocabulary
     text_lower = text.lower()
 
-    # Простой поиск по словам
+    # Простой поиск по словам: самая длинная фраза словаря с каждой позиции,
+    # так что «белый вальс» не даёт заодно отдельный «вальс»
     words = re.findall(r'\b\w+\b', text_lower)
+    found, covered = _exact_spans(words, vocabulary.dances)
+    dances_found = set(found)
 
-    # Поиск отдельных слов
-    for word in words:
-        if word in KNOWN_DANCES:
-            dances_found.add(KNOWN_DANCES[word])
-
-    # Поиск по 2-3 словам
-    for i in range(len(words) - 1):
-        bigram = f"{words[i]} {words[i + 1]}"
-        if bigram in KNOWN_DANCES:
-            dances_found.add(KNOWN_DANCES[bigram])
-
-    for i in range(len(words) - 2):
-        trigram = f"{words[i]} {words[i + 1]} {words[i + 2]}"
-        if trigram in KNOWN_DANCES:
-            dances_found.add(KNOWN_DANCES[trigram])
+    # Остальные слова — с поправкой на опечатки
+    dances_found.update(_fuzzy_spans(words, covered, vocabulary.dance_index))
 
     return list(dances_found)
 
 
 def extract_location_improved(text: str) -> Optional[str]:
     """Улучшенная логика определения места"""
+    vocabulary = _vocabulary
     text_lower = text.lower()
-    found_locations = []
 
-    # 1. Ищем известные локации
-    for canonical_name, variants in KNOWN_LOCATIONS.items():
-        for variant in variants:
-            if variant in text_lower:
-                found_locations.append(canonical_name)
-                break
+    # 1. Ищем известные локации в любом падеже
+    words = re.findall(r'\b\w+\b', text_lower)
+    found_locations = list(dict.fromkeys(_exact_spans(words, vocabulary.locations)[0]))
+
+    # 1а. Если точного совпадения нет — ищем с опечатками
+    if not found_locations:
+        found_locations.extend(dict.fromkeys(_fuzzy_spans(words, set(), vocabulary.location_index)))
 
     # 2. Ищем улицы
     street_patterns = [
@@ -338,12 +493,13 @@ def extract_location_improved(text: str) -> Optional[str]:
     return None
 
 
-def extract_with_spacy(text: str) -> Dict[str, Optional[str]]:
+def extract_with_spacy(text: str, now: Optional[datetime] = None) -> Dict[str, Optional[str]]:
     """
-    Извлекает информацию о мероприятии из текста (теперь без spacy)
+    Извлекает информацию о мероприятии из текста (теперь без spacy).
+    now — момент, относительно которого считаются «завтра», «в субботу» и т.п.
     """
     if not text or not text.strip():
-        return {"datetime": None, "location": None, "dances": []}
+        return {"datetime": None, "location": None, "dances": [], "recurrence": None, "event_type": "event"}
 
     try:
         # Извлекаем локации
@@ -353,14 +509,22 @@ def extract_with_spacy(text: str) -> Dict[str, Optional[str]]:
         dances = extract_dances_simple(text)
 
         # Извлекаем дату и время
-        dt = extract_datetime(text)
+        dt = extract_datetime(text, now)
+
+        # Правило повторения (для регулярных репетиций)
+        recurrence = extract_recurrence(text)
+
+        # Тип мероприятия задаёт длительность по умолчанию
+        event_type = extract_event_type(text)
 
         return {
             "datetime": dt,
             "location": location,
-            "dances": dances
+            "dances": dances,
+            "recurrence": recurrence,
+            "event_type": event_type
         }
 
     except Exception as e:
         logger.error(f"Error in extract_with_spacy for text '{text}': {e}")
-        return {"datetime": None, "location": None, "dances": []}
+        return {"datetime": None, "location": None, "dances": [], "recurrence": None, "event_type": "event"}
@@ -0,0 +1,80 @@
+# profiler.py
+import cProfile
+import io
+import os
+import pstats
+import tempfile
+import time
+import logging
+from typing import Optional, Tuple
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Ограничения для команды /profile
+DEFAULT_PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 300
+DEFAULT_TOP_N = 20
+MAX_TOP_N = 100
+
+# Текущая сессия профилирования (одна на процесс)
+_profiler: Optional[cProfile.Profile] = None
+_started_at: Optional[float] = None
+
+
+def is_profiling() -> bool:
+    """Проверяет, идёт ли сейчас профилирование"""
+    return _profiler is not None
+
+
+def start_profiling() -> bool:
+    """Включает cProfile для потока event loop.
+
+    Все обработчики работают в одном потоке asyncio, поэтому профиль
+    охватывает их целиком. Возвращает False, если сессия уже идёт.
+    """
+    global _profiler, _started_at
+
+    if _profiler is not None:
+        return False
+
+    _profiler = cProfile.Profile()
+    _started_at = time.monotonic()
+    _profiler.enable()
+    logger.info("Profiling started")
+    return True
+
+
+def stop_profiling(top_n: int = DEFAULT_TOP_N) -> Optional[Tuple[str, str]]:
+    """Останавливает профилирование.
+
+    Возвращает текст отчёта с самыми «горячими» функциями и путь к файлу
+    с сырым профилем (формат pstats), либо None, если сессии не было.
+    """
+    global _profiler, _started_at
+
+    if _profiler is None:
+        return None
+
+    profiler = _profiler
+    profiler.disable()
+    elapsed = time.monotonic() - _started_at
+    _profiler = None
+    _started_at = None
+
+    fd, path = tempfile.mkstemp(prefix="bot_profile_", suffix=".prof")
+    os.close(fd)
+    profiler.dump_stats(path)
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n)
+
+    report = f"Длительность: {elapsed:.1f} c\n" + _compact_report(stream.getvalue())
+    logger.info(f"Profiling stopped after {elapsed:.1f}s, dump saved to {path}")
+    return report, path
+
+
+def _compact_report(raw: str) -> str:
+    """Убирает из вывода pstats пустые строки"""
+    return "\n".join(line.rstrip() for line in raw.splitlines() if line.strip())
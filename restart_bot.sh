@@ -6,6 +6,9 @@ cd /home/Kostroma/calendar_bot
 pkill -f "python3.10 bot.py"
 sleep 2
 
+# Собираем словарь танцев и мест (vocabulary.bin)
+python3.10 -m vocabulary
+
 # Запускаем новый
 nohup python3.10 bot.py > bot.log 2>&1 &
 
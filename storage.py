@@ -0,0 +1,1133 @@
+# storage.py
+"""
+Хранилище данных бота: общий асинхронный интерфейс и два движка.
+
+Обработчики работают только с Storage из get_storage(), а какой движок
+за ним стоит, решает STORAGE_BACKEND:
+
+- sqlite — прежний database.py: каждая операция уходит в отдельный
+  поток, чтобы не останавливать event loop;
+- postgres — PostgreSQL 14 или новее (схеме нужен CREATE OR REPLACE
+  TRIGGER) через пул соединений asyncpg. Несколько экземпляров бота
+  могут работать с одной базой, а запись не упирается в блокировку
+  одного файла.
+
+Логика регулярных событий (развёртка правил, слияние с обычными
+событиями) общая и берётся из database.py, движки отличаются только SQL.
+"""
+import asyncio
+import logging
+import secrets
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta
+from itertools import dropwhile, groupby, islice
+from operator import itemgetter
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import clock
+import database
+from config import DATABASE_URL, DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE, STORAGE_BACKEND
+from database import (DEFAULT_DURATION_MINUTES, FREQ_DAYS, Event, fts_terms, iter_occurrences,
+                      merge_occurrences, rule_duration)
+
+try:
+    import asyncpg
+except ImportError:  # нужен только для STORAGE_BACKEND=postgres
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+# Новое событие: (начало, конец, место, танцы, исходный текст)
+EventRow = Tuple[datetime, Optional[datetime], Optional[str], List[str], str]
+# Новое правило: (начало, freq, interval, until, место, танцы, исходный текст,
+# длительность в минутах, отменённые повторения)
+RuleRow = Tuple[datetime, str, int, Optional[datetime], Optional[str], List[str], str, Optional[int],
+                List[datetime]]
+
+
+class Storage(ABC):
+    """Асинхронный доступ к событиям, ансамблям, сводкам и словарю"""
+
+    async def open(self):
+        """Готовит хранилище к работе (схема, соединения)"""
+
+    async def close(self):
+        """Освобождает соединения"""
+
+    # --- События ---
+
+    @abstractmethod
+    async def add_event(self, user_id: int, event_datetime: datetime, location: Optional[str],
+                        dances: List[str], raw_text: str, group_id: Optional[int] = None,
+                        end_datetime: Optional[datetime] = None) -> bool:
+        """Добавляет событие (group_id — в календарь ансамбля)"""
+
+    @abstractmethod
+    async def add_events_batch(self, user_id: int, events: List[EventRow]) -> int:
+        """Добавляет пачку событий, пропуская дубликаты; число добавленных"""
+
+    @abstractmethod
+    async def delete_event(self, event_id: int) -> bool:
+        """Удаляет событие"""
+
+    @abstractmethod
+    async def get_upcoming_events(self, user_id: int, limit: int = 50,
+                                  now: Optional[datetime] = None) -> List[Event]:
+        """Предстоящие события пользователя вместе с повторениями"""
+
+    @abstractmethod
+    async def get_events_by_date_range(self, user_id: int, start_date: datetime,
+                                       end_date: datetime) -> List[Event]:
+        """События пользователя за период вместе с повторениями"""
+
+    async def get_today_events(self, user_id: int, now: Optional[datetime] = None) -> List[Event]:
+        """События на сегодня"""
+        now = now or clock.now()
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+        return await self.get_events_by_date_range(user_id, today_start, today_end)
+
+    @abstractmethod
+    async def get_overlapping_events(self, user_id: int, start: datetime, end: datetime,
+                                     group_id: Optional[int] = None) -> List[Event]:
+        """События и повторения, идущие хотя бы часть окна (group_id — только календарь ансамбля)"""
+
+    @abstractmethod
+    async def get_all_events(self, user_id: int) -> List[Event]:
+        """Все обычные события пользователя (для отладки)"""
+
+    @abstractmethod
+    async def search_events(self, user_id: int, query: str, limit: int = 10,
+                            offset: int = 0, now: Optional[datetime] = None) -> List[Event]:
+        """Полнотекстовый поиск по событиям и регулярным событиям, лучшие совпадения первыми"""
+
+    @abstractmethod
+    async def get_user_events_page(self, user_id: int, after: Optional[Tuple[str, int]] = None,
+                                   limit: int = 500) -> List[Event]:
+        """Следующие limit событий после after = (event_datetime, id)"""
+
+    async def iter_user_events(self, user_id: int, batch_size: int = 500) -> AsyncIterator[Event]:
+        """Все видимые пользователю события потоком, страницами по batch_size"""
+        after = None
+        while True:
+            page = await self.get_user_events_page(user_id, after, batch_size)
+            for ev in page:
+                yield ev
+            if len(page) < batch_size:
+                return
+            after = (page[-1].event_datetime, page[-1].id)
+
+    @abstractmethod
+    async def get_user_rules(self, user_id: int) -> List[Tuple[Dict, List[str]]]:
+        """Правила регулярных событий пользователя с отменёнными датами"""
+
+    @abstractmethod
+    async def get_user_version(self, user_id: int) -> Tuple[str, int, Optional[str]]:
+        """Эпоха базы, версия календаря и время последнего изменения (UTC)"""
+
+    @abstractmethod
+    async def get_stats(self, now: datetime) -> Dict[str, int]:
+        """Счётчики для /stats: total_events, upcoming_events, total_users"""
+
+    # --- Регулярные события ---
+
+    @abstractmethod
+    async def add_recurring_event(self, user_id: int, start_datetime: datetime, freq: str, interval: int,
+                                  location: Optional[str], dances: List[str], raw_text: str,
+                                  until: Optional[datetime] = None, group_id: Optional[int] = None,
+                                  duration_minutes: Optional[int] = None,
+                                  exceptions: Optional[List[datetime]] = None) -> bool:
+        """Добавляет регулярное событие; exceptions — сразу отменённые повторения"""
+
+    @abstractmethod
+    async def has_recurring_event(self, user_id: int, start_datetime: datetime, freq: str) -> bool:
+        """Есть ли правило с тем же началом и частотой"""
+
+    @abstractmethod
+    async def add_recurring_events_batch(self, user_id: int, rules: List[RuleRow]) -> int:
+        """Добавляет пачку правил, пропуская дубликаты; число добавленных"""
+
+    @abstractmethod
+    async def skip_occurrence(self, rule_id: int, occurrence_datetime: str) -> bool:
+        """Отменяет одно повторение"""
+
+    @abstractmethod
+    async def delete_recurring_event(self, rule_id: int) -> bool:
+        """Удаляет правило вместе с исключениями"""
+
+    # --- Ансамбли ---
+
+    @abstractmethod
+    async def create_group(self, owner_id: int, name: str):
+        """Создаёт ансамбль; запись с id, name, invite_code или None"""
+
+    @abstractmethod
+    async def join_group(self, user_id: int, invite_code: str):
+        """Вступление по коду; запись ансамбля или None"""
+
+    @abstractmethod
+    async def leave_group(self, user_id: int, group_id: int) -> bool:
+        """Выход из ансамбля"""
+
+    @abstractmethod
+    async def get_user_groups(self, user_id: int) -> List:
+        """Ансамбли пользователя с ролью и числом участников"""
+
+    @abstractmethod
+    async def get_member_role(self, group_id: int, user_id: int) -> Optional[str]:
+        """Роль в ансамбле ('leader' / 'member') или None"""
+
+    # --- Утренняя сводка ---
+
+    @abstractmethod
+    async def get_notification_recipients(self, start: datetime, end: datetime, after: Optional[int] = None,
+                                          limit: Optional[int] = None) -> List[Tuple[int, Event]]:
+        """Пары (получатель, событие) в окне, по user_id и времени; только
+        получатели с user_id больше after, не больше limit человек"""
+
+    async def iter_notification_recipients(self, start: datetime, end: datetime,
+                                           batch_size: int = 500) -> AsyncIterator[Tuple[int, Event]]:
+        """Те же пары потоком, страницами по batch_size получателей"""
+        after = None
+        while True:
+            page = await self.get_notification_recipients(start, end, after, batch_size)
+            for pair in page:
+                yield pair
+            if len({recipient for recipient, _ in page}) < batch_size:
+                return
+            after = page[-1][0]
+
+    @abstractmethod
+    async def start_digest_run(self, digest_date: str, owner: str, lease_until: datetime) -> bool:
+        """Захват рассылки за день до lease_until; False, если она закончена или занята"""
+
+    @abstractmethod
+    async def extend_digest_lease(self, digest_date: str, owner: str, lease_until: datetime) -> bool:
+        """Продление захвата; False, если рассылку перехватил другой экземпляр"""
+
+    @abstractmethod
+    async def finish_digest_run(self, digest_date: str):
+        """Рассылка за день закончена"""
+
+    @abstractmethod
+    async def is_digest_run_unfinished(self, digest_date: str) -> bool:
+        """Рассылка начиналась, но не дошла до конца"""
+
+    @abstractmethod
+    async def get_digest_recipients_done(self, digest_date: str) -> Set[int]:
+        """Кому сводка за день уже доставлена (или кого не достать)"""
+
+    @abstractmethod
+    async def record_digest_delivery(self, digest_date: str, user_id: int, status: str):
+        """Результат отправки сводки пользователю"""
+
+    # --- Словарь ---
+
+    @abstractmethod
+    async def get_vocabulary_entries(self) -> List[Tuple[str, str, Optional[str]]]:
+        """Записи словаря: (kind, name, variants через запятую)"""
+
+    @abstractmethod
+    async def add_vocabulary_entry(self, kind: str, name: str, variants: List[str]) -> bool:
+        """Добавляет танец или место в словарь"""
+
+
+def _threaded(name: str):
+    """Метод SQLiteStorage: функция database.<name> в отдельном потоке"""
+    async def method(self, *args, **kwargs):
+        # Функцию ищем при вызове, а не при импорте: её можно подменить (loadtest)
+        return await asyncio.to_thread(getattr(database, name), *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = getattr(database, name).__doc__
+    return method
+
+
+class SQLiteStorage(Storage):
+    """Локальный файл SQLite (database.py), операции — в пуле потоков"""
+
+    async def open(self):
+        await asyncio.to_thread(database.init_db)
+
+    add_event = _threaded("add_event")
+    add_events_batch = _threaded("add_events_batch")
+    delete_event = _threaded("delete_event")
+    get_upcoming_events = _threaded("get_upcoming_events")
+    get_events_by_date_range = _threaded("get_events_by_date_range")
+    get_overlapping_events = _threaded("get_overlapping_events")
+    get_all_events = _threaded("get_all_events")
+    search_events = _threaded("search_events")
+    get_user_events_page = _threaded("get_user_events_page")
+    get_user_rules = _threaded("get_user_rules")
+    get_user_version = _threaded("get_user_version")
+    get_stats = _threaded("get_stats")
+    add_recurring_event = _threaded("add_recurring_event")
+    has_recurring_event = _threaded("has_recurring_event")
+    add_recurring_events_batch = _threaded("add_recurring_events_batch")
+    skip_occurrence = _threaded("skip_occurrence")
+    delete_recurring_event = _threaded("delete_recurring_event")
+    create_group = _threaded("create_group")
+    join_group = _threaded("join_group")
+    leave_group = _threaded("leave_group")
+    get_user_groups = _threaded("get_user_groups")
+    get_member_role = _threaded("get_member_role")
+    start_digest_run = _threaded("start_digest_run")
+    extend_digest_lease = _threaded("extend_digest_lease")
+    finish_digest_run = _threaded("finish_digest_run")
+    is_digest_run_unfinished = _threaded("is_digest_run_unfinished")
+    get_digest_recipients_done = _threaded("get_digest_recipients_done")
+    record_digest_delivery = _threaded("record_digest_delivery")
+    get_vocabulary_entries = _threaded("get_vocabulary_entries")
+    add_vocabulary_entry = _threaded("add_vocabulary_entry")
+
+    async def get_notification_recipients(self, start, end, after=None, limit=None) -> List[Tuple[int, Event]]:
+        # Читаем целиком в потоке: пока открыт курсор, SQLite не даёт писать
+        def read():
+            pairs = database.iter_notification_recipients(start, end)
+            if after is not None:
+                pairs = dropwhile(lambda pair: pair[0] <= after, pairs)
+            groups = islice(groupby(pairs, key=itemgetter(0)), limit)
+            return [pair for _, group in groups for pair in group]
+        return await asyncio.to_thread(read)
+
+    async def iter_notification_recipients(self, start, end, batch_size=500) -> AsyncIterator[Tuple[int, Event]]:
+        # Весь день одним чтением: страницы перечитывали бы тот же индекс,
+        # а день одного файла SQLite помещается в памяти
+        for pair in await self.get_notification_recipients(start, end):
+            yield pair
+
+
+# Схема PostgreSQL. Даты — timestamp без часового пояса, как и в SQLite:
+# бот хранит локальное время. Поиск — по tsvector с конфигурацией simple,
+# основы слов отрезает fts_terms, как и для FTS5.
+_PG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    event_datetime TIMESTAMP NOT NULL,
+    location TEXT,
+    dances TEXT,
+    raw_text TEXT,
+    group_id BIGINT,
+    end_datetime TIMESTAMP,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    search TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(location, '') || ' ' || coalesce(dances, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(raw_text, '')), 'B')
+    ) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_events_user_datetime ON events (user_id, event_datetime);
+CREATE INDEX IF NOT EXISTS idx_events_group_datetime ON events (group_id, event_datetime)
+    WHERE group_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_event_datetime ON events (event_datetime);
+CREATE INDEX IF NOT EXISTS idx_events_user_end ON events (user_id, end_datetime);
+CREATE INDEX IF NOT EXISTS idx_events_group_end ON events (group_id, end_datetime)
+    WHERE group_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_events_search ON events USING GIN (search);
+
+CREATE TABLE IF NOT EXISTS groups (
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    owner_id BIGINT NOT NULL,
+    invite_code TEXT NOT NULL UNIQUE,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS group_members (
+    group_id BIGINT NOT NULL,
+    user_id BIGINT NOT NULL,
+    role TEXT NOT NULL DEFAULT 'member',
+    joined_at TIMESTAMPTZ DEFAULT now(),
+    PRIMARY KEY (group_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members (user_id, group_id);
+
+CREATE TABLE IF NOT EXISTS recurring_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    start_datetime TIMESTAMP NOT NULL,
+    freq TEXT NOT NULL,
+    "interval" INTEGER NOT NULL DEFAULT 1,
+    until TIMESTAMP,
+    location TEXT,
+    dances TEXT,
+    raw_text TEXT,
+    group_id BIGINT,
+    duration_minutes INTEGER,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+CREATE INDEX IF NOT EXISTS idx_recurring_user_id ON recurring_events (user_id);
+CREATE INDEX IF NOT EXISTS idx_recurring_group_id ON recurring_events (group_id)
+    WHERE group_id IS NOT NULL;
+-- Отдельной командой: в базе, созданной до поиска по правилам, колонки ещё нет
+ALTER TABLE recurring_events ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(location, '') || ' ' || coalesce(dances, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(raw_text, '')), 'B')
+) STORED;
+CREATE INDEX IF NOT EXISTS idx_recurring_search ON recurring_events USING GIN (search);
+
+CREATE TABLE IF NOT EXISTS recurrence_exceptions (
+    rule_id BIGINT NOT NULL,
+    occurrence_datetime TIMESTAMP NOT NULL,
+    PRIMARY KEY (rule_id, occurrence_datetime)
+);
+
+CREATE TABLE IF NOT EXISTS user_versions (
+    user_id BIGINT PRIMARY KEY,
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL
+);
+-- Эпоха базы для ETag подписки, как в SQLite. После восстановления из
+-- pg_dump её нужно сменить: UPDATE database_epoch SET epoch = md5(random()::text)
+CREATE TABLE IF NOT EXISTS database_epoch (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    epoch TEXT NOT NULL
+);
+INSERT INTO database_epoch (id, epoch) VALUES (1, substr(md5(random()::text), 1, 8))
+    ON CONFLICT DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS digest_runs (
+    digest_date DATE PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP
+);
+ALTER TABLE digest_runs ADD COLUMN IF NOT EXISTS owner TEXT, ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP;
+CREATE TABLE IF NOT EXISTS digest_deliveries (
+    digest_date DATE NOT NULL,
+    user_id BIGINT NOT NULL,
+    status TEXT NOT NULL,
+    sent_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (digest_date, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS vocabulary (
+    kind TEXT NOT NULL CHECK (kind IN ('dance', 'location')),
+    name TEXT NOT NULL,
+    variants TEXT,
+    created_at TIMESTAMPTZ DEFAULT now(),
+    PRIMARY KEY (kind, name)
+);
+
+-- Счётчик изменений календаря (см. database._init_versions)
+CREATE OR REPLACE FUNCTION bump_user_versions(owner BIGINT, grp BIGINT) RETURNS void AS $$
+    INSERT INTO user_versions (user_id, version, updated_at)
+    SELECT user_id, 1, now() AT TIME ZONE 'UTC' FROM (
+        SELECT owner AS user_id WHERE grp IS NULL
+        UNION
+        SELECT user_id FROM group_members WHERE group_id = grp
+    ) recipients
+    ON CONFLICT (user_id) DO UPDATE SET version = user_versions.version + 1, updated_at = excluded.updated_at
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION calendar_changed() RETURNS trigger AS $$
+DECLARE
+    changed JSONB;
+    owner BIGINT;
+    grp BIGINT;
+BEGIN
+    FOREACH changed IN ARRAY CASE TG_OP
+        WHEN 'INSERT' THEN ARRAY[to_jsonb(NEW)]
+        WHEN 'DELETE' THEN ARRAY[to_jsonb(OLD)]
+        ELSE ARRAY[to_jsonb(OLD), to_jsonb(NEW)]
+    END LOOP
+        IF TG_TABLE_NAME = 'recurrence_exceptions' THEN
+            SELECT user_id, group_id INTO owner, grp FROM recurring_events
+            WHERE id = (changed->>'rule_id')::BIGINT;
+        ELSIF TG_TABLE_NAME = 'group_members' THEN
+            owner := (changed->>'user_id')::BIGINT;
+            grp := NULL;
+        ELSE
+            owner := (changed->>'user_id')::BIGINT;
+            grp := (changed->>'group_id')::BIGINT;
+        END IF;
+        PERFORM bump_user_versions(owner, grp);
+    END LOOP;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER events_version AFTER INSERT OR UPDATE OR DELETE ON events
+    FOR EACH ROW EXECUTE FUNCTION calendar_changed();
+CREATE OR REPLACE TRIGGER recurring_events_version AFTER INSERT OR UPDATE OR DELETE ON recurring_events
+    FOR EACH ROW EXECUTE FUNCTION calendar_changed();
+CREATE OR REPLACE TRIGGER recurrence_exceptions_version
+    AFTER INSERT OR UPDATE OR DELETE ON recurrence_exceptions
+    FOR EACH ROW EXECUTE FUNCTION calendar_changed();
+CREATE OR REPLACE TRIGGER group_members_version AFTER INSERT OR UPDATE OR DELETE ON group_members
+    FOR EACH ROW EXECUTE FUNCTION calendar_changed();
+"""
+
+# Ключ advisory-блокировки: схему создаёт только один экземпляр за раз
+_PG_SCHEMA_LOCK = 0x64616E6365
+
+_EVENT_COLUMNS = "e.id, e.event_datetime, e.location, e.dances, e.raw_text, e.group_id, e.end_datetime"
+
+_RULE_COLUMNS = """r.id, r.user_id, r.start_datetime, r.freq, r."interval" AS interval, r.until,
+                   r.location, r.dances, r.raw_text, r.group_id, r.duration_minutes"""
+
+
+def _pg_visible_events_sql(condition: str) -> str:
+    """Как database._visible_events_sql: $1 — user_id, condition — условие на e"""
+    return f"""
+        SELECT {_EVENT_COLUMNS} FROM events e
+        WHERE e.user_id = $1 AND e.group_id IS NULL AND {condition}
+        UNION ALL
+        SELECT {_EVENT_COLUMNS} FROM group_members m
+        JOIN events e ON e.group_id = m.group_id
+        WHERE m.user_id = $1 AND {condition}
+    """
+
+
+def _pg_rules_sql(condition: str) -> str:
+    """Правила пользователя ($1) и его ансамблей"""
+    return f"""
+        SELECT {_RULE_COLUMNS} FROM recurring_events r
+        WHERE r.user_id = $1 AND r.group_id IS NULL AND {condition}
+        UNION ALL
+        SELECT {_RULE_COLUMNS} FROM group_members m
+        JOIN recurring_events r ON r.group_id = m.group_id
+        WHERE m.user_id = $1 AND {condition}
+    """
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def _event(row) -> Event:
+    """Строка asyncpg → Event (даты строками ISO, как их отдаёт SQLite)"""
+    return Event(row['id'], row['event_datetime'].isoformat(), row['location'], row['dances'],
+                 row['raw_text'], row['group_id'], _iso(row['end_datetime']))
+
+
+def _rule(row) -> Dict:
+    """Правило в том виде, в каком его понимает database.iter_occurrences"""
+    rule = dict(row)
+    rule['start_datetime'] = rule['start_datetime'].isoformat()
+    rule['until'] = _iso(rule['until'])
+    return rule
+
+
+def _rowcount(status: str) -> int:
+    """Число строк из статуса команды asyncpg («DELETE 1», «INSERT 0 5»)"""
+    return int(status.rsplit(" ", 1)[-1])
+
+
+class PostgresStorage(Storage):
+    """PostgreSQL через пул соединений asyncpg (нужен PostgreSQL 14+)"""
+
+    def __init__(self, dsn: str, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE):
+        self._dsn = dsn
+        self._min_size = min_size
+        self._max_size = max_size
+        self._pool = None
+
+    async def open(self):
+        if asyncpg is None:
+            raise RuntimeError("Для STORAGE_BACKEND=postgres нужен пакет asyncpg")
+        self._pool = await asyncpg.create_pool(self._dsn, min_size=self._min_size, max_size=self._max_size)
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", _PG_SCHEMA_LOCK)
+                await conn.execute(_PG_SCHEMA)
+        logger.info("PostgreSQL storage initialized successfully")
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    # --- События ---
+
+    async def add_event(self, user_id, event_datetime, location, dances, raw_text,
+                        group_id=None, end_datetime=None) -> bool:
+        try:
+            await self._pool.execute("""
+                INSERT INTO events (user_id, event_datetime, location, dances, raw_text, group_id, end_datetime)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+            """, user_id, event_datetime, location or "", ",".join(dances) if dances else "", raw_text,
+                group_id, end_datetime)
+            logger.info(f"Event added for user {user_id} at {event_datetime}")
+            return True
+        except Exception as e:
+            logger.error(f"Error adding event for user {user_id}: {e}")
+            return False
+
+    async def add_events_batch(self, user_id, events) -> int:
+        # Одна команда на пачку; DISTINCT ON убирает дубликаты внутри самой пачки
+        try:
+            status = await self._pool.execute("""
+                INSERT INTO events (user_id, event_datetime, end_datetime, location, dances, raw_text)
+                SELECT $1, b.start_at, b.end_at, b.location, b.dances, b.raw_text
+                FROM (
+                    SELECT DISTINCT ON (start_at, location) *
+                    FROM unnest($2::timestamp[], $3::timestamp[], $4::text[], $5::text[], $6::text[])
+                        WITH ORDINALITY AS u(start_at, end_at, location, dances, raw_text, n)
+                    ORDER BY start_at, location, n
+                ) b
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM events e
+                    WHERE e.user_id = $1 AND e.event_datetime = b.start_at AND e.location = b.location
+                )
+                ORDER BY b.n
+            """, user_id,
+                [start for start, _, _, _, _ in events],
+                [end for _, end, _, _, _ in events],
+                [location or "" for _, _, location, _, _ in events],
+                [",".join(dances) if dances else "" for _, _, _, dances, _ in events],
+                [raw_text for _, _, _, _, raw_text in events])
+            added = _rowcount(status)
+            logger.info(f"Imported {added} of {len(events)} events for user {user_id}")
+            return added
+        except Exception as e:
+            logger.error(f"Error importing events for user {user_id}: {e}")
+            return 0
+
+    async def delete_event(self, event_id) -> bool:
+        try:
+            status = await self._pool.execute("DELETE FROM events WHERE id = $1", event_id)
+            logger.info(f"Event {event_id} deleted")
+            return _rowcount(status) > 0
+        except Exception as e:
+            logger.error(f"Error deleting event {event_id}: {e}")
+            return False
+
+    async def _occurrences(self, conn, user_id: int, start: datetime, end: Optional[datetime] = None):
+        """Генераторы повторений правил пользователя, пересекающих окно"""
+        rules = await conn.fetch(_pg_rules_sql("r.start_datetime <= $3 AND (r.until IS NULL OR r.until >= $2)"),
+                                 user_id, start, end or datetime.max)
+        if not rules:
+            return []
+        exceptions = await self._load_exceptions(conn, [rule['id'] for rule in rules], start, end)
+        return [iter_occurrences(_rule(rule), exceptions.get(rule['id'], set()), start, end) for rule in rules]
+
+    @staticmethod
+    async def _load_exceptions(conn, rule_ids: List[int], start: datetime,
+                               end: Optional[datetime] = None) -> Dict[int, Set[str]]:
+        rows = await conn.fetch("""
+            SELECT rule_id, occurrence_datetime FROM recurrence_exceptions
+            WHERE rule_id = ANY($1::bigint[]) AND occurrence_datetime BETWEEN $2 AND $3
+        """, rule_ids, start, end or datetime.max)
+        exceptions: Dict[int, Set[str]] = {}
+        for row in rows:
+            exceptions.setdefault(row['rule_id'], set()).add(row['occurrence_datetime'].isoformat())
+        return exceptions
+
+    async def get_upcoming_events(self, user_id, limit=50, now=None) -> List[Event]:
+        try:
+            now = now or clock.now()
+            async with self._pool.acquire() as conn:
+                rows = await conn.fetch(
+                    _pg_visible_events_sql("e.event_datetime >= $2") + " ORDER BY event_datetime ASC LIMIT $3",
+                    user_id, now, limit
+                )
+                events = [_event(row) for row in rows]
+                return merge_occurrences(events, await self._occurrences(conn, user_id, now), limit)
+        except Exception as e:
+            logger.error(f"Error getting events for user {user_id}: {e}")
+            return []
+
+    async def get_events_by_date_range(self, user_id, start_date, end_date) -> List[Event]:
+        try:
+            async with self._pool.acquire() as conn:
+                rows = await conn.fetch(
+                    _pg_visible_events_sql("e.event_datetime BETWEEN $2 AND $3") + " ORDER BY event_datetime ASC",
+                    user_id, start_date, end_date
+                )
+                events = [_event(row) for row in rows]
+                return merge_occurrences(events, await self._occurrences(conn, user_id, start_date, end_date))
+        except Exception as e:
+            logger.error(f"Error getting events for date range: {e}")
+            return []
+
+    async def get_overlapping_events(self, user_id, start, end, group_id=None) -> List[Event]:
+        # Как database.get_overlapping_events: пересечение по настоящему окончанию
+        scope = user_id if group_id is None else group_id
+        conditions = (
+            "e.end_datetime > $2 AND e.event_datetime < $3",
+            "e.end_datetime IS NULL AND e.event_datetime > $4 AND e.event_datetime < $3",
+        )
+        rule_condition = """r.start_datetime < $3 AND (r.until IS NULL OR
+            r.until + make_interval(mins => COALESCE(r.duration_minutes, $4)) > $2)"""
+        if group_id is None:
+            sql = " UNION ALL ".join(_pg_visible_events_sql(condition) for condition in conditions)
+            rules_sql = _pg_rules_sql(rule_condition)
+        else:
+            sql = " UNION ALL ".join(f"SELECT {_EVENT_COLUMNS} FROM events e WHERE e.group_id = $1 AND {condition}"
+                                     for condition in conditions)
+            rules_sql = f"SELECT {_RULE_COLUMNS} FROM recurring_events r WHERE r.group_id = $1 AND {rule_condition}"
+        try:
+            async with self._pool.acquire() as conn:
+                rows = await conn.fetch(sql + " ORDER BY event_datetime ASC", scope, start, end,
+                                        start - timedelta(minutes=DEFAULT_DURATION_MINUTES))
+                events = [_event(row) for row in rows]
+                rules = [_rule(rule) for rule in await conn.fetch(rules_sql, scope, start, end,
+                                                                  DEFAULT_DURATION_MINUTES)]
+                if not rules:
+                    return events
+                longest = max(rule_duration(rule) for rule in rules)
+                exceptions = await self._load_exceptions(conn, [rule['id'] for rule in rules], start - longest, end)
+            occurrences = [iter_occurrences(rule, exceptions.get(rule['id'], set()), start - rule_duration(rule), end)
+                           for rule in rules]
+            return [ev for ev in merge_occurrences(events, occurrences) if ev.dt < end and ev.end > start]
+        except Exception as e:
+            logger.error(f"Error getting overlapping events for user {user_id}: {e}")
+            return []
+
+    async def get_all_events(self, user_id) -> List[Event]:
+        try:
+            rows = await self._pool.fetch(_pg_visible_events_sql("TRUE") + " ORDER BY event_datetime ASC", user_id)
+            return [_event(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting all events for user {user_id}: {e}")
+            return []
+
+    async def search_events(self, user_id, query, limit=10, offset=0, now=None) -> List[Event]:
+        terms = fts_terms(query)
+        if not terms:
+            return []
+        # Основы только из букв и цифр, так что в кавычках они безопасны для to_tsquery
+        ts_query = " & ".join(f"'{term}':*" for term in terms)
+        try:
+            now = now or clock.now()
+            async with self._pool.acquire() as conn:
+                # Вес A (место, танцы) выше, чем B (текст) — как bm25 с весами в SQLite
+                rows = await conn.fetch(f"""
+                    SELECT {_EVENT_COLUMNS}, NULL::bigint AS rule_id, ts_rank(e.search, q) AS rank
+                    FROM events e, to_tsquery('simple', $1) q
+                    WHERE e.search @@ q
+                    AND ((e.user_id = $2 AND e.group_id IS NULL)
+                         OR e.group_id IN (SELECT group_id FROM group_members WHERE user_id = $2))
+                    UNION ALL
+                    SELECT NULL, r.start_datetime, r.location, r.dances, r.raw_text, r.group_id, NULL,
+                           r.id, ts_rank(r.search, q)
+                    FROM recurring_events r, to_tsquery('simple', $1) q
+                    WHERE r.search @@ q
+                    AND ((r.user_id = $2 AND r.group_id IS NULL)
+                         OR r.group_id IN (SELECT group_id FROM group_members WHERE user_id = $2))
+                    ORDER BY rank DESC, event_datetime DESC
+                    LIMIT $3 OFFSET $4
+                """, ts_query, user_id, limit, offset)
+                rule_ids = [row['rule_id'] for row in rows if row['rule_id'] is not None]
+                if not rule_ids:
+                    return [_event(row) for row in rows]
+                rules = {rule['id']: _rule(rule) for rule in await conn.fetch(
+                    f"SELECT {_RULE_COLUMNS} FROM recurring_events r WHERE r.id = ANY($1::bigint[])", rule_ids)}
+                exceptions = await self._load_exceptions(conn, rule_ids, now)
+            hits = []
+            for row in rows:
+                if row['rule_id'] is None:
+                    hits.append(_event(row))
+                    continue
+                # Правило показываем ближайшим повторением, а если они кончились — началом
+                start = Event(None, row['event_datetime'].isoformat(), row['location'], row['dances'],
+                              row['raw_text'], row['group_id'], rule_id=row['rule_id'])
+                hits.append(next(iter_occurrences(rules[row['rule_id']],
+                                                   exceptions.get(row['rule_id'], set()), now), start))
+            return hits
+        except Exception as e:
+            logger.error(f"Error searching events for user {user_id}: {e}")
+            return []
+
+    async def get_user_events_page(self, user_id, after=None, limit=500) -> List[Event]:
+        if after:
+            rows = await self._pool.fetch(
+                _pg_visible_events_sql("(e.event_datetime, e.id) > ($3, $4)")
+                + " ORDER BY event_datetime ASC, id ASC LIMIT $2",
+                user_id, limit, datetime.fromisoformat(after[0]), after[1]
+            )
+        else:
+            rows = await self._pool.fetch(
+                _pg_visible_events_sql("TRUE") + " ORDER BY event_datetime ASC, id ASC LIMIT $2",
+                user_id, limit
+            )
+        return [_event(row) for row in rows]
+
+    async def get_user_rules(self, user_id) -> List[Tuple[Dict, List[str]]]:
+        try:
+            async with self._pool.acquire() as conn:
+                rules = await conn.fetch(_pg_rules_sql("TRUE"), user_id)
+                if not rules:
+                    return []
+                exceptions = await self._load_exceptions(conn, [rule['id'] for rule in rules], datetime.min)
+                return [(_rule(rule), sorted(exceptions.get(rule['id'], ()))) for rule in rules]
+        except Exception as e:
+            logger.error(f"Error getting recurring events for user {user_id}: {e}")
+            return []
+
+    async def get_user_version(self, user_id) -> Tuple[str, int, Optional[str]]:
+        try:
+            row = await self._pool.fetchrow("""
+                SELECT d.epoch, v.version, v.updated_at
+                FROM database_epoch d LEFT JOIN user_versions v ON v.user_id = $1
+            """, user_id)
+            updated_at = row['updated_at'].isoformat(sep=" ", timespec="seconds") if row['updated_at'] else None
+            return row['epoch'], row['version'] or 0, updated_at
+        except Exception as e:
+            logger.error(f"Error getting calendar version for user {user_id}: {e}")
+            return "", 0, None
+
+    async def get_stats(self, now) -> Dict[str, int]:
+        row = await self._pool.fetchrow("""
+            SELECT COUNT(*) AS total_events,
+                   COUNT(*) FILTER (WHERE event_datetime >= $1) AS upcoming_events,
+                   COUNT(DISTINCT user_id) AS total_users
+            FROM events
+        """, now)
+        return dict(row)
+
+    # --- Регулярные события ---
+
+    async def add_recurring_event(self, user_id, start_datetime, freq, interval, location, dances, raw_text,
+                                  until=None, group_id=None, duration_minutes=None, exceptions=None) -> bool:
+        if freq not in FREQ_DAYS:
+            logger.error(f"Unknown recurrence frequency {freq!r} for user {user_id}")
+            return False
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    rule_id = await conn.fetchval("""
+                        INSERT INTO recurring_events
+                            (user_id, start_datetime, freq, "interval", until, location, dances, raw_text,
+                             group_id, duration_minutes)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                        RETURNING id
+                    """, user_id, start_datetime, freq, interval, until, location or "",
+                        ",".join(dances) if dances else "", raw_text, group_id, duration_minutes)
+                    if exceptions:
+                        await conn.executemany("""
+                            INSERT INTO recurrence_exceptions (rule_id, occurrence_datetime) VALUES ($1, $2)
+                            ON CONFLICT DO NOTHING
+                        """, [(rule_id, moment) for moment in exceptions])
+            logger.info(f"Recurring event ({freq}/{interval}) added for user {user_id} from {start_datetime}")
+            return True
+        except Exception as e:
+            logger.error(f"Error adding recurring event for user {user_id}: {e}")
+            return False
+
+    async def has_recurring_event(self, user_id, start_datetime, freq) -> bool:
+        try:
+            row = await self._pool.fetchrow("""
+                SELECT 1 FROM recurring_events WHERE user_id = $1 AND start_datetime = $2 AND freq = $3
+            """, user_id, start_datetime, freq)
+            return row is not None
+        except Exception as e:
+            logger.error(f"Error checking recurring events for user {user_id}: {e}")
+            return False
+
+    async def add_recurring_events_batch(self, user_id, rules) -> int:
+        # Одна вставка на пачку; отменённые повторения — по номерам добавленных строк
+        rules = [rule for rule in rules if rule[1] in FREQ_DAYS]
+        if not rules:
+            return 0
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    rows = await conn.fetch("""
+                        INSERT INTO recurring_events
+                            (user_id, start_datetime, freq, "interval", until, location, dances, raw_text,
+                             duration_minutes)
+                        SELECT $1, b.start_at, b.freq, b.step, b.until, b.location, b.dances, b.raw_text,
+                               b.duration
+                        FROM (
+                            SELECT DISTINCT ON (start_at, freq) *
+                            FROM unnest($2::timestamp[], $3::text[], $4::int[], $5::timestamp[], $6::text[],
+                                        $7::text[], $8::text[], $9::int[])
+                                WITH ORDINALITY AS u(start_at, freq, step, until, location, dances, raw_text,
+                                                     duration, n)
+                            ORDER BY start_at, freq, n
+                        ) b
+                        WHERE NOT EXISTS (
+                            SELECT 1 FROM recurring_events r
+                            WHERE r.user_id = $1 AND r.start_datetime = b.start_at AND r.freq = b.freq
+                        )
+                        ORDER BY b.n
+                        RETURNING id, start_datetime, freq
+                    """, user_id,
+                        [rule[0] for rule in rules],
+                        [rule[1] for rule in rules],
+                        [rule[2] for rule in rules],
+                        [rule[3] for rule in rules],
+                        [rule[4] or "" for rule in rules],
+                        [",".join(rule[5]) if rule[5] else "" for rule in rules],
+                        [rule[6] for rule in rules],
+                        [rule[7] for rule in rules])
+                    exceptions = {(rule[0], rule[1]): rule[8] for rule in reversed(rules)}
+                    await conn.executemany("""
+                        INSERT INTO recurrence_exceptions (rule_id, occurrence_datetime) VALUES ($1, $2)
+                        ON CONFLICT DO NOTHING
+                    """, [(row["id"], moment) for row in rows
+                          for moment in exceptions[(row["start_datetime"], row["freq"])] or []])
+            logger.info(f"Imported {len(rows)} of {len(rules)} recurring events for user {user_id}")
+            return len(rows)
+        except Exception as e:
+            logger.error(f"Error importing recurring events for user {user_id}: {e}")
+            return 0
+
+    async def skip_occurrence(self, rule_id, occurrence_datetime) -> bool:
+        try:
+            await self._pool.execute("""
+                INSERT INTO recurrence_exceptions (rule_id, occurrence_datetime) VALUES ($1, $2)
+                ON CONFLICT DO NOTHING
+            """, rule_id, datetime.fromisoformat(occurrence_datetime))
+            logger.info(f"Occurrence {occurrence_datetime} of rule {rule_id} skipped")
+            return True
+        except Exception as e:
+            logger.error(f"Error skipping occurrence of rule {rule_id}: {e}")
+            return False
+
+    async def delete_recurring_event(self, rule_id) -> bool:
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute("DELETE FROM recurrence_exceptions WHERE rule_id = $1", rule_id)
+                    status = await conn.execute("DELETE FROM recurring_events WHERE id = $1", rule_id)
+            logger.info(f"Recurring event {rule_id} deleted")
+            return _rowcount(status) > 0
+        except Exception as e:
+            logger.error(f"Error deleting recurring event {rule_id}: {e}")
+            return False
+
+    # --- Ансамбли ---
+
+    async def create_group(self, owner_id, name):
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.transaction():
+                    group = await conn.fetchrow("""
+                        INSERT INTO groups (name, owner_id, invite_code) VALUES ($1, $2, $3)
+                        RETURNING id, name, invite_code
+                    """, name, owner_id, secrets.token_urlsafe(6))
+                    await conn.execute("""
+                        INSERT INTO group_members (group_id, user_id, role) VALUES ($1, $2, 'leader')
+                    """, group['id'], owner_id)
+            logger.info(f"Group {group['id']} created by user {owner_id}")
+            return group
+        except Exception as e:
+            logger.error(f"Error creating group for user {owner_id}: {e}")
+            return None
+
+    async def join_group(self, user_id, invite_code):
+        try:
+            async with self._pool.acquire() as conn:
+                group = await conn.fetchrow("SELECT id, name, invite_code FROM groups WHERE invite_code = $1",
+                                            invite_code)
+                if group is None:
+                    return None
+                await conn.execute("""
+                    INSERT INTO group_members (group_id, user_id) VALUES ($1, $2) ON CONFLICT DO NOTHING
+                """, group['id'], user_id)
+            logger.info(f"User {user_id} joined group {group['id']}")
+            return group
+        except Exception as e:
+            logger.error(f"Error joining group for user {user_id}: {e}")
+            return None
+
+    async def leave_group(self, user_id, group_id) -> bool:
+        try:
+            status = await self._pool.execute("DELETE FROM group_members WHERE group_id = $1 AND user_id = $2",
+                                              group_id, user_id)
+            logger.info(f"User {user_id} left group {group_id}")
+            return _rowcount(status) > 0
+        except Exception as e:
+            logger.error(f"Error leaving group {group_id} for user {user_id}: {e}")
+            return False
+
+    async def get_user_groups(self, user_id) -> List:
+        try:
+            return await self._pool.fetch("""
+                SELECT g.id, g.name, g.invite_code, m.role,
+                       (SELECT COUNT(*) FROM group_members c WHERE c.group_id = g.id) AS members
+                FROM group_members m
+                JOIN groups g ON g.id = m.group_id
+                WHERE m.user_id = $1
+                ORDER BY g.name
+            """, user_id)
+        except Exception as e:
+            logger.error(f"Error getting groups for user {user_id}: {e}")
+            return []
+
+    async def get_member_role(self, group_id, user_id) -> Optional[str]:
+        try:
+            return await self._pool.fetchval("""
+                SELECT role FROM group_members WHERE group_id = $1 AND user_id = $2
+            """, group_id, user_id)
+        except Exception as e:
+            logger.error(f"Error getting role in group {group_id} for user {user_id}: {e}")
+            return None
+
+    # --- Утренняя сводка ---
+
+    async def get_notification_recipients(self, start, end, after=None, limit=None) -> List[Tuple[int, Event]]:
+        # Страница — следующие limit получателей по user_id (keyset), так
+        # что iter_notification_recipients не держит в памяти весь день
+        async with self._pool.acquire() as conn:
+            rules = await conn.fetch(f"""
+                SELECT {_RULE_COLUMNS} FROM recurring_events r
+                WHERE r.start_datetime <= $2 AND (r.until IS NULL OR r.until >= $1)
+            """, start, end)
+            personal, by_group = {}, {}
+            if rules:
+                exceptions = await self._load_exceptions(conn, [rule['id'] for rule in rules], start, end)
+                for rule in rules:
+                    rule_events = list(iter_occurrences(_rule(rule), exceptions.get(rule['id'], set()), start, end))
+                    if not rule_events:
+                        continue
+                    if rule['group_id'] is None:
+                        personal.setdefault(rule['user_id'], []).extend(rule_events)
+                    else:
+                        by_group.setdefault(rule['group_id'], []).extend(rule_events)
+
+            # Получатели: у кого есть события в окне или повторения правил
+            recipients = [row['recipient'] for row in await conn.fetch("""
+                SELECT recipient FROM (
+                    SELECT COALESCE(m.user_id, e.user_id) AS recipient
+                    FROM events e
+                    LEFT JOIN group_members m ON m.group_id = e.group_id
+                    WHERE e.event_datetime BETWEEN $1 AND $2
+                    UNION
+                    SELECT unnest($3::bigint[])
+                    UNION
+                    SELECT user_id FROM group_members WHERE group_id = ANY($4::bigint[])
+                ) r
+                WHERE $5::bigint IS NULL OR recipient > $5
+                ORDER BY recipient
+                LIMIT $6
+            """, start, end, list(personal), list(by_group), after, limit)]
+            if not recipients:
+                return []
+
+            rows = await conn.fetch(f"""
+                SELECT COALESCE(m.user_id, e.user_id) AS recipient, {_EVENT_COLUMNS}
+                FROM events e
+                LEFT JOIN group_members m ON m.group_id = e.group_id
+                WHERE e.event_datetime BETWEEN $1 AND $2 AND COALESCE(m.user_id, e.user_id) = ANY($3::bigint[])
+            """, start, end, recipients)
+            pairs = [(row['recipient'], _event(row)) for row in rows]
+            for recipient in recipients:
+                pairs.extend((recipient, ev) for ev in personal.get(recipient, []))
+            if by_group:
+                members = await conn.fetch("""
+                    SELECT user_id, group_id FROM group_members
+                    WHERE group_id = ANY($1::bigint[]) AND user_id = ANY($2::bigint[])
+                """, list(by_group), recipients)
+                pairs.extend((row['user_id'], ev) for row in members for ev in by_group[row['group_id']])
+
+        pairs.sort(key=lambda pair: (pair[0], pair[1].event_datetime))
+        return pairs
+
+    async def start_digest_run(self, digest_date, owner, lease_until) -> bool:
+        # Строка рассылки блокируется на время UPSERT, так что из
+        # одновременных попыток захвата проходит ровно одна
+        try:
+            status = await self._pool.execute("""
+                INSERT INTO digest_runs (digest_date, started_at, owner, lease_until) VALUES ($1, $2, $3, $4)
+                ON CONFLICT (digest_date) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until
+                WHERE digest_runs.finished_at IS NULL
+                AND (digest_runs.lease_until IS NULL OR digest_runs.lease_until < excluded.started_at)
+            """, date.fromisoformat(digest_date), clock.now(), owner, lease_until)
+            return _rowcount(status) > 0
+        except Exception as e:
+            logger.error(f"Error starting digest run {digest_date}: {e}")
+            return False
+
+    async def extend_digest_lease(self, digest_date, owner, lease_until) -> bool:
+        try:
+            status = await self._pool.execute("""
+                UPDATE digest_runs SET lease_until = $3
+                WHERE digest_date = $1 AND owner = $2 AND finished_at IS NULL
+            """, date.fromisoformat(digest_date), owner, lease_until)
+            return _rowcount(status) > 0
+        except Exception as e:
+            logger.error(f"Error extending digest lease {digest_date}: {e}")
+            return False
+
+    async def finish_digest_run(self, digest_date):
+        try:
+            await self._pool.execute("UPDATE digest_runs SET finished_at = $1 WHERE digest_date = $2",
+                                     clock.now(), date.fromisoformat(digest_date))
+        except Exception as e:
+            logger.error(f"Error finishing digest run {digest_date}: {e}")
+
+    async def is_digest_run_unfinished(self, digest_date) -> bool:
+        try:
+            row = await self._pool.fetchrow("SELECT finished_at FROM digest_runs WHERE digest_date = $1",
+                                            date.fromisoformat(digest_date))
+            return row is not None and row['finished_at'] is None
+        except Exception as e:
+            logger.error(f"Error checking digest run {digest_date}: {e}")
+            return False
+
+    async def get_digest_recipients_done(self, digest_date) -> Set[int]:
+        try:
+            rows = await self._pool.fetch("""
+                SELECT user_id FROM digest_deliveries
+                WHERE digest_date = $1 AND status IN ('sent', 'blocked')
+            """, date.fromisoformat(digest_date))
+            return {row['user_id'] for row in rows}
+        except Exception as e:
+            logger.error(f"Error getting digest deliveries for {digest_date}: {e}")
+            return set()
+
+    async def record_digest_delivery(self, digest_date, user_id, status):
+        try:
+            await self._pool.execute("""
+                INSERT INTO digest_deliveries (digest_date, user_id, status, sent_at) VALUES ($1, $2, $3, $4)
+                ON CONFLICT (digest_date, user_id) DO UPDATE SET status = excluded.status, sent_at = excluded.sent_at
+            """, date.fromisoformat(digest_date), user_id, status, clock.now())
+        except Exception as e:
+            logger.error(f"Error recording digest delivery to {user_id}: {e}")
+
+    # --- Словарь ---
+
+    async def get_vocabulary_entries(self) -> List[Tuple[str, str, Optional[str]]]:
+        try:
+            rows = await self._pool.fetch("SELECT kind, name, variants FROM vocabulary ORDER BY kind, name")
+            return [tuple(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting vocabulary: {e}")
+            return []
+
+    async def add_vocabulary_entry(self, kind, name, variants) -> bool:
+        try:
+            await self._pool.execute("""
+                INSERT INTO vocabulary (kind, name, variants) VALUES ($1, $2, $3)
+                ON CONFLICT (kind, name) DO UPDATE SET
+                    variants = CASE
+                        WHEN excluded.variants = '' THEN vocabulary.variants
+                        WHEN vocabulary.variants IS NULL OR vocabulary.variants = '' THEN excluded.variants
+                        ELSE vocabulary.variants || ',' || excluded.variants
+                    END
+            """, kind, name, ",".join(variants))
+            logger.info(f"Vocabulary {kind} {name!r} saved")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving vocabulary {kind} {name!r}: {e}")
+            return False
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    """Хранилище по имени движка из конфигурации"""
+    if backend == "sqlite":
+        return SQLiteStorage()
+    if backend == "postgres":
+        if not DATABASE_URL:
+            raise ValueError("STORAGE_BACKEND=postgres требует DATABASE_URL")
+        return PostgresStorage(DATABASE_URL)
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend!r}")
+
+
+# Хранилище процесса (одно на всех обработчиков)
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    """Хранилище, выбранное STORAGE_BACKEND"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+
+def set_storage(storage: Storage):
+    """Подменяет хранилище процесса (например, на PostgreSQL в тестовом стенде)"""
+    global _storage
+    _storage = storage
@@ -0,0 +1,235 @@
+# tests/test_storage.py
+"""
+Общий сценарий для обоих движков хранилища.
+
+Одни и те же проверки идут на SQLite (временный файл) и на PostgreSQL
+(отдельная схема в базе DATABASE_URL, удаляется после теста). Без
+DATABASE_URL или asyncpg тесты PostgreSQL пропускаются. Нужен
+PostgreSQL 14+.
+
+    python -m pytest -q tests
+    DATABASE_URL=postgresql://localhost/test python -m pytest -q tests
+"""
+import os
+import secrets
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+import database
+import storage
+
+NOW = datetime(2026, 10, 19, 12, 0)  # понедельник
+TUESDAY = datetime(2026, 10, 20, 19, 0)
+
+
+class StorageScenario:
+    """Проверки, общие для всех движков; self.storage готовит наследник"""
+
+    async def test_events_and_batch(self):
+        st = self.storage
+        self.assertTrue(await st.add_event(1, TUESDAY, "БКЗ", ["вальс"], "вальс в БКЗ"))
+        added = await st.add_events_batch(1, [
+            (TUESDAY, None, "БКЗ", [], "дубликат"),
+            (TUESDAY + timedelta(days=1), None, "Максим", [], "репетиция"),
+            (TUESDAY + timedelta(days=1), None, "Максим", [], "дубликат в пачке"),
+        ])
+        self.assertEqual(added, 1)
+
+        events = await st.get_upcoming_events(1, now=NOW)
+        self.assertEqual([ev.location for ev in events], ["БКЗ", "Максим"])
+        self.assertEqual(await st.get_upcoming_events(2, now=NOW), [])
+
+        self.assertTrue(await st.delete_event(events[0].id))
+        self.assertEqual(len(await st.get_all_events(1)), 1)
+
+    async def test_overlapping_events(self):
+        st = self.storage
+        # Многодневное событие хранится целиком и находится по окончанию
+        await st.add_event(1, TUESDAY - timedelta(days=2), "", [], "фестиваль", end_datetime=TUESDAY + timedelta(days=1))
+        await st.add_event(1, TUESDAY - timedelta(days=1), "", [], "вчера", end_datetime=TUESDAY - timedelta(hours=20))
+        await st.add_recurring_event(1, TUESDAY - timedelta(weeks=1), "weekly", 1, "", [], "ночная смена",
+                                     duration_minutes=600)
+        group = await st.create_group(1, "Ансамбль")
+        await st.add_event(1, TUESDAY, "", [], "концерт ансамбля", group_id=group['id'])
+
+        window = (TUESDAY + timedelta(hours=1), TUESDAY + timedelta(hours=2))
+        events = await st.get_overlapping_events(1, *window)
+        self.assertEqual(sorted(ev.raw_text for ev in events), ["концерт ансамбля", "ночная смена", "фестиваль"])
+        self.assertEqual(max(ev.end for ev in events), TUESDAY + timedelta(days=1))
+
+        events = await st.get_overlapping_events(1, *window, group_id=group['id'])
+        self.assertEqual([ev.raw_text for ev in events], ["концерт ансамбля"])
+
+    async def test_recurring_events(self):
+        st = self.storage
+        self.assertTrue(await st.add_recurring_event(
+            1, TUESDAY, "weekly", 1, "Студия", ["танго"], "танго по вторникам",
+            until=TUESDAY + timedelta(weeks=3), exceptions=[TUESDAY + timedelta(weeks=1)]))
+        self.assertTrue(await st.has_recurring_event(1, TUESDAY, "weekly"))
+
+        events = await st.get_events_by_date_range(1, NOW, NOW + timedelta(weeks=5))
+        self.assertEqual([ev.dt for ev in events],
+                         [TUESDAY, TUESDAY + timedelta(weeks=2), TUESDAY + timedelta(weeks=3)])
+        rule_id = events[0].rule_id
+        self.assertIsNotNone(rule_id)
+
+        self.assertTrue(await st.skip_occurrence(rule_id, TUESDAY.isoformat()))
+        events = await st.get_upcoming_events(1, now=NOW)
+        self.assertEqual(events[0].dt, TUESDAY + timedelta(weeks=2))
+
+        self.assertTrue(await st.delete_recurring_event(rule_id))
+        self.assertEqual(await st.get_upcoming_events(1, now=NOW), [])
+
+    async def test_recurring_batch(self):
+        st = self.storage
+        await st.add_recurring_event(1, TUESDAY, "weekly", 1, "", [], "уже есть")
+        rules = [
+            (TUESDAY, "weekly", 1, None, "", [], "дубликат", None, []),
+            (TUESDAY + timedelta(days=2), "weekly", 1, TUESDAY + timedelta(weeks=2), "Студия", ["танго"],
+             "танго по четвергам", 90, [TUESDAY + timedelta(days=9)]),
+            (TUESDAY + timedelta(days=2), "weekly", 1, None, "", [], "дубликат в пачке", None, []),
+        ]
+        self.assertEqual(await st.add_recurring_events_batch(1, rules), 1)
+
+        events = await st.get_events_by_date_range(1, NOW, NOW + timedelta(weeks=3))
+        thursdays = [ev for ev in events if ev.raw_text == "танго по четвергам"]
+        self.assertEqual([ev.dt for ev in thursdays], [TUESDAY + timedelta(days=2)])
+        self.assertEqual(thursdays[0].end - thursdays[0].dt, timedelta(minutes=90))
+
+    async def test_search_finds_events_and_rules(self):
+        st = self.storage
+        await st.add_event(1, TUESDAY, "Дом культуры", ["вальс"], "вальс в доме культуры")
+        await st.add_recurring_event(1, TUESDAY - timedelta(weeks=4), "weekly", 1, "Студия", ["танго"],
+                                     "танго по вторникам")
+        await st.add_recurring_event(2, TUESDAY, "weekly", 1, "Студия", ["танго"], "чужое танго")
+
+        hits = await st.search_events(1, "танго", now=NOW)
+        self.assertEqual(len(hits), 1)
+        self.assertIsNotNone(hits[0].rule_id)
+        # Правило показывается ближайшим повторением
+        self.assertEqual(hits[0].dt, TUESDAY)
+
+        hits = await st.search_events(1, "вальс", now=NOW)
+        self.assertEqual([(ev.location, ev.rule_id) for ev in hits], [("Дом культуры", None)])
+
+    async def test_groups_and_versions(self):
+        st = self.storage
+        epoch, version, _ = await st.get_user_version(2)
+        self.assertEqual(version, 0)
+
+        group = await st.create_group(1, "Ансамбль")
+        self.assertIsNotNone(await st.join_group(2, group['invite_code']))
+        await st.add_event(1, TUESDAY, "БКЗ", [], "концерт ансамбля", group_id=group['id'])
+
+        events = await st.get_upcoming_events(2, now=NOW)
+        self.assertEqual([ev.group_id for ev in events], [group['id']])
+        new_epoch, new_version, updated_at = await st.get_user_version(2)
+        self.assertEqual(new_epoch, epoch)
+        self.assertGreater(new_version, version)
+        self.assertIsNotNone(updated_at)
+
+        self.assertTrue(await st.leave_group(2, group['id']))
+        self.assertEqual(await st.get_upcoming_events(2, now=NOW), [])
+
+    async def test_events_page(self):
+        st = self.storage
+        await st.add_events_batch(1, [(TUESDAY + timedelta(hours=i), None, "", [], f"событие {i}")
+                                      for i in range(7)])
+        events = [ev async for ev in st.iter_user_events(1, batch_size=3)]
+        self.assertEqual([ev.dt for ev in events], [TUESDAY + timedelta(hours=i) for i in range(7)])
+
+    async def test_notification_recipients(self):
+        st = self.storage
+        group = await st.create_group(1, "Ансамбль")
+        await st.join_group(3, group['invite_code'])
+        await st.add_event(1, TUESDAY, "БКЗ", [], "концерт ансамбля", group_id=group['id'])
+        await st.add_event(2, TUESDAY - timedelta(hours=2), "", [], "своё")
+        await st.add_recurring_event(4, TUESDAY - timedelta(weeks=1), "weekly", 1, "", [], "правило")
+        await st.add_recurring_event(5, TUESDAY - timedelta(days=1), "weekly", 1, "", [], "не в этот день")
+
+        start, end = TUESDAY.replace(hour=0), TUESDAY.replace(hour=23, minute=59)
+        expected = [(1, "концерт ансамбля"), (2, "своё"), (3, "концерт ансамбля"), (4, "правило")]
+        pairs = await st.get_notification_recipients(start, end)
+        self.assertEqual([(user_id, ev.raw_text) for user_id, ev in pairs], expected)
+        pairs = [pair async for pair in st.iter_notification_recipients(start, end, batch_size=1)]
+        self.assertEqual([(user_id, ev.raw_text) for user_id, ev in pairs], expected)
+        pairs = await st.get_notification_recipients(start, end, after=1, limit=2)
+        self.assertEqual([user_id for user_id, _ in pairs], [2, 3])
+
+    async def test_digest_claim(self):
+        st = self.storage
+        digest_date = date(2026, 10, 20).isoformat()
+        lease_until = datetime.now() + timedelta(minutes=5)
+
+        # Из двух экземпляров рассылку захватывает один
+        self.assertTrue(await st.start_digest_run(digest_date, "a", lease_until))
+        self.assertFalse(await st.start_digest_run(digest_date, "b", lease_until))
+        self.assertTrue(await st.extend_digest_lease(digest_date, "a", lease_until))
+        self.assertFalse(await st.extend_digest_lease(digest_date, "b", lease_until))
+        self.assertTrue(await st.is_digest_run_unfinished(digest_date))
+
+        await st.record_digest_delivery(digest_date, 1, "sent")
+        await st.record_digest_delivery(digest_date, 2, "failed")
+        self.assertEqual(await st.get_digest_recipients_done(digest_date), {1})
+
+        # Захват упавшего экземпляра истёк — рассылку подхватывает другой
+        self.assertTrue(await st.extend_digest_lease(digest_date, "a", datetime.now() - timedelta(seconds=1)))
+        self.assertTrue(await st.start_digest_run(digest_date, "b", lease_until))
+        self.assertFalse(await st.extend_digest_lease(digest_date, "a", lease_until))
+
+        # Законченную рассылку не захватить
+        await st.finish_digest_run(digest_date)
+        self.assertFalse(await st.is_digest_run_unfinished(digest_date))
+        self.assertFalse(await st.start_digest_run(digest_date, "c", datetime.now() + timedelta(days=1)))
+
+
+class SQLiteStorageTest(StorageScenario, unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        self._db_path = database.DB_PATH
+        database.DB_PATH = self.path
+        database.init_db()
+        self.storage = storage.SQLiteStorage()
+        await self.storage.open()
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+        database.DB_PATH = self._db_path
+
+
+@unittest.skipUnless(os.getenv("DATABASE_URL") and storage.asyncpg is not None,
+                     "нужны DATABASE_URL и asyncpg")
+class PostgresStorageTest(StorageScenario, unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        dsn = os.environ["DATABASE_URL"]
+        # Своя схема на каждый тест: данные в базе DATABASE_URL не трогаем
+        self.schema = f"test_storage_{secrets.token_hex(4)}"
+        conn = await storage.asyncpg.connect(dsn)
+        try:
+            await conn.execute(f"CREATE SCHEMA {self.schema}")
+        finally:
+            await conn.close()
+        # Неизвестные asyncpg параметры ссылки уходят в настройки сервера
+        separator = "&" if "?" in dsn else "?"
+        self.storage = storage.PostgresStorage(dsn + separator + urlencode({"search_path": self.schema}),
+                                               min_size=1, max_size=2)
+        await self.storage.open()
+        self.dsn = dsn
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+        conn = await storage.asyncpg.connect(self.dsn)
+        try:
+            await conn.execute(f"DROP SCHEMA {self.schema} CASCADE")
+        finally:
+            await conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,344 @@
+# vocabulary.py
+"""
+Словарь танцев и площадок: падежные формы и компактное префиксное дерево.
+
+Из канонических названий («Белый вальс») по правилам склонения
+порождаются все падежные формы («белого вальса», «белым вальсом»...),
+к ним добавляются вручную перечисленные варианты из parser.py
+(неправильные формы вроде «яблочко» → Морской) и записи из таблицы
+vocabulary в базе. Всё вместе компилируется в префиксное дерево,
+хранящееся плоскими массивами: его можно записать в файл одной
+операцией и так же быстро прочитать при старте.
+
+Сборка файла (повторять после правки словарей в parser.py):
+    python -m vocabulary
+"""
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from fuzzy import BKTree
+
+logger = logging.getLogger(__name__)
+
+VOCABULARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vocabulary.bin")
+
+# Меняется при правке правил склонения или формата файла — старый файл пересобирается
+RULES_VERSION = 1
+
+_MAGIC = b"DVOC"
+_VOWELS = set("аеёиоуыэюяй")
+_VELARS = set("гкх")
+_SIBILANTS = set("жшщчц")
+
+# Порядок падежей в списках форм
+CASES = ("nom", "gen", "dat", "acc", "ins", "prep")
+
+
+def _inflect_word(word: str) -> List[str]:
+    """Формы одного слова по падежам (в порядке CASES)"""
+    w = word.lower()
+    # Аббревиатуры (БКЗ, ДК) и застывший родительный падеж («Горького») не склоняются
+    if (word.isupper() and len(word) > 1) or w.endswith(("ого", "его")) or not w.isalpha():
+        return [w] * 6
+
+    # Прилагательные мужского рода
+    if w.endswith(("ый", "ий", "ой")):
+        s = w[:-2]
+        soft = w.endswith("ий") and s[-1] not in _VELARS
+        hard_ins = "им" if s[-1] in _VELARS | _SIBILANTS else "ым"
+        if soft:
+            return [w, s + "его", s + "ему", w, s + "им", s + "ем"]
+        return [w, s + "ого", s + "ому", w, s + hard_ins, s + "ом"]
+
+    # Прилагательные женского рода
+    if w.endswith("ая"):
+        s = w[:-2]
+        return [w, s + "ой", s + "ой", s + "ую", s + "ой", s + "ой"]
+    if w.endswith("яя"):
+        s = w[:-2]
+        return [w, s + "ей", s + "ей", s + "юю", s + "ей", s + "ей"]
+
+    # Существительные на -а/-я
+    if w.endswith("ия"):
+        s = w[:-1]
+        return [w, s + "и", s + "и", s + "ю", s + "ей", s + "и"]
+    if w.endswith("я"):
+        s = w[:-1]
+        return [w, s + "и", s + "е", s + "ю", s + "ей", s + "е"]
+    if w.endswith("а"):
+        s = w[:-1]
+        gen = "и" if s[-1] in _VELARS | _SIBILANTS else "ы"
+        ins = "ей" if s[-1] in _SIBILANTS else "ой"
+        return [w, s + gen, s + "е", s + "у", s + ins, s + "е"]
+
+    # Множественное число (Снегири, Скакалки, Соперницы)
+    if w.endswith(("ы", "и")):
+        s = w[:-1]
+        soft = w.endswith("и") and s[-1] not in _VELARS | _SIBILANTS
+        if soft or s[-1] in "жшщч":
+            gen = s + "ей"
+        elif s[-1] == "ц":
+            gen = s
+        elif s[-1] == "к" and s[-2] not in _VOWELS:
+            # Беглая гласная: скакалки → скакалок, дробушки → дробушек
+            gen = s[:-1] + ("е" if s[-2] in _SIBILANTS else "о") + "к"
+        else:
+            gen = s + "ов"
+        a = "я" if soft else "а"
+        return [w, gen, s + a + "м", w, s + a + "ми", s + a + "х"]
+
+    # Женский род на -ь (круговерть)
+    if w.endswith("ь"):
+        s = w[:-1]
+        return [w, s + "и", s + "и", w, s + "ью", s + "и"]
+
+    # Мужской род на согласный (Вальс, Максим)
+    if w[-1] not in _VOWELS:
+        ins = "ем" if w[-1] in _SIBILANTS else "ом"
+        return [w, w + "а", w + "у", w, w + ins, w + "е"]
+
+    return [w] * 6
+
+
+def inflect(name: str) -> Set[str]:
+    """Все падежные формы названия; слова фразы согласуются по падежу"""
+    words = [_inflect_word(word) for word in name.split()]
+    if not words:
+        return set()
+    return {" ".join(forms[case] for forms in words) for case in range(len(CASES))}
+
+
+class Trie:
+    """Префиксное дерево фраз → канонических имён в плоских массивах.
+
+    Рёбра узла i — символы _chars[_edges[i]:_edges[i + 1]] (по возрастанию)
+    и узлы _targets с теми же индексами; _values[i] — номер имени
+    в names или -1.
+    """
+
+    __slots__ = ("names", "_chars", "_edges", "_targets", "_values")
+
+    def __init__(self, names: List[str], chars: str, edges: array, targets: array, values: array):
+        self.names = names
+        self._chars = chars
+        self._edges = edges
+        self._targets = targets
+        self._values = values
+
+    @classmethod
+    def compile(cls, phrases: Dict[str, str]) -> "Trie":
+        """Строит дерево из словаря «фраза → каноническое имя»"""
+        names = sorted(set(phrases.values()))
+        name_ids = {name: i for i, name in enumerate(names)}
+
+        root: dict = {}
+        for phrase, name in phrases.items():
+            node = root
+            for ch in phrase:
+                node = node.setdefault(ch, {})
+            node[""] = name_ids[name]
+
+        # Нумеруем узлы в ширину, чтобы рёбра каждого узла шли подряд
+        order = [root]
+        chars, edges, targets, values = [], array("I", [0]), array("I"), array("i")
+        for node in order:
+            values.append(node.get("", -1))
+            for ch in sorted(k for k in node if k):
+                chars.append(ch)
+                targets.append(len(order))
+                order.append(node[ch])
+            edges.append(len(chars))
+        return cls(names, "".join(chars), edges, targets, values)
+
+    def _step(self, node: int, ch: str) -> int:
+        index = self._chars.find(ch, self._edges[node], self._edges[node + 1])
+        return self._targets[index] if index >= 0 else -1
+
+    def get(self, phrase: str) -> Optional[str]:
+        """Каноническое имя для точной фразы"""
+        node = 0
+        for ch in phrase:
+            node = self._step(node, ch)
+            if node < 0:
+                return None
+        value = self._values[node]
+        return self.names[value] if value >= 0 else None
+
+    def longest_match(self, words: List[str], start: int) -> Optional[Tuple[str, int]]:
+        """Самая длинная фраза словаря из слов words[start:] → (имя, индекс после неё)"""
+        node, best = 0, None
+        for k in range(start, len(words)):
+            for ch in (" " + words[k]) if k > start else words[k]:
+                node = self._step(node, ch)
+                if node < 0:
+                    return best
+            value = self._values[node]
+            if value >= 0:
+                best = (self.names[value], k + 1)
+        return best
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """Все пары (фраза, имя)"""
+        stack = [(0, "")]
+        while stack:
+            node, prefix = stack.pop()
+            if self._values[node] >= 0:
+                yield prefix, self.names[self._values[node]]
+            for index in range(self._edges[node], self._edges[node + 1]):
+                stack.append((self._targets[index], prefix + self._chars[index]))
+
+    def __len__(self) -> int:
+        return sum(1 for value in self._values if value >= 0)
+
+    def to_bytes(self) -> Tuple[dict, bytes]:
+        """Заголовок (JSON-совместимый) и двоичное тело массивов"""
+        header = {"names": self.names, "chars": self._chars,
+                  "nodes": len(self._values), "edges": len(self._targets)}
+        return header, self._edges.tobytes() + self._targets.tobytes() + self._values.tobytes()
+
+    @classmethod
+    def from_bytes(cls, header: dict, body: memoryview) -> "Trie":
+        nodes, edges_count = header["nodes"], header["edges"]
+        edges, targets, values = array("I"), array("I"), array("i")
+        offset = 0
+        for arr, count in ((edges, nodes + 1), (targets, edges_count), (values, nodes)):
+            size = count * arr.itemsize
+            arr.frombytes(body[offset:offset + size])
+            offset += size
+        return cls(header["names"], header["chars"], edges, targets, values)
+
+
+def build_fuzzy_index(phrases: Iterable[Tuple[str, str]]) -> Dict[int, BKTree]:
+    """BK-деревья вариантов написания, отдельно по числу слов во фразе"""
+    by_size: Dict[int, Dict[str, str]] = {}
+    for phrase, name in phrases:
+        by_size.setdefault(len(phrase.split()), {})[phrase] = name
+    return {size: BKTree(items) for size, items in sorted(by_size.items(), reverse=True)}
+
+
+class Vocabulary:
+    """Словари танцев и площадок: точный поиск по дереву и нечёткий по BK-деревьям"""
+
+    __slots__ = ("dances", "locations", "dance_index", "location_index")
+
+    def __init__(self, dances: Trie, locations: Trie):
+        self.dances = dances
+        self.locations = locations
+        self.dance_index = build_fuzzy_index(dances.items())
+        self.location_index = build_fuzzy_index(locations.items())
+
+    @property
+    def location_names(self) -> Set[str]:
+        return set(self.locations.names)
+
+
+def _expand(variants: Dict[str, Iterable[str]]) -> Dict[str, str]:
+    """Фразы для дерева: порождённые формы и ручные варианты (они важнее)"""
+    phrases = {}
+    for name in variants:
+        for form in inflect(name):
+            phrases[form] = name
+    for name, extra in variants.items():
+        for variant in extra:
+            phrases[variant.lower()] = name
+    return phrases
+
+
+def merge_entries(dance_variants: Dict[str, Set[str]], location_variants: Dict[str, Set[str]],
+                  entries: Iterable = ()) -> Tuple[Dict[str, Set[str]], Dict[str, Set[str]]]:
+    """Добавляет к встроенным словарям записи (kind, name, variants) из базы"""
+    dances = {name: set(variants) for name, variants in dance_variants.items()}
+    locations = {name: set(variants) for name, variants in location_variants.items()}
+    for kind, name, variants in entries:
+        target = dances if kind == "dance" else locations
+        extra = {v.strip().lower() for v in (variants or "").split(",") if v.strip()}
+        target.setdefault(name, set()).update(extra)
+    return dances, locations
+
+
+def source_hash(dance_variants: Dict[str, Set[str]], location_variants: Dict[str, Set[str]]) -> str:
+    """Отпечаток исходных словарей и правил: по нему узнаём устаревший файл"""
+    source = {"rules": RULES_VERSION,
+              "dances": {name: sorted(v) for name, v in dance_variants.items()},
+              "locations": {name: sorted(v) for name, v in location_variants.items()}}
+    return hashlib.sha256(json.dumps(source, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+def compile_vocabulary(dance_variants: Dict[str, Set[str]],
+                       location_variants: Dict[str, Set[str]]) -> Vocabulary:
+    """Компилирует словари в деревья"""
+    return Vocabulary(Trie.compile(_expand(dance_variants)), Trie.compile(_expand(location_variants)))
+
+
+def save(vocabulary: Vocabulary, path: str, digest: str):
+    """Записывает словарь в файл: магия, длина заголовка, JSON-заголовок, массивы"""
+    dance_header, dance_body = vocabulary.dances.to_bytes()
+    location_header, location_body = vocabulary.locations.to_bytes()
+    header = json.dumps({
+        "hash": digest,
+        "byteorder": sys.byteorder,
+        "dances": dance_header,
+        "locations": location_header,
+        "dance_body": len(dance_body),
+    }, ensure_ascii=False).encode()
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_MAGIC + struct.pack("<I", len(header)) + header + dance_body + location_body)
+    os.replace(tmp_path, path)
+
+
+def load(path: str, digest: str) -> Optional[Vocabulary]:
+    """Читает словарь из файла; None, если файла нет или он устарел"""
+    try:
+        with open(path, "rb") as f:
+            data = memoryview(f.read())
+    except FileNotFoundError:
+        return None
+
+    if bytes(data[:4]) != _MAGIC:
+        logger.warning(f"{path}: не файл словаря, пересобираю")
+        return None
+    (header_size,) = struct.unpack("<I", data[4:8])
+    header = json.loads(bytes(data[8:8 + header_size]))
+    if header["hash"] != digest or header["byteorder"] != sys.byteorder:
+        logger.info(f"{path}: словарь устарел, пересобираю")
+        return None
+
+    body = data[8 + header_size:]
+    split = header["dance_body"]
+    return Vocabulary(Trie.from_bytes(header["dances"], body[:split]),
+                      Trie.from_bytes(header["locations"], body[split:]))
+
+
+def load_or_compile(dance_variants: Dict[str, Set[str]], location_variants: Dict[str, Set[str]],
+                    path: str = VOCABULARY_PATH) -> Vocabulary:
+    """Словарь из собранного файла, а если его нет или он устарел — собранный в памяти"""
+    digest = source_hash(dance_variants, location_variants)
+    try:
+        vocabulary = load(path, digest)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"Ошибка чтения словаря {path}: {e}")
+        vocabulary = None
+    return vocabulary or compile_vocabulary(dance_variants, location_variants)
+
+
+def main() -> int:
+    from parser import DANCE_VARIANTS, KNOWN_LOCATIONS
+
+    vocabulary = compile_vocabulary(DANCE_VARIANTS, KNOWN_LOCATIONS)
+    save(vocabulary, VOCABULARY_PATH, source_hash(DANCE_VARIANTS, KNOWN_LOCATIONS))
+    print(f"Словарь записан в {VOCABULARY_PATH}: танцев {len(vocabulary.dances.names)} "
+          f"({len(vocabulary.dances)} форм), площадок {len(vocabulary.locations.names)} "
+          f"({len(vocabulary.locations)} форм), {os.path.getsize(VOCABULARY_PATH)} байт")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())